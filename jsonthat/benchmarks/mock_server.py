@@ -0,0 +1,485 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+BATCH_RECORD = re.compile(r"^\[(\d+)\] (.*)$", re.M)
+
+
+class MockSettings:
+    def __init__(
+        self,
+        latency: float = 0.05,
+        token_rate: float = 500.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        load_time: float = 0.0,
+        keep_alive: float = 300.0,
+        parallel: int = 0,
+        structured_outputs: bool = True,
+        malformed_rate: float = 0.0,
+    ):
+        # latency: seconds before the first byte of a response.
+        # token_rate: generated tokens per second, 0 for instantaneous output.
+        # error_rate: fraction of requests answered with a 429 or a 500.
+        # structured_outputs: False to answer requests that constrain the
+        #   output to a schema with a 400, like a model without the feature.
+        # malformed_rate: fraction of the answers to requests that do not
+        #   constrain the output which wrap the JSON in prose.
+        # Like an Ollama server, /api/generate also has:
+        # load_time: seconds to load a model that is not loaded, or loaded
+        #   with another context size.
+        # keep_alive: seconds a model stays loaded after a request that does
+        #   not say otherwise.
+        # parallel: requests generated at once, 0 for no limit; the others
+        #   wait for a slot.
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.structured_outputs = structured_outputs
+        self.malformed_rate = malformed_rate
+        self.load_time = load_time
+        self.keep_alive = keep_alive
+        self.slots = threading.Semaphore(parallel) if parallel else None
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.loads = 0
+        self.prefixes = set()
+        # model -> (context size, time it is unloaded at)
+        self.models: Dict[str, Tuple[Optional[int], float]] = {}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+
+def parse_keep_alive(value: any, default: float) -> float:
+    # Seconds, or a duration such as "5m"; negative for ever.
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r"(-?[\d.]+)(ms|s|m|h)?", value.strip())
+        if not match:
+            return default
+        unit = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2) or "s"]
+        seconds = float(match.group(1)) * unit
+    return float("inf") if seconds < 0 else seconds
+
+
+def extract_input(prompt: str) -> str:
+    marker = "Transform the following text into a JSON format:"
+    if marker in prompt:
+        prompt = prompt.split(marker, 1)[1]
+    return prompt.split("Only output json", 1)[0].strip()
+
+
+def make_output(text: str) -> Dict:
+    records = BATCH_RECORD.findall(text)
+    if records:
+        return {
+            "results": [
+                {"index": int(index), "output": make_output(record)}
+                for index, record in records
+            ]
+        }
+    words = text.split()
+    return {"text": text[:80], "words": len(words), "length": len(text)}
+
+
+def tokenize(text: str) -> List[str]:
+    # About four characters per token, like the estimate used by jt itself.
+    return [text[i : i + 4] for i in range(0, len(text), 4)]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    settings: MockSettings
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+            failed = settings.random.random() < settings.error_rate
+            if failed:
+                settings.errors += 1
+
+        time.sleep(settings.latency)
+        if failed:
+            status = settings.random.choice([429, 500])
+            self._send_json({"error": {"message": "injected error"}}, status)
+            return
+
+        if self.path.endswith("/chat/completions"):
+            self._chat_completions(body)
+        elif self.path.endswith("/messages"):
+            self._messages(body)
+        elif self.path.endswith("/api/generate"):
+            self._generate(body)
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def _prompt_tokens(self, prompt: str) -> int:
+        return len(tokenize(prompt))
+
+    def _cached_tokens(self, prefix: str) -> int:
+        # Simulates provider prompt caching: a prefix seen before is "read
+        # from the cache" and reported as cached tokens.
+        with self.settings.lock:
+            seen = prefix in self.settings.prefixes
+            self.settings.prefixes.add(prefix)
+        return self._prompt_tokens(prefix) if seen else 0
+
+    def _generate_tokens(self, text: str, constrained: bool = False) -> List[str]:
+        output = json.dumps(make_output(extract_input(text)))
+        with self.settings.lock:
+            malformed = self.settings.random.random() < self.settings.malformed_rate
+        if malformed and not constrained:
+            output = f"Here is the JSON you asked for:\n{output}"
+        return tokenize(output)
+
+    def _reject(self, constrained: bool) -> bool:
+        if not constrained or self.settings.structured_outputs:
+            return False
+        with self.settings.lock:
+            self.settings.rejected += 1
+        message = {"message": "structured outputs are not supported"}
+        self._send_json({"error": message}, 400)
+        return True
+
+    def _pace(self, count: int = 1):
+        if self.settings.token_rate:
+            time.sleep(count / self.settings.token_rate)
+
+    def _send_json(self, body: Dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: str):
+        encoded = data.encode()
+        self.wfile.write(f"{len(encoded):x}\r\n".encode() + encoded + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _chat_completions(self, body: Dict):
+        constrained = (body.get("response_format") or {}).get("type") == "json_schema"
+        if self._reject(constrained):
+            return
+        prompt = "\n".join(message["content"] for message in body["messages"])
+        tokens = self._generate_tokens(body["messages"][-1]["content"], constrained)
+        usage = {
+            "prompt_tokens": self._prompt_tokens(prompt),
+            "completion_tokens": len(tokens),
+            "total_tokens": self._prompt_tokens(prompt) + len(tokens),
+        }
+        if body["messages"][0]["role"] == "system":
+            usage["prompt_tokens_details"] = {
+                "cached_tokens": self._cached_tokens(body["messages"][0]["content"])
+            }
+
+        if not body.get("stream"):
+            self._pace(len(tokens))
+            self._send_json(
+                {
+                    "object": "chat.completion",
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(tokens),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+            return
+
+        # OpenAI sends usage in a final chunk without choices when asked to,
+        # Mistral always attaches it to the last content chunk.
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        self._start_stream("text/event-stream")
+        for position, token in enumerate(tokens):
+            self._pace()
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+            if position == len(tokens) - 1 and not include_usage:
+                chunk["usage"] = usage
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        if include_usage:
+            self._write_chunk(
+                f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+            )
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_stream()
+
+    def _messages(self, body: Dict):
+        # A forced tool call answers with the output as the tool input.
+        tool = (body.get("tool_choice") or {}).get("name")
+        if self._reject(tool is not None):
+            return
+        prompt = "\n".join(
+            message["content"]
+            if isinstance(message["content"], str)
+            else "".join(block.get("text", "") for block in message["content"])
+            for message in body["messages"]
+        )
+        tokens = self._generate_tokens(prompt, tool is not None)
+        input_tokens = self._prompt_tokens(prompt)
+        # Only a system prompt marked with cache_control is cached.
+        cache = {}
+        for block in body.get("system") or []:
+            if isinstance(block, dict) and block.get("cache_control"):
+                cached = self._cached_tokens(block["text"])
+                key = (
+                    "cache_read_input_tokens"
+                    if cached
+                    else "cache_creation_input_tokens"
+                )
+                cache[key] = self._prompt_tokens(block["text"])
+
+        block = {"type": "text", "text": ""}
+        delta_type, field = "text_delta", "text"
+        if tool is not None:
+            block = {"type": "tool_use", "id": "toolu_mock", "name": tool, "input": {}}
+            delta_type, field = "input_json_delta", "partial_json"
+        if not body.get("stream"):
+            self._pace(len(tokens))
+            if tool is not None:
+                block["input"] = json.loads("".join(tokens))
+            else:
+                block["text"] = "".join(tokens)
+            self._send_json(
+                {
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body["model"],
+                    "content": [block],
+                    "stop_reason": "tool_use" if tool else "end_turn",
+                    "usage": {
+                        "input_tokens": input_tokens,
+                        "output_tokens": len(tokens),
+                        **cache,
+                    },
+                }
+            )
+            return
+
+        def event(name: str, data: Dict):
+            self._write_chunk(f"event: {name}\ndata: {json.dumps(data)}\n\n")
+
+        self._start_stream("text/event-stream")
+        event(
+            "message_start",
+            {
+                "type": "message_start",
+                "message": {
+                    "usage": {
+                        "input_tokens": input_tokens,
+                        "output_tokens": 1,
+                        **cache,
+                    }
+                },
+            },
+        )
+        event(
+            "content_block_start",
+            {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": block,
+            },
+        )
+        for token in tokens:
+            self._pace()
+            event(
+                "content_block_delta",
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": delta_type, field: token},
+                },
+            )
+        event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        event(
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "tool_use" if tool else "end_turn"},
+                "usage": {"output_tokens": len(tokens)},
+            },
+        )
+        event("message_stop", {"type": "message_stop"})
+        self._end_stream()
+
+    def _load_model(self, body: Dict):
+        settings = self.settings
+        model = body.get("model")
+        num_ctx = (body.get("options") or {}).get("num_ctx")
+        with settings.load_lock:
+            loaded = settings.models.get(model)
+            if not loaded or loaded[0] != num_ctx or loaded[1] < time.monotonic():
+                time.sleep(settings.load_time)
+                with settings.lock:
+                    settings.loads += 1
+            # Kept loaded while in use.
+            settings.models[model] = (num_ctx, float("inf"))
+
+    def _unload_after(self, body: Dict):
+        settings = self.settings
+        keep_alive = parse_keep_alive(body.get("keep_alive"), settings.keep_alive)
+        with settings.load_lock:
+            num_ctx, _ = settings.models[body.get("model")]
+            settings.models[body.get("model")] = (
+                num_ctx,
+                time.monotonic() + keep_alive,
+            )
+
+    def _generate(self, body: Dict):
+        if self._reject(isinstance(body.get("format"), dict)):
+            return
+        self._load_model(body)
+        if not body.get("prompt"):
+            # A request without a prompt only loads the model.
+            self._unload_after(body)
+            self._send_json({"model": body["model"], "done": True})
+            return
+        slots = self.settings.slots
+        if slots:
+            slots.acquire()
+        try:
+            self._generate_response(body)
+        finally:
+            if slots:
+                slots.release()
+            self._unload_after(body)
+
+    def _generate_response(self, body: Dict):
+        tokens = self._generate_tokens(
+            body["prompt"], isinstance(body.get("format"), dict)
+        )
+        counts = {
+            "prompt_eval_count": self._prompt_tokens(body["prompt"]),
+            "eval_count": len(tokens),
+        }
+
+        if not body.get("stream", True):
+            self._pace(len(tokens))
+            self._send_json(
+                {
+                    "model": body["model"],
+                    "response": "".join(tokens),
+                    "done": True,
+                    **counts,
+                }
+            )
+            return
+
+        self._start_stream("application/x-ndjson")
+        for token in tokens:
+            self._pace()
+            line = {"model": body["model"], "response": token, "done": False}
+            self._write_chunk(json.dumps(line) + "\n")
+        final = {"model": body["model"], "response": "", "done": True, **counts}
+        self._write_chunk(json.dumps(final) + "\n")
+        self._end_stream()
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    # Room for the burst of connections opened by hundreds of concurrent
+    # requests: with the default backlog of 5, most would wait for a SYN
+    # retry and the benchmarks would measure that instead.
+    request_queue_size = 1024
+
+
+class MockLLMServer:
+    # Serves the OpenAI, Mistral (/v1/chat/completions), Anthropic
+    # (/v1/messages) and Ollama (/api/generate) wire formats on localhost.
+
+    def __init__(self, settings: Optional[MockSettings] = None, port: int = 0):
+        self.settings = settings or MockSettings()
+        handler = type("Handler", (MockLLMHandler,), {"settings": self.settings})
+        self.httpd = MockHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self) -> "MockLLMServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the mock LLM server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-rate", type=float, default=500.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--load-time", type=float, default=0.0)
+    parser.add_argument("--keep-alive", type=float, default=300.0)
+    parser.add_argument("--parallel", type=int, default=0)
+    parser.add_argument("--no-structured-outputs", action="store_true")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        args.latency,
+        args.token_rate,
+        args.error_rate,
+        load_time=args.load_time,
+        keep_alive=args.keep_alive,
+        parallel=args.parallel,
+        structured_outputs=not args.no_structured_outputs,
+        malformed_rate=args.malformed_rate,
+    )
+    server = MockLLMServer(settings, args.port)
+    print(f"Mock LLM server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
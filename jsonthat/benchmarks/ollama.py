@@ -0,0 +1,77 @@
+import argparse
+import time
+from typing import Dict, List
+
+from jsonthat.main import OllamaProvider, transform_lines
+
+from .mock_server import MockLLMServer, MockSettings
+from .run import make_lines
+
+# Records arrive in bursts with idle gaps between them, as from cron, against
+# an Ollama stand-in that takes load_time to load a model, unloads it after
+# its default keep-alive and generates `parallel` requests at once.
+
+MODES = [
+    ("default", {}, False),
+    ("keep-alive", {"keep_alive": "1h"}, False),
+    ("keep-alive+parallel", {"keep_alive": "1h"}, True),
+    ("tuned", {"keep_alive": "1h", "num_ctx": "auto", "preload": True}, True),
+]
+
+
+def run_mode(
+    settings: MockSettings, options: Dict, parallel: bool, args: argparse.Namespace
+) -> List[float]:
+    with MockLLMServer(settings) as server:
+        provider = OllamaProvider(server.url, "mock", **options)
+        if provider.preload:
+            provider.warm_up()
+            # As jt would, from when it starts: the first burst comes later.
+            time.sleep(args.gap)
+        concurrency = args.parallel if parallel else 1
+        bursts = []
+        for burst in range(args.bursts):
+            lines = make_lines(args.records)
+            start = time.perf_counter()
+            list(transform_lines(provider, lines, concurrency=concurrency))
+            bursts.append(time.perf_counter() - start)
+            time.sleep(args.gap)
+        provider.close()
+    return bursts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the Ollama keep-alive, preload and parallel settings"
+    )
+    parser.add_argument("--bursts", type=int, default=4)
+    parser.add_argument("--records", type=int, default=16)
+    parser.add_argument("--gap", type=float, default=0.6)
+    parser.add_argument("--load-time", type=float, default=0.5)
+    parser.add_argument("--server-keep-alive", type=float, default=0.3)
+    parser.add_argument("--parallel", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--token-rate", type=float, default=300.0)
+    args = parser.parse_args()
+
+    print(
+        f"{args.bursts} bursts of {args.records} records, {args.gap}s apart; model "
+        f"load {args.load_time}s, unloaded after {args.server_keep_alive}s idle, "
+        f"{args.parallel} parallel slots"
+    )
+    print(f"{'mode':<20} {'first burst':>12} {'other bursts':>13} {'loads':>6}")
+    for name, options, parallel in MODES:
+        settings = MockSettings(
+            latency=args.latency,
+            token_rate=args.token_rate,
+            load_time=args.load_time,
+            keep_alive=args.server_keep_alive,
+            parallel=args.parallel,
+        )
+        bursts = run_mode(settings, options, parallel, args)
+        rest = sum(bursts[1:]) / max(len(bursts) - 1, 1)
+        print(f"{name:<20} {bursts[0]:>11.2f}s {rest:>12.2f}s {settings.loads:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import yaml
+
+from .mock_server import MockLLMServer, MockSettings
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROVIDERS = ["openai", "mistral", "claude", "ollama"]
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "timestamp": {"type": "string"},
+        "user": {"type": "string"},
+        "action": {"type": "string"},
+        "ip": {"type": "string"},
+    },
+}
+
+# name, extra jt arguments, whether the input is split into lines
+SCENARIOS = [
+    ("single", [], False),
+    ("single+schema", ["--schema", "{schema}"], False),
+    ("stream", ["--stream"], False),
+    ("line", ["--line"], True),
+    ("line+schema", ["--line", "--schema", "{schema}"], True),
+    ("line+stream", ["--line", "--stream"], True),
+    ("line+concurrency", ["--line", "--concurrency", "8"], True),
+    (
+        "line+asyncio",
+        ["--line", "--concurrency", "100", "--engine", "asyncio"],
+        True,
+    ),
+    ("line+batch", ["--line", "--batch-size", "10"], True),
+]
+
+
+def make_lines(count: int) -> List[str]:
+    return [
+        f"2024-05-01T12:{i // 60 % 60:02d}:{i % 60:02d}Z user{i} logged in "
+        f"from 10.0.{i // 256 % 256}.{i % 256}"
+        for i in range(count)
+    ]
+
+
+def write_config(directory: str, server_url: str) -> Dict[str, str]:
+    config = {
+        "providers": {
+            "openai": {"api_key": "mock", "api_base": f"{server_url}/v1"},
+            "mistral": {"api_key": "mock", "api_base": f"{server_url}/v1"},
+            "claude": {"api_key": "mock", "api_base": f"{server_url}/v1"},
+            "ollama": {"api_url": server_url},
+        },
+        "default_provider": "openai",
+    }
+    config_dir = os.path.join(directory, "config")
+    os.makedirs(os.path.join(config_dir, "jsonthat"), exist_ok=True)
+    with open(os.path.join(config_dir, "jsonthat", "config.yaml"), "w") as f:
+        yaml.dump(config, f)
+
+    schema_path = os.path.join(directory, "schema.json")
+    with open(schema_path, "w") as f:
+        json.dump(SCHEMA, f)
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("LLM_PROVIDER", "LLM_API_KEY", "LLM_MODEL", "LLM_API_BASE")
+        and not key.startswith("OLLAMA_")
+    }
+    env.update(
+        {
+            "XDG_CONFIG_HOME": config_dir,
+            "XDG_CACHE_HOME": os.path.join(directory, "cache"),
+            "PYTHONPATH": PROJECT_DIR,
+        }
+    )
+    return {"env": env, "schema": schema_path}
+
+
+def run_jt(
+    provider: str,
+    arguments: List[str],
+    input_text: str,
+    setup: Dict,
+    report_path: str,
+) -> Dict:
+    command = [
+        sys.executable,
+        "-m",
+        "jsonthat.main",
+        "--provider",
+        provider,
+        "--no-cache",
+        "--usage-json",
+        report_path,
+    ] + [argument.format(schema=setup["schema"]) for argument in arguments]
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        command,
+        input=input_text,
+        capture_output=True,
+        text=True,
+        env=setup["env"],
+        cwd=PROJECT_DIR,
+    )
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"jt {' '.join(command[3:])} failed:\n{process.stderr.strip()}"
+        )
+
+    with open(report_path) as f:
+        report = json.load(f)
+    return {
+        "wall_time": wall_time,
+        "records": report["records"],
+        "requests": report["requests"],
+        "latency_p50": report["latency"]["p50"],
+        "latency_p95": report["latency"]["p95"],
+        "ttft_p50": report["time_to_first_token"]["p50"],
+    }
+
+
+def run_benchmarks(
+    providers: List[str],
+    scenarios: List[str],
+    lines: int,
+    repeat: int,
+    settings: MockSettings,
+) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as directory, MockLLMServer(settings) as server:
+        setup = write_config(directory, server.url)
+        line_input = "\n".join(make_lines(lines)) + "\n"
+        single_input = make_lines(1)[0] + "\n"
+        report_path = os.path.join(directory, "usage.json")
+
+        for provider in providers:
+            for name, arguments, line_mode in SCENARIOS:
+                if name not in scenarios:
+                    continue
+                runs = [
+                    run_jt(
+                        provider,
+                        arguments,
+                        line_input if line_mode else single_input,
+                        setup,
+                        report_path,
+                    )
+                    for _ in range(repeat)
+                ]
+                wall_time = statistics.median(run["wall_time"] for run in runs)
+                records = runs[0]["records"]
+                results.append(
+                    {
+                        "provider": provider,
+                        "scenario": name,
+                        "wall_time": wall_time,
+                        "records": records,
+                        "requests": runs[0]["requests"],
+                        "records_per_second": records / wall_time,
+                        "latency_p50": statistics.median(
+                            run["latency_p50"] or 0 for run in runs
+                        ),
+                        "latency_p95": statistics.median(
+                            run["latency_p95"] or 0 for run in runs
+                        ),
+                        "ttft_p50": statistics.median(
+                            run["ttft_p50"] or 0 for run in runs
+                        ),
+                    }
+                )
+    return results
+
+
+def print_table(results: List[Dict], baseline: Optional[Dict] = None):
+    header = (
+        f"{'provider':<9} {'scenario':<17} {'wall (s)':>9} {'records/s':>10} "
+        f"{'requests':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'ttft (s)':>9}"
+    )
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        line = (
+            f"{result['provider']:<9} {result['scenario']:<17} "
+            f"{result['wall_time']:>9.3f} {result['records_per_second']:>10.1f} "
+            f"{result['requests']:>9} {result['latency_p50']:>8.3f} "
+            f"{result['latency_p95']:>8.3f} {result['ttft_p50']:>9.3f}"
+        )
+        if baseline:
+            base = baseline.get((result["provider"], result["scenario"]))
+            if base:
+                change = result["wall_time"] / base["wall_time"] - 1
+                line += f" {change:>+8.1%}"
+        print(line)
+
+
+def load_baseline(path: str) -> Dict:
+    with open(path) as f:
+        return {
+            (result["provider"], result["scenario"]): result
+            for result in json.load(f)["results"]
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark jt end to end against a local mock LLM server"
+    )
+    parser.add_argument(
+        "--providers",
+        default=",".join(PROVIDERS),
+        help="Comma separated providers to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(name for name, _, _ in SCENARIOS),
+        help="Comma separated scenarios to run (default: all)",
+    )
+    parser.add_argument(
+        "--lines", type=int, default=50, help="Lines of input in --line scenarios"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per scenario, median is reported"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Mock time to first byte (s)"
+    )
+    parser.add_argument(
+        "--token-rate", type=float, default=500.0, help="Mock tokens per second"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Mock fraction of errors"
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument(
+        "--baseline", help="Compare against results previously written by --output"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Fail if a scenario is this much slower than the baseline (default: 0.2)",
+    )
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.token_rate, args.error_rate, seed=0)
+    results = run_benchmarks(
+        args.providers.split(","),
+        args.scenarios.split(","),
+        args.lines,
+        args.repeat,
+        settings,
+    )
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": {
+                        "lines": args.lines,
+                        "latency": args.latency,
+                        "token_rate": args.token_rate,
+                        "error_rate": args.error_rate,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if baseline:
+        regressions = [
+            result
+            for result in results
+            if (result["provider"], result["scenario"]) in baseline
+            and result["wall_time"]
+            > baseline[(result["provider"], result["scenario"])]["wall_time"]
+            * (1 + args.max_regression)
+        ]
+        for result in regressions:
+            print(
+                f"Regression: {result['provider']} {result['scenario']}",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
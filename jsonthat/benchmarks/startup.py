@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(
+    arguments: List[str], env: Dict[str, str]
+) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable] + arguments,
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=PROJECT_DIR,
+    )
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, int]]:
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_time, cumulative, name = line[len("import time:") :].split("|")
+            modules[name.strip()] = {
+                "self": int(self_time),
+                "cumulative": int(cumulative),
+            }
+        except ValueError:
+            continue  # header line
+    return modules
+
+
+def measure(runs: int) -> Dict:
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+
+    import_times = []
+    modules = {}
+    for _ in range(runs):
+        process = run_python(["-X", "importtime", "-c", "import jsonthat.main"], env)
+        modules = parse_importtime(process.stderr)
+        import_times.append(modules["jsonthat.main"]["cumulative"] / 1e6)
+
+    def wall_time(arguments: List[str]) -> float:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_python(arguments, env)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    loaded = run_python(
+        [
+            "-c",
+            "import sys, jsonthat.main; "
+            "print(','.join(m for m in ('requests', 'yaml', 'urllib3') "
+            "if m in sys.modules))",
+        ],
+        env,
+    ).stdout.strip()
+
+    slowest = sorted(modules.items(), key=lambda item: item[1]["self"], reverse=True)
+    return {
+        "import_jsonthat_main": statistics.median(import_times),
+        "python_startup": wall_time(["-c", "pass"]),
+        "jt_version": wall_time(["-m", "jsonthat.main", "--version"]),
+        "heavy_modules_loaded": [name for name in loaded.split(",") if name],
+        "slowest_imports": [
+            {"module": name, "self": times["self"] / 1e6}
+            for name, times in slowest[:10]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure jt startup time")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per measurement")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    print(f"import jsonthat.main:  {result['import_jsonthat_main'] * 1000:7.1f} ms")
+    print(f"python -c pass:        {result['python_startup'] * 1000:7.1f} ms")
+    print(f"jt --version:          {result['jt_version'] * 1000:7.1f} ms")
+    print(
+        "heavy modules loaded:  "
+        + (", ".join(result["heavy_modules_loaded"]) or "none")
+    )
+    print("slowest imports (self time):")
+    for entry in result["slowest_imports"]:
+        print(f"  {entry['self'] * 1000:7.2f} ms  {entry['module']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
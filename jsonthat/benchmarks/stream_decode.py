@@ -0,0 +1,230 @@
+import argparse
+import json
+import time
+from statistics import median
+from typing import Callable, Dict, Iterator, List
+
+import requests
+
+from jsonthat.main import ClaudeProvider, OllamaProvider, OpenAIProvider
+from jsonthat.usage import RequestUsage
+
+from .mock_server import tokenize
+
+
+class PacketStream:
+    # Stands in for response.raw: the body arrives in packets, one per event
+    # like an LLM stream, and read() waits for a full buffer like urllib3.
+
+    def __init__(self, packets: List[bytes]):
+        self.packets = list(reversed(packets))
+        self.pending = b""
+
+    def _next(self) -> bytes:
+        if not self.pending and self.packets:
+            self.pending = self.packets.pop()
+        return self.pending
+
+    def read1(self, size: int = -1) -> bytes:
+        data = self._next()
+        size = len(data) if size < 0 else size
+        chunk, self.pending = data[:size], data[size:]
+        return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while size < 0 or sum(map(len, chunks)) < size:
+            chunk = self.read1(-1 if size < 0 else size - sum(map(len, chunks)))
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+def openai_packets(tokens: List[str]) -> List[bytes]:
+    # Shaped like the chunks the API sends, metadata included.
+    chunk = {
+        "id": "chatcmpl-AbCdEfGhIjKlMnOpQrStUvWxYz012",
+        "object": "chat.completion.chunk",
+        "created": 1760000000,
+        "model": "gpt-4o-mini-2024-07-18",
+        "system_fingerprint": "fp_0123456789",
+    }
+    packets = [
+        "data: "
+        + json.dumps(
+            {
+                **chunk,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": token},
+                        "logprobs": None,
+                        "finish_reason": None,
+                    }
+                ],
+            }
+        )
+        + "\n\n"
+        for token in tokens
+    ]
+    usage = {"prompt_tokens": 10, "completion_tokens": len(tokens)}
+    packets.append(f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n")
+    packets.append("data: [DONE]\n\n")
+    return [packet.encode() for packet in packets]
+
+
+def claude_packets(tokens: List[str]) -> List[bytes]:
+    def event(name: str, data: Dict) -> bytes:
+        return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode()
+
+    return (
+        [event("message_start", {"message": {"usage": {"input_tokens": 10}}})]
+        + [
+            event(
+                "content_block_delta",
+                {"index": 0, "delta": {"type": "text_delta", "text": token}},
+            )
+            for token in tokens
+        ]
+        + [
+            event("message_delta", {"usage": {"output_tokens": len(tokens)}}),
+            event("message_stop", {}),
+        ]
+    )
+
+
+def ollama_packets(tokens: List[str]) -> List[bytes]:
+    lines = [
+        {
+            "model": "llama3.1",
+            "created_at": "2026-10-18T12:00:00.000000Z",
+            "response": token,
+            "done": False,
+        }
+        for token in tokens
+    ]
+    lines.append(
+        {"model": "llama3.1", "response": "", "done": True, "eval_count": len(tokens)}
+    )
+    return [(json.dumps(line) + "\n").encode() for line in lines]
+
+
+def line_based_openai(response: requests.Response) -> Iterator[str]:
+    # The per-provider decoder used before the shared one, kept as baseline.
+    for line in response.iter_lines():
+        if line:
+            line = line.decode("utf-8")
+            if line.startswith("data: "):
+                line = line[6:]
+                if line.strip() == "[DONE]":
+                    break
+                try:
+                    json_response = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                choices = json_response.get("choices")
+                if choices:
+                    content = choices[0]["delta"].get("content", "")
+                    if content:
+                        yield content
+
+
+def line_based_claude(response: requests.Response) -> Iterator[str]:
+    for line in response.iter_lines():
+        if line:
+            line = line.decode("utf-8")
+            if line.startswith("event: message_stop"):
+                break
+            if line.startswith("data: "):
+                try:
+                    json_response = json.loads(line[6:])
+                except json.JSONDecodeError:
+                    continue
+                if json_response.get("type") == "content_block_delta":
+                    text = json_response.get("delta", {}).get("text")
+                    if text:
+                        yield text
+
+
+def line_based_ollama(response: requests.Response) -> Iterator[str]:
+    for line in response.iter_lines():
+        if line:
+            json_response = json.loads(line.decode("utf-8"))
+            if json_response.get("done", False):
+                break
+            if json_response.get("response"):
+                yield json_response["response"]
+
+
+def coalesce(packets: List[bytes], burst: int) -> List[bytes]:
+    # Several events per read, as when tokens arrive faster than they are read.
+    return [b"".join(packets[i : i + burst]) for i in range(0, len(packets), burst)]
+
+
+def make_response(packets: List[bytes]) -> requests.Response:
+    response = requests.Response()
+    response.raw = PacketStream(packets)
+    response.status_code = 200
+    return response
+
+
+def measure(decode: Callable, packets: List[bytes], tokens: int) -> float:
+    response = make_response(packets)
+    start = time.perf_counter()
+    count = sum(1 for _ in decode(response))
+    elapsed = time.perf_counter() - start
+    assert count == tokens, count
+    return elapsed / tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the CPU cost per streamed token of the stream decoders"
+    )
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--burst", type=int, default=16)
+    args = parser.parse_args()
+
+    text = json.dumps({"text": "lorem ipsum dolor sit amet " * (args.tokens // 6)})
+    tokens = tokenize(text)[: args.tokens]
+
+    cases = [
+        ("openai", openai_packets, line_based_openai, OpenAIProvider("key")),
+        ("claude", claude_packets, line_based_claude, ClaudeProvider("key")),
+        ("ollama", ollama_packets, line_based_ollama, OllamaProvider()),
+    ]
+    print(
+        f"{'format':<8} {'events/read':>11} "
+        f"{'line-based (us/token)':>22} {'shared (us/token)':>18}"
+    )
+    for name, make_packets, baseline, provider in cases:
+        for burst in (1, args.burst):
+            packets = coalesce(make_packets(tokens), burst)
+            before, after = [], []
+            # The two decoders take turns, so that a slow patch of the
+            # machine weighs on both, and the medians are reported.
+            for _ in range(args.repeat):
+                before.append(measure(baseline, packets, len(tokens)))
+                after.append(
+                    measure(
+                        lambda response: provider._stream_response(
+                            response, RequestUsage()
+                        ),
+                        packets,
+                        len(tokens),
+                    )
+                )
+            before, after = median(before), median(after)
+            print(f"{name:<8} {burst:>11} {before * 1e6:>22.2f} {after * 1e6:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import json
+import time
+
+from jsonthat.main import ClaudeProvider, OllamaProvider, OpenAIProvider
+from jsonthat.usage import UsageTracker
+
+from .mock_server import MockLLMServer, MockSettings
+from .run import make_lines
+
+# A schema given only in the prompt leaves the model free to wrap its JSON in
+# prose, which fails to parse and costs the record, or another request for
+# it. The mock server answers a fraction of such requests that way, and
+# always with JSON when the output is constrained to the schema.
+
+SCHEMA = "text: string\nwords: integer\nlength: integer"
+
+
+def make_provider(name: str, url: str):
+    if name == "openai":
+        return OpenAIProvider("mock", api_base=f"{url}/v1")
+    if name == "claude":
+        return ClaudeProvider("mock", api_base=f"{url}/v1")
+    return OllamaProvider(url, "mock")
+
+
+def run_mode(name: str, structured: bool, args: argparse.Namespace) -> dict:
+    settings = MockSettings(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        malformed_rate=args.malformed_rate,
+        seed=1,
+    )
+    with MockLLMServer(settings) as server:
+        provider = make_provider(name, server.url)
+        provider.structured_outputs = structured
+        provider.usage_tracker = UsageTracker()
+        failed = 0
+        start = time.perf_counter()
+        for line in make_lines(args.records):
+            # A record that does not parse is asked for again, up to retries
+            # times, as a rerun of the failed records would.
+            for _ in range(args.retries + 1):
+                try:
+                    provider.transform_text_to_json(line, SCHEMA)
+                    break
+                except json.JSONDecodeError:
+                    continue
+            else:
+                failed += 1
+        elapsed = time.perf_counter() - start
+        provider.close()
+    summary = provider.usage_tracker.summary()
+    return {
+        "seconds": elapsed,
+        "requests": settings.requests,
+        "failed": failed,
+        "completion_tokens": summary["completion_tokens"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare prompt-only and constrained structured output"
+    )
+    parser.add_argument("--providers", default="openai,claude,ollama")
+    parser.add_argument("--records", type=int, default=200)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(
+        f"{args.records} records, {args.malformed_rate:.0%} of unconstrained answers "
+        f"malformed, {args.retries} retries"
+    )
+    print(
+        f"{'provider':<8} {'mode':<11} {'time':>7} {'requests':>9} "
+        f"{'failed':>7} {'output tokens':>14}"
+    )
+    for name in args.providers.split(","):
+        for mode, structured in [("prompt", False), ("structured", True)]:
+            result = run_mode(name, structured, args)
+            print(
+                f"{name:<8} {mode:<11} {result['seconds']:>6.2f}s "
+                f"{result['requests']:>9} {result['failed']:>7} "
+                f"{result['completion_tokens']:>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from typing import TYPE_CHECKING
+
+from .version import __version__
+
+# The client is only imported when used, so that `jt` does not pay for it.
+if TYPE_CHECKING:
+    from .client import AsyncClient, Client, TransformError
+    from .schema import InvalidOutput
+
+__all__ = ["AsyncClient", "Client", "InvalidOutput", "TransformError", "__version__"]
+
+
+def __getattr__(name: str):
+    if name in ("AsyncClient", "Client", "TransformError"):
+        from . import client
+
+        return getattr(client, name)
+    if name == "InvalidOutput":
+        from .schema import InvalidOutput
+
+        return InvalidOutput
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
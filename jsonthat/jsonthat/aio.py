@@ -0,0 +1,152 @@
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import AsyncIterator, Iterable, List, Optional, Tuple, Union
+
+from .base import LLMProvider
+from .dedupe import RecordCoalescer
+from .main import invalid_output, output_errors, pack_batches
+from .prompts import build_retry_prompt
+from .schema import DEFAULT_SCHEMA_RETRIES, CompiledSchema, InvalidOutput
+
+# The asyncio counterparts of transform_batch() and transform_lines(): every
+# request is a task on one event loop rather than a call on a worker thread,
+# so that hundreds of them can be in flight at once.
+
+
+async def transform_record_async(
+    provider: LLMProvider,
+    text: str,
+    schema: Optional[str],
+    validator: Optional[CompiledSchema],
+) -> Union[dict[str, any], json.JSONDecodeError]:
+    try:
+        return await provider.transform_text_to_json_async(text, schema)
+    except json.JSONDecodeError as error:
+        if validator is None:
+            raise
+        return error
+
+
+async def validate_output_async(
+    provider: LLMProvider,
+    text: str,
+    output: Union[dict[str, any], json.JSONDecodeError],
+    schema: Optional[str],
+    validator: CompiledSchema,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+) -> Union[dict[str, any], InvalidOutput]:
+    errors = output_errors(output, validator)
+    for _ in range(retries):
+        if not errors:
+            break
+        output = await transform_record_async(
+            provider.uncached, build_retry_prompt(text, errors), schema, validator
+        )
+        errors = output_errors(output, validator)
+    return invalid_output(text, output, errors) if errors else output
+
+
+async def transform_batch_async(
+    provider: LLMProvider,
+    texts: List[str],
+    schema: Optional[str] = None,
+    validator: Optional[CompiledSchema] = None,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+) -> List[Union[dict[str, any], InvalidOutput]]:
+    if len(texts) == 1:
+        outputs = [await transform_record_async(provider, texts[0], schema, validator)]
+    else:
+        try:
+            outputs = await provider.transform_batch_to_json_async(texts, schema)
+        except json.JSONDecodeError:
+            middle = len(texts) // 2
+            return await transform_batch_async(
+                provider, texts[:middle], schema, validator, retries
+            ) + await transform_batch_async(
+                provider, texts[middle:], schema, validator, retries
+            )
+
+        outputs = [
+            output
+            if output is not None
+            else await transform_record_async(provider, text, schema, validator)
+            for text, output in zip(texts, outputs)
+        ]
+
+    if validator is None:
+        return outputs
+    return [
+        await validate_output_async(provider, text, output, schema, validator, retries)
+        for text, output in zip(texts, outputs)
+    ]
+
+
+async def transform_lines_async(
+    provider: LLMProvider,
+    lines: Iterable[str],
+    schema: Optional[str] = None,
+    concurrency: int = 1,
+    ordered: bool = True,
+    batch_size: int = 1,
+    batch_tokens: int = 4000,
+    validator: Optional[CompiledSchema] = None,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+    keyed: bool = False,
+    coalescer: Optional[RecordCoalescer] = None,
+) -> AsyncIterator[Union[dict[str, any], InvalidOutput]]:
+    pairs = lines if keyed else ((None, line) for line in lines)
+    batches = pack_batches(pairs, batch_size, batch_tokens, key=itemgetter(1))
+
+    async def transform(texts: List[str]):
+        return await transform_batch_async(provider, texts, schema, validator, retries)
+
+    async def run(batch: List[Tuple[any, str]]):
+        keys, texts = zip(*batch)
+        if coalescer is not None:
+            outputs = await coalescer.run_async(list(texts), transform)
+        else:
+            outputs = await transform(list(texts))
+        return list(zip(keys, outputs)) if keyed else outputs
+
+    async def completed() -> list:
+        if ordered:
+            return await in_flight.popleft()
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        results = []
+        for task in done:
+            in_flight.remove(task)
+            results.extend(task.result())
+        return results
+
+    # At most `concurrency` batches are in flight, and none is read from the
+    # input until a slot is free. As the caller writes each result before
+    # asking for the next one, a slow reader of the output holds up the
+    # event loop and with it the sending of new requests. The input is read
+    # on a thread of its own, so that a slow one does not.
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(1, thread_name_prefix="jt-input")
+    batches = iter(batches)
+    in_flight = deque() if ordered else set()
+    try:
+        while (
+            batch := await loop.run_in_executor(reader, next, batches, None)
+        ) is not None:
+            if len(in_flight) >= concurrency:
+                for result in await completed():
+                    yield result
+            task = asyncio.ensure_future(run(batch))
+            if ordered:
+                in_flight.append(task)
+            else:
+                in_flight.add(task)
+
+        while in_flight:
+            for result in await completed():
+                yield result
+    finally:
+        for task in in_flight:
+            task.cancel()
+        reader.shutdown(wait=False)
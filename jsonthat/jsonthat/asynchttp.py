@@ -0,0 +1,314 @@
+import asyncio
+import json
+import socket
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .streaming import READ_SIZE
+from .version import __version__
+
+# A minimal HTTP/1.1 client on asyncio streams, enough for JSON APIs: POST
+# with a JSON body, keep-alive connection pools, and content-length, chunked
+# or read-until-close response bodies. Errors are raised as the requests
+# exceptions the blocking path raises, so that callers handle both alike.
+
+MAX_HEADER_SIZE = 64 * 1024
+
+Origin = Tuple[str, str, int]
+
+
+def connection_error(error: Exception):
+    import requests
+
+    if isinstance(error, TimeoutError):
+        return requests.ReadTimeout("Read timed out")
+    return requests.ConnectionError(f"{type(error).__name__}: {error}")
+
+
+class AsyncResponse:
+    def __init__(
+        self,
+        session: "AsyncSession",
+        origin: Origin,
+        url: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        read_timeout: Optional[float] = None,
+    ):
+        self.session = session
+        self.origin = origin
+        self.url = url
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+        self.status_code = 0
+        self.reason = ""
+        self.headers = None
+        self.elapsed = timedelta(0)
+        self.content: Optional[bytes] = None
+        self._keep_alive = True
+        self._released = False
+
+    async def _wait(self, read):
+        # Raises TimeoutError when the server sends nothing for read_timeout.
+        async with asyncio.timeout(self.read_timeout):
+            return await read
+
+    async def _read_head(self):
+        from requests.structures import CaseInsensitiveDict
+
+        # Headers longer than the stream limit raise LimitOverrunError.
+        head = await self._wait(self.reader.readuntil(b"\r\n\r\n"))
+        status_line, *lines = head.decode("latin-1").split("\r\n")
+        version, status, *reason = status_line.split(" ", 2)
+        self.status_code = int(status)
+        self.reason = reason[0] if reason else ""
+        self.headers = CaseInsensitiveDict()
+        for line in lines:
+            if line:
+                name, _, value = line.partition(":")
+                self.headers[name.strip()] = value.strip()
+        connection = self.headers.get("connection", "").lower()
+        self._keep_alive = connection != "close" and (
+            version == "HTTP/1.1" or connection == "keep-alive"
+        )
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        # Yields the body as it arrives, at most READ_SIZE bytes at a time.
+        if self.content is not None:
+            if self.content:
+                yield self.content
+            return
+        try:
+            if "chunked" in self.headers.get("transfer-encoding", "").lower():
+                while True:
+                    size = int(
+                        (await self._wait(self.reader.readuntil(b"\r\n"))).split(b";")[
+                            0
+                        ],
+                        16,
+                    )
+                    if size == 0:
+                        # Trailers, if any, end with an empty line.
+                        while (
+                            await self._wait(self.reader.readuntil(b"\r\n")) != b"\r\n"
+                        ):
+                            pass
+                        break
+                    while size:
+                        data = await self._wait(self.reader.read(min(size, READ_SIZE)))
+                        if not data:
+                            raise asyncio.IncompleteReadError(b"", size)
+                        size -= len(data)
+                        yield data
+                    await self._wait(self.reader.readexactly(2))
+            elif "content-length" in self.headers:
+                remaining = int(self.headers["content-length"])
+                while remaining:
+                    data = await self._wait(self.reader.read(min(remaining, READ_SIZE)))
+                    if not data:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    remaining -= len(data)
+                    yield data
+            else:
+                self._keep_alive = False
+                while data := await self._wait(self.reader.read(READ_SIZE)):
+                    yield data
+        except (
+            OSError,
+            ValueError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ) as e:
+            self.close()
+            raise connection_error(e)
+        except BaseException:
+            # Cancelled, or no longer read: the connection is dropped and its
+            # slot given back.
+            self.close()
+            raise
+        self.release()
+
+    async def aread(self) -> bytes:
+        if self.content is None:
+            chunks = [chunk async for chunk in self.aiter_chunks()]
+            self.content = b"".join(chunks)
+        return self.content
+
+    def json(self) -> any:
+        return json.loads(self.content)
+
+    @property
+    def text(self) -> str:
+        return (self.content or b"").decode("utf-8", errors="replace")
+
+    def raise_for_status(self):
+        import requests
+
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                f"{self.status_code} Error: {self.reason} for url: {self.url}",
+                response=self,
+            )
+
+    def release(self):
+        # Hands the connection back to the pool once the body has been read.
+        if self._released:
+            return
+        self._released = True
+        self.session._release(self.origin, self.reader, self.writer, self._keep_alive)
+
+    def close(self):
+        # Drops the connection if the body has not been read to the end.
+        if not self._released:
+            self._keep_alive = False
+            self.release()
+
+
+class AsyncSession:
+    def __init__(self, pool_size: int = 10):
+        # Connections belong to the event loop they were opened on.
+        self.loop = asyncio.get_running_loop()
+        self.pool_size = pool_size
+        self._idle: Dict[
+            Origin, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]
+        ] = {}
+        self._slots: Dict[Origin, asyncio.Semaphore] = {}
+        self._ssl = None
+
+    def _ssl_context(self):
+        if self._ssl is None:
+            import ssl
+
+            self._ssl = ssl.create_default_context()
+        return self._ssl
+
+    async def _connect(self, origin: Origin, timeout: Optional[float] = None):
+        import requests
+
+        scheme, host, port = origin
+        idle = self._idle.get(origin)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        try:
+            async with asyncio.timeout(timeout):
+                reader, writer = await asyncio.open_connection(
+                    host,
+                    port,
+                    ssl=self._ssl_context() if scheme == "https" else None,
+                    limit=MAX_HEADER_SIZE,
+                )
+        except TimeoutError:
+            raise requests.ConnectTimeout(f"Connection to {host}:{port} timed out")
+        except OSError as e:
+            raise connection_error(e)
+        return reader, writer, False
+
+    def _release(self, origin: Origin, reader, writer, keep_alive: bool):
+        idle = self._idle.setdefault(origin, [])
+        if keep_alive and len(idle) < self.pool_size and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+        self._slots[origin].release()
+
+    async def post(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        json: any = None,
+        stream: bool = False,
+        timeout: Optional[Tuple[float, float]] = None,
+    ) -> AsyncResponse:
+        # timeout is (connect, read) seconds, as for requests.
+        import json as jsonlib
+
+        from requests.structures import CaseInsensitiveDict
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        origin = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+        body = jsonlib.dumps(json).encode("utf-8")
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{port}"
+        # The headers given replace the defaults of the same name, in any case.
+        fields = CaseInsensitiveDict(
+            {
+                "Host": host,
+                "User-Agent": f"jsonthat/{__version__}",
+                "Accept-Encoding": "identity",
+                "Content-Type": "application/json",
+            }
+        )
+        fields.update(headers or {})
+        fields["Content-Length"] = str(len(body))
+        lines = [f"POST {path} HTTP/1.1"]
+        lines += [f"{name}: {value}" for name, value in fields.items()]
+        connect_timeout, read_timeout = timeout or (None, None)
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+        # One request per connection at a time, at most pool_size at once.
+        slots = self._slots.setdefault(origin, asyncio.Semaphore(self.pool_size))
+        await slots.acquire()
+        start = time.perf_counter()
+        try:
+            while True:
+                reader, writer, reused = await self._connect(origin, connect_timeout)
+                response = AsyncResponse(
+                    self, origin, url, reader, writer, read_timeout
+                )
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    await response._read_head()
+                    break
+                except (
+                    OSError,
+                    ValueError,
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                ) as e:
+                    writer.close()
+                    # The server may have closed an idle connection just as
+                    # it was reused: that one is retried on a new connection.
+                    if not reused or isinstance(e, TimeoutError):
+                        raise connection_error(e)
+        except BaseException:
+            slots.release()
+            raise
+        response.elapsed = timedelta(seconds=time.perf_counter() - start)
+        if not stream or response.status_code >= 400:
+            try:
+                await response.aread()
+            except BaseException:
+                response.close()
+                raise
+        return response
+
+    async def aclose(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    def discard(self):
+        # Drops the pooled connections from outside their event loop, which
+        # may have been closed already: each socket is shut down at once,
+        # and its transport closed on its loop if that can still run.
+        for idle in self._idle.values():
+            for _, writer in idle:
+                try:
+                    writer.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                if not self.loop.is_closed():
+                    self.loop.call_soon_threadsafe(writer.close)
+        self._idle.clear()
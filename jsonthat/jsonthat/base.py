@@ -0,0 +1,92 @@
+from abc import ABC, abstractmethod
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Union,
+)
+
+from .cache import make_cache_key
+from .prompts import build_batch_prompt, build_batch_schema, split_batch_result
+
+
+class LLMProvider(ABC):
+    name: str
+
+    @abstractmethod
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        pass
+
+    @abstractmethod
+    def transform_text_to_json(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], Generator[str, None, None]]:
+        pass
+
+    @property
+    @abstractmethod
+    def supports_streaming(self) -> bool:
+        pass
+
+    def transform_batch_to_json(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        result = self.transform_text_to_json(
+            build_batch_prompt(texts), build_batch_schema(schema)
+        )
+        return split_batch_result(result, len(texts))
+
+    async def transform_text_to_json_async(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], AsyncGenerator[str, None]]:
+        # Providers without an asyncio transport run on a worker thread.
+        import asyncio
+
+        result = await asyncio.to_thread(
+            self.transform_text_to_json, text, schema, stream
+        )
+        if isinstance(result, dict):
+            return result
+        return iterate_in_thread(result)
+
+    async def transform_batch_to_json_async(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        result = await self.transform_text_to_json_async(
+            build_batch_prompt(texts), build_batch_schema(schema)
+        )
+        return split_batch_result(result, len(texts))
+
+    @property
+    def uncached(self) -> "LLMProvider":
+        # The provider behind any response cache, for requests whose answer
+        # must not be replayed, such as schema retries.
+        return self
+
+    def cache_key(self, text: str, schema: Optional[str] = None) -> str:
+        return make_cache_key(self.name, self._prepare_request_data(text, schema))
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def iterate_in_thread(iterator: Iterator) -> AsyncIterator:
+    # Steps through a blocking iterator without blocking the event loop.
+    import asyncio
+
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield item
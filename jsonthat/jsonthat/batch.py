@@ -0,0 +1,439 @@
+import argparse
+import json
+import os
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Type
+
+import requests
+
+from .base import LLMProvider
+from .main import REQUEST_TIMEOUT, Config, get_provider, read_schema_file
+from .schema import CompiledSchema
+from .wrappers import LoadBalancedProvider
+
+DEFAULT_POLL_INTERVAL = 30.0
+
+# The results of a large batch can take a while to come down, so their
+# download is given longer between reads than a single request.
+RESULTS_TIMEOUT = (REQUEST_TIMEOUT[0], 1800.0)
+
+
+class BatchStatus:
+    def __init__(
+        self, status: str, done: bool, total: int, completed: int, failed: int
+    ):
+        self.status = status
+        self.done = done
+        self.total = total
+        self.completed = completed
+        self.failed = failed
+
+    def to_dict(self) -> Dict:
+        return {
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+class BatchBackend(ABC):
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+
+    @abstractmethod
+    def submit(self, texts: List[str], schema: Optional[str] = None) -> str:
+        pass
+
+    @abstractmethod
+    def status(self, job_id: str) -> BatchStatus:
+        pass
+
+    # Maps each input index to {"output": ...} or {"error": ...}.
+    @abstractmethod
+    def results(self, job_id: str) -> Dict[int, Dict]:
+        pass
+
+
+def custom_id(index: int) -> str:
+    return f"line-{index}"
+
+
+def parse_custom_id(value: str) -> int:
+    return int(value.rsplit("-", 1)[1])
+
+
+def parse_jsonl(text: str) -> List[Dict]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class OpenAIBatchBackend(BatchBackend):
+    endpoint = "/v1/chat/completions"
+
+    def _auth_headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.provider.api_key}"}
+
+    def submit(self, texts: List[str], schema: Optional[str] = None) -> str:
+        requests_file = "".join(
+            json.dumps(
+                {
+                    "custom_id": custom_id(index),
+                    "method": "POST",
+                    "url": self.endpoint,
+                    "body": self.provider._prepare_request_data(text, schema),
+                }
+            )
+            + "\n"
+            for index, text in enumerate(texts)
+        )
+
+        response = self.provider.session.post(
+            f"{self.provider.api_base}/files",
+            headers=self._auth_headers(),
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", requests_file.encode("utf-8"))},
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        file_id = response.json()["id"]
+
+        response = self.provider.session.post(
+            f"{self.provider.api_base}/batches",
+            headers=self.provider._get_headers(),
+            json={
+                "input_file_id": file_id,
+                "endpoint": self.endpoint,
+                "completion_window": "24h",
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _get_batch(self, job_id: str) -> Dict:
+        response = self.provider.session.get(
+            f"{self.provider.api_base}/batches/{job_id}",
+            headers=self._auth_headers(),
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def status(self, job_id: str) -> BatchStatus:
+        batch = self._get_batch(job_id)
+        counts = batch.get("request_counts") or {}
+        return BatchStatus(
+            status=batch["status"],
+            done=batch["status"] in ("completed", "failed", "expired", "cancelled"),
+            total=counts.get("total", 0),
+            completed=counts.get("completed", 0),
+            failed=counts.get("failed", 0),
+        )
+
+    def _get_file(self, file_id: str) -> List[Dict]:
+        response = self.provider.session.get(
+            f"{self.provider.api_base}/files/{file_id}/content",
+            headers=self._auth_headers(),
+            timeout=RESULTS_TIMEOUT,
+        )
+        response.raise_for_status()
+        return parse_jsonl(response.text)
+
+    def results(self, job_id: str) -> Dict[int, Dict]:
+        batch = self._get_batch(job_id)
+        results = {}
+        for file_key in ("output_file_id", "error_file_id"):
+            if not batch.get(file_key):
+                continue
+            for item in self._get_file(batch[file_key]):
+                index = parse_custom_id(item["custom_id"])
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results[index] = {"error": item.get("error") or response}
+                    continue
+                try:
+                    output = self.provider._parse_response(response["body"])
+                    results[index] = {"output": output}
+                except (KeyError, IndexError, json.JSONDecodeError) as e:
+                    results[index] = {"error": f"Invalid response: {e}"}
+        return results
+
+
+class ClaudeBatchBackend(BatchBackend):
+    def submit(self, texts: List[str], schema: Optional[str] = None) -> str:
+        response = self.provider.session.post(
+            f"{self.provider.api_base}/messages/batches",
+            headers=self.provider._get_headers(),
+            json={
+                "requests": [
+                    {
+                        "custom_id": custom_id(index),
+                        "params": self.provider._prepare_request_data(text, schema),
+                    }
+                    for index, text in enumerate(texts)
+                ]
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _get_batch(self, job_id: str) -> Dict:
+        response = self.provider.session.get(
+            f"{self.provider.api_base}/messages/batches/{job_id}",
+            headers=self.provider._get_headers(),
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def status(self, job_id: str) -> BatchStatus:
+        batch = self._get_batch(job_id)
+        counts = batch.get("request_counts") or {}
+        failed = sum(counts.get(key, 0) for key in ("errored", "canceled", "expired"))
+        return BatchStatus(
+            status=batch["processing_status"],
+            done=batch["processing_status"] == "ended",
+            total=sum(counts.values()),
+            completed=counts.get("succeeded", 0),
+            failed=failed,
+        )
+
+    def results(self, job_id: str) -> Dict[int, Dict]:
+        batch = self._get_batch(job_id)
+        if not batch.get("results_url"):
+            return {}
+
+        response = self.provider.session.get(
+            batch["results_url"],
+            headers=self.provider._get_headers(),
+            timeout=RESULTS_TIMEOUT,
+        )
+        response.raise_for_status()
+
+        results = {}
+        for item in parse_jsonl(response.text):
+            index = parse_custom_id(item["custom_id"])
+            result = item["result"]
+            if result["type"] != "succeeded":
+                results[index] = {"error": result.get("error") or result["type"]}
+                continue
+            try:
+                output = self.provider._parse_response(result["message"])
+                results[index] = {"output": output}
+            except (KeyError, IndexError, json.JSONDecodeError) as e:
+                results[index] = {"error": f"Invalid response: {e}"}
+        return results
+
+
+BATCH_BACKENDS: Dict[str, Type[BatchBackend]] = {
+    "openai": OpenAIBatchBackend,
+    "claude": ClaudeBatchBackend,
+}
+
+
+def get_batch_backend(provider: LLMProvider) -> BatchBackend:
+    backend_class = BATCH_BACKENDS.get(provider.name)
+    if not backend_class:
+        raise ValueError(
+            f"Batch jobs are not supported by {provider.name}. "
+            f"Supported providers: {', '.join(BATCH_BACKENDS)}"
+        )
+    return backend_class(provider)
+
+
+def select_member(provider: LLMProvider, key_index: int) -> LLMProvider:
+    # A batch job belongs to the API key that submitted it, so a pool of keys
+    # submits, polls and collects through one of them.
+    if not isinstance(provider, LoadBalancedProvider):
+        if key_index:
+            raise ValueError(f"--key-index {key_index} requires a pool of API keys")
+        return provider
+    if not 0 <= key_index < len(provider.members):
+        raise ValueError(
+            f"--key-index {key_index} is out of range for a pool of "
+            f"{len(provider.members)} API keys"
+        )
+    return provider.members[key_index]
+
+
+class BatchJobStore:
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or self.get_batch_dir()
+
+    def get_batch_dir(self) -> str:
+        data_dir = os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share"))
+        return os.path.join(data_dir, "jsonthat", "batches")
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job_id: str, provider_name: str, count: int, key_index: int = 0):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(job_id), "w") as f:
+            json.dump(
+                {
+                    "job_id": job_id,
+                    "provider": provider_name,
+                    "count": count,
+                    "key_index": key_index,
+                    "created": time.time(),
+                },
+                f,
+            )
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def wait_for_batch(
+    backend: BatchBackend, job_id: str, poll_interval: float = DEFAULT_POLL_INTERVAL
+) -> BatchStatus:
+    while True:
+        status = backend.status(job_id)
+        if status.done:
+            return status
+        print(
+            f"Batch {job_id}: {status.status} "
+            f"({status.completed + status.failed}/{status.total})",
+            file=sys.stderr,
+        )
+        time.sleep(poll_interval)
+
+
+def collect_results(
+    backend: BatchBackend, job_id: str, count: Optional[int] = None
+) -> List[Dict]:
+    results = backend.results(job_id)
+    if count is None:
+        count = max(results, default=-1) + 1
+    return [
+        results.get(index, {"error": "No result returned for this record"})
+        for index in range(count)
+    ]
+
+
+def batch_command(config: Config, argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="jt batch", description="Run --line transforms as provider batch jobs"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser(
+        "submit", help="Submit stdin, one record per line, as a batch job"
+    )
+    submit_parser.add_argument("--schema", type=str, help="Path to the schema file")
+    submit_parser.add_argument(
+        "--provider", type=str, help="Specify the LLM provider to use"
+    )
+    submit_parser.add_argument(
+        "--key-index",
+        type=int,
+        default=0,
+        help="API key of a pool of keys to submit with (default: 0, the first)",
+    )
+
+    status_parser = subparsers.add_parser("status", help="Show a batch job status")
+    status_parser.add_argument("job_id", help="Batch job id")
+    status_parser.add_argument(
+        "--provider", type=str, help="Provider of a job submitted elsewhere"
+    )
+    status_parser.add_argument(
+        "--key-index", type=int, help="API key of a job submitted elsewhere"
+    )
+
+    collect_parser = subparsers.add_parser(
+        "collect", help="Wait for a batch job and print its results in input order"
+    )
+    collect_parser.add_argument("job_id", help="Batch job id")
+    collect_parser.add_argument(
+        "--provider", type=str, help="Provider of a job submitted elsewhere"
+    )
+    collect_parser.add_argument(
+        "--key-index", type=int, help="API key of a job submitted elsewhere"
+    )
+    collect_parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Fail instead of waiting if the job is still running",
+    )
+    collect_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="Seconds between status checks (default: 30)",
+    )
+
+    args = parser.parse_args(argv)
+    store = BatchJobStore()
+    job = None if args.command == "submit" else store.load(args.job_id)
+    provider_name = args.provider or (job and job["provider"])
+    key_index = args.key_index
+    if key_index is None:
+        key_index = job.get("key_index", 0) if job else 0
+
+    try:
+        provider = get_provider(config, provider_name)
+        backend = get_batch_backend(select_member(provider, key_index))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        with provider:
+            if args.command == "submit":
+                schema = (
+                    str(CompiledSchema.parse(read_schema_file(args.schema)))
+                    if args.schema
+                    else None
+                )
+                texts = [line.strip() for line in sys.stdin if line.strip()]
+                if not texts:
+                    print("Error: No input provided.", file=sys.stderr)
+                    sys.exit(1)
+                job_id = backend.submit(texts, schema)
+                store.save(job_id, provider.name, len(texts), key_index)
+                print(job_id)
+
+            elif args.command == "status":
+                print(json.dumps(backend.status(args.job_id).to_dict(), indent=2))
+
+            elif args.command == "collect":
+                if args.no_wait:
+                    status = backend.status(args.job_id)
+                    if not status.done:
+                        print(
+                            f"Error: Batch {args.job_id} is still {status.status}.",
+                            file=sys.stderr,
+                        )
+                        sys.exit(1)
+                else:
+                    wait_for_batch(backend, args.job_id, args.poll_interval)
+
+                failed = 0
+                count = job["count"] if job else None
+                for index, result in enumerate(
+                    collect_results(backend, args.job_id, count)
+                ):
+                    if "error" in result:
+                        failed += 1
+                        print(
+                            f"Error: Record {index} failed: {result['error']}",
+                            file=sys.stderr,
+                        )
+                        continue
+                    print(json.dumps(result["output"], indent=2))
+                if failed:
+                    sys.exit(1)
+    except requests.RequestException as e:
+        print(f"Error: Failed to communicate with the API.\n{e}", file=sys.stderr)
+        if e.response is not None:
+            print(e.response.text, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024  # 100 MB
+
+
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "jsonthat", "responses")
+
+
+def make_cache_key(
+    provider_name: str, request: Dict, endpoint: Optional[str] = None
+) -> str:
+    # The request payload already carries the model, the prompt template, the
+    # schema text and the input, so hashing it with the endpoint it is sent
+    # to covers everything that can change the response.
+    import hashlib
+
+    payload = json.dumps(
+        {"provider": provider_name, "endpoint": endpoint, "request": request},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: Optional[float] = None,
+    ):
+        self.directory = directory or get_cache_dir()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[any]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        # Entries are evicted by modification time, so touching an entry on
+        # every hit turns the eviction order into least-recently-used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(hit=True)
+        return entry["value"]
+
+    def set(self, key: str, value: any):
+        import tempfile
+
+        path = self._path(key)
+        data = json.dumps({"created": time.time(), "value": value})
+
+        # Write to a temporary file and rename it so that concurrent runs
+        # never read a partially written entry. A cache that cannot be
+        # written is skipped, as one that cannot be read is: the response
+        # has already been paid for and is returned all the same.
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        except OSError:
+            return
+        try:
+            # An entry written again, as with --refresh, replaces its old size.
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_size:
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                self._remove(path)
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Evict down to 90% of the limit so that eviction does not run again
+        # on the very next write.
+        target = self.max_size * 0.9
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            self._remove(path)
+            size -= entry_size
+        self._size = size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
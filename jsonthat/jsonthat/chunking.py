@@ -0,0 +1,99 @@
+import json
+from typing import Dict, Iterable, Iterator, Optional, TextIO
+
+# Roughly four characters per token for English text and JSON.
+CHARS_PER_TOKEN = 4
+READ_SIZE = 64 * 1024
+
+# Preferred places to end a chunk, from the most to the least natural.
+BOUNDARIES = ("\n\n", "\n", ". ", " ")
+
+
+def find_boundary(text: str, limit: int) -> int:
+    # Look for a boundary in the second half of the window so that chunks
+    # never become much smaller than requested.
+    for boundary in BOUNDARIES:
+        index = text.rfind(boundary, limit // 2, limit)
+        if index != -1:
+            return index + len(boundary)
+    return limit
+
+
+def iter_chunks(
+    stream: TextIO, chunk_tokens: int = 4000, overlap_tokens: int = 200
+) -> Iterator[str]:
+    chunk_size = chunk_tokens * CHARS_PER_TOKEN
+    overlap = min(overlap_tokens * CHARS_PER_TOKEN, chunk_size // 2)
+    buffer = ""
+    eof = False
+
+    # Only about one chunk of input is held in memory at a time, so the input
+    # size is bounded by the source rather than by the model context.
+    while not eof or buffer.strip():
+        while not eof and len(buffer) < chunk_size:
+            data = stream.read(READ_SIZE)
+            if not data:
+                eof = True
+            buffer += data
+
+        if eof and len(buffer) <= chunk_size:
+            chunk, buffer = buffer, ""
+        else:
+            end = find_boundary(buffer, chunk_size)
+            chunk = buffer[:end]
+            start = max(end - overlap, 0)
+            if start:
+                # Start the overlap on a word so no chunk begins mid-token.
+                space = buffer.find(" ", start, end)
+                start = space + 1 if space != -1 else start
+            buffer = buffer[start:]
+
+        chunk = chunk.strip()
+        if chunk:
+            yield chunk
+
+
+def _canonical(value: any) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+def merge_values(first: any, second: any, schema: Optional[Dict] = None) -> any:
+    schema = schema or {}
+    if first is None or first == "" or first == [] or first == {}:
+        return second
+    if second is None or second == "" or second == [] or second == {}:
+        return first
+
+    if schema.get("type") == "array" or (
+        isinstance(first, list) and isinstance(second, list)
+    ):
+        first = first if isinstance(first, list) else [first]
+        second = second if isinstance(second, list) else [second]
+        # Overlapping chunks report the same items twice; keep the first copy.
+        merged = list(first)
+        seen = {_canonical(item) for item in merged}
+        for item in second:
+            key = _canonical(item)
+            if key not in seen:
+                seen.add(key)
+                merged.append(item)
+        return merged
+
+    if isinstance(first, dict) and isinstance(second, dict):
+        properties = schema.get("properties", {})
+        merged = dict(first)
+        for key, value in second.items():
+            merged[key] = merge_values(first.get(key), value, properties.get(key))
+        return merged
+
+    # Conflicting scalars: the earliest chunk wins, which keeps the merge
+    # deterministic regardless of the order in which chunks complete.
+    return first
+
+
+def merge_results(results: Iterable[any], schema: Optional[Dict] = None) -> any:
+    # schema is the JSON schema of --schema, whatever format it was given in.
+    merged = None
+    for result in results:
+        merged = merge_values(merged, result, schema)
+    return merged
@@ -0,0 +1,205 @@
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional, Union
+
+from .aio import transform_batch_async, transform_lines_async
+from .cache import DEFAULT_MAX_SIZE, ResponseCache
+from .dedupe import RecordCoalescer
+from .main import Config, build_provider, transform_batch, transform_lines
+from .ratelimit import DEFAULT_MAX_RETRIES
+from .schema import DEFAULT_SCHEMA_RETRIES, CompiledSchema, InvalidOutput
+from .usage import UsageTracker
+from .wrappers import DEFAULT_HEDGE_PERCENTILE, CachedProvider
+
+
+class TransformError(ValueError):
+    def __init__(self, result: InvalidOutput):
+        super().__init__(result.format())
+        self.result = result
+
+
+def iter_texts(texts: Iterable[str]) -> Iterator[str]:
+    # As --line reads its records: stripped, and the blank ones skipped.
+    for text in texts:
+        text = text.strip()
+        if text:
+            yield text
+
+
+class Client:
+    # A long-lived client for use from Python code, safe to share between
+    # threads: the provider connections, rate limits and response cache are
+    # set up once and reused by every call.
+
+    def __init__(
+        self,
+        provider: Optional[str] = None,
+        schema: Union[str, Dict, None] = None,
+        config: Union[Config, Dict, None] = None,
+        concurrency: int = 4,
+        pool_size: Optional[int] = None,
+        cache: bool = True,
+        cache_ttl: Optional[float] = None,
+        cache_size: int = DEFAULT_MAX_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        schema_retries: int = DEFAULT_SCHEMA_RETRIES,
+        hedge_delay: Optional[float] = None,
+        dedupe: bool = True,
+        usage: bool = False,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if isinstance(config, dict):
+            # A dict has the layout of config.yaml and replaces it.
+            config = Config({"providers": {}, "default_provider": None, **config})
+        elif config is None:
+            config = Config()
+
+        self.concurrency = concurrency
+        self.schema_retries = schema_retries
+        self.dedupe = dedupe
+        self.usage = UsageTracker() if usage else None
+        self.provider, self.endpoints = build_provider(
+            config,
+            provider,
+            pool_size=pool_size or concurrency,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            hedge_delay=hedge_delay,
+            hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+            usage_tracker=self.usage,
+        )
+        self.validator = None
+        self.schema = None
+        if schema is not None:
+            if isinstance(schema, dict):
+                schema = json.dumps(schema)
+            self.validator = CompiledSchema.parse(schema)
+            self.schema = str(self.validator)
+
+        self.cache = None
+        if cache:
+            self.cache = ResponseCache(max_size=cache_size, ttl=cache_ttl)
+            self.provider = CachedProvider(
+                self.provider, self.cache, validator=self.validator
+            )
+
+    def transform(self, text: str) -> Dict:
+        result = transform_batch(
+            self.provider, [text], self.schema, self.validator, self.schema_retries
+        )[0]
+        if isinstance(result, InvalidOutput):
+            raise TransformError(result)
+        if self.usage:
+            self.usage.add_records()
+        return result
+
+    def transform_many(
+        self, texts: Iterable[str], batch_size: int = 1
+    ) -> Iterator[Union[Dict, InvalidOutput]]:
+        # Results come in input order; a record whose output does not match
+        # the schema yields an InvalidOutput instead of raising, so that one
+        # bad record does not end the iteration.
+        results = transform_lines(
+            self.provider,
+            iter_texts(texts),
+            self.schema,
+            concurrency=self.concurrency,
+            batch_size=batch_size,
+            validator=self.validator,
+            retries=self.schema_retries,
+            coalescer=RecordCoalescer() if self.dedupe else None,
+        )
+        for result in results:
+            if self.usage and not isinstance(result, InvalidOutput):
+                self.usage.add_records()
+            yield result
+
+    def stream(self, text: str) -> Iterator[str]:
+        # Yields the JSON text as it is generated, or all at once from the
+        # cache and from providers that do not stream.
+        result = self.provider.transform_text_to_json(
+            text, self.schema, stream=self.provider.supports_streaming
+        )
+        if isinstance(result, dict):
+            yield json.dumps(result, indent=2)
+        else:
+            yield from result
+        if self.usage:
+            self.usage.add_records()
+
+    def close(self):
+        self.provider.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncClient:
+    # The asyncio counterpart of Client, with the same options. Requests are
+    # sent from the event loop itself, so that many of them can be in flight
+    # without a thread each.
+
+    def __init__(self, *args, **kwargs):
+        self.client = Client(*args, **kwargs)
+
+    async def transform(self, text: str) -> Dict:
+        client = self.client
+        result = (
+            await transform_batch_async(
+                client.provider,
+                [text],
+                client.schema,
+                client.validator,
+                client.schema_retries,
+            )
+        )[0]
+        if isinstance(result, InvalidOutput):
+            raise TransformError(result)
+        if client.usage:
+            client.usage.add_records()
+        return result
+
+    async def transform_many(
+        self, texts: Iterable[str], batch_size: int = 1
+    ) -> AsyncIterator[Union[Dict, InvalidOutput]]:
+        client = self.client
+        results = transform_lines_async(
+            client.provider,
+            iter_texts(texts),
+            client.schema,
+            concurrency=client.concurrency,
+            batch_size=batch_size,
+            validator=client.validator,
+            retries=client.schema_retries,
+            coalescer=RecordCoalescer() if client.dedupe else None,
+        )
+        async for result in results:
+            if client.usage and not isinstance(result, InvalidOutput):
+                client.usage.add_records()
+            yield result
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        client = self.client
+        result = await client.provider.transform_text_to_json_async(
+            text, client.schema, stream=client.provider.supports_streaming
+        )
+        if isinstance(result, dict):
+            yield json.dumps(result, indent=2)
+        else:
+            async for chunk in result:
+                yield chunk
+        if client.usage:
+            client.usage.add_records()
+
+    async def aclose(self):
+        await self.client.provider.aclose()
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
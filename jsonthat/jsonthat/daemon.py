@@ -0,0 +1,336 @@
+import json
+import os
+import socket
+import sys
+import threading
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .schema import CompiledSchema, InvalidOutput
+from .version import __version__
+
+# `jt --serve` keeps providers, their connection pools and rate limiters and
+# the response cache in one long-running process, and `jt` hands its records
+# to it over a unix socket instead of starting cold. Messages are JSON, one
+# per line: the client sends a request, then its records and closes its side;
+# the daemon answers with a ready message, then one message per result in
+# the order the client asked for, then a done message.
+
+# The variables that pick the provider, key and model. A daemon only serves
+# clients that would have made the same choice, from the same config.yaml.
+PROVIDER_ENVIRONMENT = [
+    "LLM_PROVIDER",
+    "LLM_API_KEY",
+    "LLM_MODEL",
+    "LLM_API_BASE",
+    "OLLAMA_API_URL",
+    "OLLAMA_MODEL",
+]
+
+
+class DaemonError(ValueError):
+    pass
+
+
+def get_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "jsonthat.sock")
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "jsonthat", "daemon.sock")
+
+
+def environment_digest() -> str:
+    # The provider environment variables, and the version of config.yaml
+    # the daemon read when it started.
+    import hashlib
+
+    from .main import get_config_file_path
+
+    values = [os.environ.get(name) for name in PROVIDER_ENVIRONMENT]
+    config_file = get_config_file_path()
+    try:
+        stat = os.stat(config_file)
+        values += [config_file, stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        values += [config_file, None, None]
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def send_message(stream: BinaryIO, message: Dict):
+    data = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+    stream.write(data.encode("utf-8") + b"\n")
+
+
+def read_message(stream: BinaryIO) -> Optional[Dict]:
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def format_error(error: Exception) -> str:
+    import requests
+
+    if isinstance(error, requests.RequestException):
+        message = f"Failed to communicate with the API.\n{error}"
+        if error.response is not None:
+            message += f"\n{error.response.text}"
+        return message
+    if isinstance(error, json.JSONDecodeError):
+        return f"Failed to parse API response as JSON. {error}"
+    return str(error)
+
+
+class Daemon:
+    def __init__(
+        self,
+        config,
+        concurrency: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        cache=None,
+        options: Optional[Dict] = None,
+    ):
+        from .main import DEFAULT_SERVE_CONCURRENCY
+        from .ratelimit import DEFAULT_MAX_RETRIES
+        from .wrappers import DEFAULT_HEDGE_PERCENTILE
+
+        self.config = config
+        self.concurrency = concurrency or DEFAULT_SERVE_CONCURRENCY
+        self.pool_size = pool_size or self.concurrency
+        self.max_retries = DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile or DEFAULT_HEDGE_PERCENTILE
+        self.cache = cache
+        self.options = options
+        self.environment = environment_digest()
+        self.providers = {}
+        self.validators: Dict[str, CompiledSchema] = {}
+        self.clients = 0
+        self._lock = threading.Lock()
+
+    def get_provider(self, names: Optional[str]):
+        # One provider per list of provider names, shared by every client.
+        from .main import build_provider
+
+        with self._lock:
+            if names not in self.providers:
+                self.providers[names], _ = build_provider(
+                    self.config,
+                    names,
+                    pool_size=self.pool_size,
+                    concurrency=self.concurrency,
+                    max_retries=self.max_retries,
+                    hedge_delay=self.hedge_delay,
+                    hedge_percentile=self.hedge_percentile,
+                    options=self.options,
+                )
+            return self.providers[names]
+
+    def get_validator(self, schema: Optional[str]) -> Optional[CompiledSchema]:
+        if schema is None:
+            return None
+        with self._lock:
+            if schema not in self.validators:
+                self.validators[schema] = CompiledSchema.parse(schema)
+            return self.validators[schema]
+
+    def handle(self, rfile: BinaryIO, wfile: BinaryIO):
+        from .dedupe import RecordCoalescer
+        from .main import get_default_concurrency, transform_lines
+        from .wrappers import CachedProvider
+
+        request = read_message(rfile)
+        if request is None:
+            return
+        # A client that can not be served as it would serve itself runs
+        # on its own instead.
+        if request.get("version") != __version__:
+            send_message(wfile, {"fallback": f"the daemon runs {__version__}"})
+            return
+        if request.get("environment") != self.environment:
+            send_message(wfile, {"fallback": "the provider environment differs"})
+            return
+        try:
+            provider = self.get_provider(request.get("provider"))
+            validator = self.get_validator(request.get("schema"))
+            concurrency = request.get("concurrency") or get_default_concurrency(
+                self.config, request.get("provider")
+            )
+        except ValueError as e:
+            send_message(wfile, {"error": str(e)})
+            return
+        with self._lock:
+            self.clients += 1
+        send_message(wfile, {"ready": True})
+
+        if self.cache is not None and request.get("cache", True):
+            provider = CachedProvider(
+                provider,
+                self.cache,
+                refresh=request.get("refresh", False),
+                validator=validator,
+            )
+        records = (
+            (tuple(record["key"]), record["text"]) for record in map(json.loads, rfile)
+        )
+        results = transform_lines(
+            provider,
+            records,
+            str(validator) if validator else None,
+            concurrency=concurrency,
+            ordered=request.get("ordered", True),
+            batch_size=request.get("batch_size", 1),
+            batch_tokens=request.get("batch_tokens", 4000),
+            validator=validator,
+            retries=request.get("schema_retries", 0),
+            keyed=True,
+            coalescer=RecordCoalescer() if request.get("dedupe") else None,
+        )
+        try:
+            for key, result in results:
+                if isinstance(result, InvalidOutput):
+                    invalid = [result.text, result.output, result.errors]
+                    send_message(wfile, {"key": key, "invalid": invalid})
+                else:
+                    send_message(wfile, {"key": key, "output": result})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client has gone away, and with it the rest of its records.
+            return
+        except Exception as e:
+            send_message(wfile, {"error": format_error(e)})
+            return
+        send_message(wfile, {"done": True})
+
+    def close(self):
+        for provider in self.providers.values():
+            provider.close()
+
+
+def connect(path: str) -> Optional[socket.socket]:
+    # Returns None when no daemon is listening, or the platform has no unix
+    # sockets.
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def forward(
+    connection: socket.socket, request: Dict, records: Iterable[Tuple[any, str]]
+) -> Optional[Iterator[Tuple[any, Union[dict, InvalidOutput]]]]:
+    # Returns the results of the records, or None when the daemon declines
+    # the request and the caller is to run it itself.
+    reader = connection.makefile("rb")
+    writer = connection.makefile("wb")
+    send_message(
+        writer,
+        {**request, "version": __version__, "environment": environment_digest()},
+    )
+    writer.flush()
+    reply = read_message(reader)
+    if reply is None or "fallback" in reply:
+        connection.close()
+        return None
+    if "error" in reply:
+        connection.close()
+        raise DaemonError(reply["error"])
+    return receive(connection, reader, writer, records)
+
+
+def receive(connection, reader, writer, records) -> Iterator:
+    errors = []
+
+    def send():
+        # Records are sent from a thread while the results are read, the
+        # socket buffers holding back whichever side runs ahead.
+        try:
+            for key, text in records:
+                send_message(writer, {"key": key, "text": text})
+            writer.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                connection.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    try:
+        while (message := read_message(reader)) is not None:
+            if "done" in message:
+                break
+            if "error" in message:
+                raise DaemonError(message["error"])
+            key = tuple(message["key"])
+            if "invalid" in message:
+                yield key, InvalidOutput(*message["invalid"])
+            else:
+                yield key, message["output"]
+        else:
+            raise DaemonError("The jt daemon closed the connection")
+        sender.join()
+        if errors:
+            raise errors[0]
+    finally:
+        connection.close()
+
+
+def create_server(daemon: Daemon, path: str):
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            daemon.handle(self.rfile, self.wfile)
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    existing = connect(path)
+    if existing is not None:
+        existing.close()
+        raise DaemonError(f"A jt daemon is already listening on {path}")
+    os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+    try:
+        os.unlink(path)  # left behind by a daemon that did not exit cleanly
+    except FileNotFoundError:
+        pass
+
+    # Only the owner may connect: the daemon sends requests with their keys.
+    umask = os.umask(0o177)
+    try:
+        return Server(path, Handler)
+    finally:
+        os.umask(umask)
+
+
+def serve(daemon: Daemon, path: str):
+    import signal
+
+    server = create_server(daemon, path)
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Listening on {path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        daemon.close()
+        print(f"Served {daemon.clients} clients", file=sys.stderr)
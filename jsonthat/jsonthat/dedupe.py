@@ -0,0 +1,106 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+# Results kept for duplicates still to come; older ones are dropped and a
+# later repeat of them is simply transformed again.
+MAX_RESULTS = 100_000
+
+WHITESPACE = re.compile(r"\s+")
+
+T = TypeVar("T")
+
+
+def normalize_record(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def record_digest(text: str) -> bytes:
+    return hashlib.blake2b(
+        normalize_record(text).encode("utf-8"), digest_size=16
+    ).digest()
+
+
+class RecordCoalescer:
+    # Sends one request per distinct record in a run. The first occurrence of
+    # a record transforms it; duplicates, including those in flight at the
+    # same time in other workers, wait for and share its result.
+
+    def __init__(self, max_results: int = MAX_RESULTS):
+        self.max_results = max_results
+        self.records = 0
+        self.duplicates = 0
+        self._results: "OrderedDict[bytes, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim(self, texts: List[str]):
+        # Returns the records this call has to transform, and a future for
+        # the result of every record.
+        owned: Dict[bytes, Tuple[str, Future]] = {}
+        futures: List[Future] = []
+        digests = [record_digest(text) for text in texts]
+        with self._lock:
+            for digest, text in zip(digests, texts):
+                future = self._results.get(digest)
+                if future is None:
+                    future = self._results[digest] = Future()
+                    owned[digest] = (text, future)
+                    if len(self._results) > self.max_results:
+                        self._results.popitem(last=False)
+                else:
+                    self._results.move_to_end(digest)
+                futures.append(future)
+            self.records += len(texts)
+            self.duplicates += len(texts) - len(owned)
+        return owned, futures
+
+    def _fail(self, owned: Dict[bytes, Tuple[str, Future]], error: BaseException):
+        # Waiting duplicates fail the same way; later ones try again.
+        with self._lock:
+            for digest, (_, future) in owned.items():
+                if self._results.get(digest) is future:
+                    del self._results[digest]
+        for _, future in owned.values():
+            future.set_exception(error)
+
+    def run(
+        self, texts: List[str], transform: Callable[[List[str]], List[T]]
+    ) -> List[T]:
+        owned, futures = self._claim(texts)
+        if owned:
+            try:
+                outputs = transform([text for text, _ in owned.values()])
+            except BaseException as e:
+                self._fail(owned, e)
+                raise
+            for (_, future), output in zip(owned.values(), outputs):
+                future.set_result(output)
+        return [future.result() for future in futures]
+
+    async def run_async(
+        self, texts: List[str], transform: Callable[[List[str]], Awaitable[List[T]]]
+    ) -> List[T]:
+        import asyncio
+
+        owned, futures = self._claim(texts)
+        if owned:
+            try:
+                outputs = await transform([text for text, _ in owned.values()])
+            except BaseException as e:
+                self._fail(owned, e)
+                raise
+            for (_, future), output in zip(owned.values(), outputs):
+                future.set_result(output)
+        return [
+            future.result() if future.done() else await asyncio.wrap_future(future)
+            for future in futures
+        ]
+
+    def format_summary(self) -> str:
+        return (
+            f"Duplicates: {self.duplicates} of {self.records} records "
+            "reused an earlier result"
+        )
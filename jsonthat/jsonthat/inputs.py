@@ -0,0 +1,179 @@
+import glob
+import io
+import os
+import re
+import sys
+from typing import BinaryIO, Iterable, Iterator, List, Pattern, TextIO, Tuple, Union
+
+READ_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+Delimiter = Union[bytes, Pattern[bytes]]
+
+
+def expand_inputs(patterns: Iterable[str]) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        if pattern == "-" or os.path.exists(pattern):
+            paths.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            raise ValueError(f"No input file matches {pattern}")
+        paths.extend(matches)
+    return paths
+
+
+def close_with(reader: BinaryIO, stream: BinaryIO) -> BinaryIO:
+    # Decompressors given a file object leave it open when they are closed.
+    close = reader.close
+
+    def close_both():
+        try:
+            close()
+        finally:
+            stream.close()
+
+    reader.close = close_both
+    return reader
+
+
+def open_zstd(stream: BinaryIO) -> BinaryIO:
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return close_with(zstd.ZstdFile(stream), stream)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "Reading zstd input requires Python 3.14 or the zstd extra: "
+            "pip install 'jsonthat[zstd]'"
+        ) from None
+    return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+
+
+def open_binary(path: str) -> BinaryIO:
+    # Compressed input is recognized by its magic bytes, not its extension.
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    magic = stream.peek(4)[:4] if hasattr(stream, "peek") else b""
+    if magic.startswith(GZIP_MAGIC):
+        import gzip
+
+        return close_with(gzip.GzipFile(fileobj=stream), stream)
+    if magic.startswith(ZSTD_MAGIC):
+        return open_zstd(stream)
+    return stream
+
+
+def open_text(path: str) -> TextIO:
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8", errors="replace")
+
+
+def read_text(path: str) -> str:
+    f = open_text(path)
+    try:
+        return f.read().strip()
+    finally:
+        if path == "-":
+            # Closing the wrapper would close stdin for the rest of the run.
+            f.detach()
+        else:
+            f.close()
+
+
+def decode_record(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace").strip()
+
+
+def split_buffer(buffer, delimiter: Delimiter) -> Iterator[str]:
+    # Works on a memory map without copying it: only each record is copied
+    # out of the buffer while it is decoded.
+    position = 0
+    if isinstance(delimiter, bytes):
+        while True:
+            end = buffer.find(delimiter, position)
+            if end == -1:
+                break
+            yield decode_record(buffer[position:end])
+            position = end + len(delimiter)
+    else:
+        for match in delimiter.finditer(buffer):
+            if match.end() == match.start():
+                continue
+            yield decode_record(buffer[position : match.start()])
+            position = match.end()
+    yield decode_record(buffer[position:])
+
+
+def last_delimiter_end(buffer: bytes, delimiter: Delimiter) -> int:
+    if isinstance(delimiter, bytes):
+        index = buffer.rfind(delimiter)
+        return index + len(delimiter) if index != -1 else 0
+    end = 0
+    for match in delimiter.finditer(buffer):
+        if match.end() > match.start():
+            end = match.end()
+    return end
+
+
+def split_stream(stream: BinaryIO, delimiter: Delimiter) -> Iterator[str]:
+    # read1 returns as soon as some data is available, so records of a slow
+    # pipe are processed as they arrive instead of after a full block.
+    read = getattr(stream, "read1", stream.read)
+    buffer = b""
+    while True:
+        data = read(READ_SIZE)
+        if not data:
+            break
+        buffer += data
+        # Only complete records are split off, the rest waits for more data.
+        end = last_delimiter_end(buffer, delimiter)
+        if end:
+            yield from split_buffer(buffer[:end], delimiter)
+            buffer = buffer[end:]
+    yield decode_record(buffer)
+
+
+def iter_file_records(path: str, delimiter: Delimiter) -> Iterator[str]:
+    if path != "-":
+        import mmap
+
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            magic = f.read(4)
+            if size and not magic.startswith((GZIP_MAGIC, ZSTD_MAGIC)):
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    if hasattr(buffer, "madvise"):
+                        buffer.madvise(mmap.MADV_SEQUENTIAL)
+                    yield from split_buffer(buffer, delimiter)
+                return
+
+    with open_binary(path) as stream:
+        yield from split_stream(stream, delimiter)
+
+
+def iter_records(
+    paths: Iterable[str], delimiter: Delimiter = b"\n", numbered: bool = False
+) -> Iterator[Union[str, Tuple[Tuple[str, int], str]]]:
+    # With numbered=True, each record comes with its path and its 1-based
+    # position in that file, empty records included, which is the line
+    # number for newline-delimited input.
+    for path in paths:
+        for number, record in enumerate(iter_file_records(path, delimiter), 1):
+            if record:
+                yield ((path, number), record) if numbered else record
+
+
+def make_delimiter(null: bool = False, pattern: str = None) -> Delimiter:
+    if null:
+        return b"\0"
+    if pattern:
+        try:
+            return re.compile(pattern.encode("utf-8"))
+        except re.error as e:
+            raise ValueError(f"Invalid delimiter {pattern!r}: {e}") from None
+    return b"\n"
@@ -0,0 +1,124 @@
+import json
+import os
+import stat
+import threading
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+JOURNAL_VERSION = 1
+
+
+def journal_header(inputs: List[str], schema: Optional[str]) -> Dict:
+    # Identifies the job, so that a journal is never resumed against
+    # different inputs or a different schema.
+    import hashlib
+
+    digest = hashlib.sha256(schema.encode("utf-8")).hexdigest() if schema else None
+    return {"jsonthat_checkpoint": JOURNAL_VERSION, "inputs": inputs, "schema": digest}
+
+
+def regular_file_fd(stream: Optional[IO]) -> Optional[int]:
+    # Pipes and terminals cannot be fsynced, and need not be.
+    try:
+        fd = stream.fileno()
+        return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class CheckpointJournal:
+    # Append-only JSONL record of the completed records of a --line run: one
+    # line per record with its input, its record number and its output.
+    # Entries are appended only once the output they describe has been
+    # flushed, so after a crash a record may be output twice but never lost.
+    # When the output is a regular file it is fsynced before the entries are
+    # appended, so that they never describe output lost with the page cache.
+
+    def __init__(
+        self,
+        path: str,
+        inputs: List[str],
+        schema: Optional[str] = None,
+        resume: bool = False,
+        output: Optional[IO] = None,
+    ):
+        self.path = path
+        self._output_fd = regular_file_fd(output)
+        self.completed: Set[Tuple[str, int]] = set()
+        self.skipped = 0
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        header = journal_header(inputs, schema)
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and not resume:
+            raise ValueError(
+                f"Checkpoint {path} already exists, use --resume to continue it"
+            )
+        if exists:
+            self._load(header)
+        self._file = open(path, "ab")
+        if not exists:
+            self._append(json.dumps(header) + "\n")
+
+    def _load(self, header: Dict):
+        with open(self.path, "r+b") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            lines = data[:end].splitlines()
+            tail = data[end:]
+            if tail:
+                try:
+                    json.loads(tail)
+                    lines.append(tail)
+                    f.write(b"\n")
+                except json.JSONDecodeError:
+                    # An entry cut short by a crash: the record is done again.
+                    f.truncate(end)
+
+        try:
+            found = json.loads(lines[0]) if lines else None
+        except json.JSONDecodeError:
+            found = None
+        if found != header:
+            raise ValueError(
+                f"Checkpoint {self.path} was written for other inputs or schema"
+            )
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                entry = json.loads(line)
+                self.completed.add((entry["input"], entry["record"]))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                raise ValueError(f"Checkpoint {self.path} is corrupt at line {number}")
+
+    def _append(self, text: str):
+        self._file.write(text.encode("utf-8"))
+        self._file.flush()
+
+    def pending_records(
+        self, pairs: Iterable[Tuple[Tuple[str, int], str]]
+    ) -> Iterator[Tuple[Tuple[str, int], str]]:
+        for key, text in pairs:
+            if key in self.completed:
+                self.skipped += 1
+                continue
+            yield key, text
+
+    def record(self, key: Tuple[str, int], output: any):
+        path, number = key
+        entry = {"input": path, "record": number, "output": output}
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._pending.append(line)
+
+    def flush(self):
+        # Called by the output writer after each flush of its stream.
+        with self._lock:
+            if self._pending:
+                if self._output_fd is not None:
+                    os.fsync(self._output_fd)
+                self._append("".join(self._pending))
+                self._pending.clear()
+
+    def close(self):
+        self.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
@@ -1,13 +1,124 @@
+from __future__ import annotations
+
 import sys
 import json
 import os
-import requests
-from abc import ABC, abstractmethod
-from typing import Dict, Type, Optional, List, Generator, Union
-import yaml
+import threading
+from abc import abstractmethod
+from typing import (
+    TYPE_CHECKING,
+    AsyncGenerator,
+    Dict,
+    Type,
+    Optional,
+    List,
+    Generator,
+    Union,
+    Iterable,
+    Iterator,
+    Callable,
+    Tuple,
+)
 import argparse
+from collections import abc, deque
+from functools import partial
+from operator import itemgetter
 from enum import Enum
+from .base import LLMProvider
+from .cache import DEFAULT_MAX_SIZE, ResponseCache, make_cache_key
+from .chunking import CHARS_PER_TOKEN, iter_chunks, merge_results
+from .journal import CheckpointJournal
+from .inputs import expand_inputs, iter_records, make_delimiter, open_text, read_text
+from .partial import IncrementalJSONParser
+from .prompts import (
+    build_response_format,
+    build_retry_prompt,
+    build_system_prompt,
+    build_user_prompt,
+)
+from .ratelimit import DEFAULT_MAX_RETRIES, RateLimiter
+from .streaming import (
+    SSE,
+    NDJSON,
+    decode_events,
+    decode_events_async,
+    iter_response_chunks,
+)
+from .schema import (
+    DEFAULT_SCHEMA_RETRIES,
+    CompiledSchema,
+    InvalidOutput,
+    to_json_schema,
+)
+from .usage import RequestUsage, UsageTracker
 from .version import __version__
+from .wrappers import (
+    DEFAULT_HEDGE_PERCENTILE,
+    CachedProvider,
+    HedgedProvider,
+    LoadBalancedProvider,
+)
+from .writer import OUTPUT_MODES, OutputWriter
+
+# requests and yaml are imported where they are first needed: together they
+# account for most of the startup time of a `jt` invocation.
+if TYPE_CHECKING:
+    import requests
+
+    from .asynchttp import AsyncResponse, AsyncSession
+    from .dedupe import RecordCoalescer
+
+DEFAULT_POOL_SIZE = 10
+
+# Seconds to connect, and to wait for each read of a response: long enough
+# for a slow model to answer, short enough that a dead server does not hang
+# the run.
+REQUEST_TIMEOUT = (10.0, 600.0)
+
+ENGINES = ["threads", "asyncio"]
+
+# Context window bounds of an automatically sized Ollama context, and the
+# room left in it for the answer.
+MIN_CONTEXT = 2048
+MAX_CONTEXT = 131072
+OUTPUT_TOKENS = 1024
+
+# Ollama settings read from config.yaml or given on the command line.
+OLLAMA_OPTIONS = ["keep_alive", "num_ctx", "num_predict", "preload"]
+
+# The tool Claude is made to call with the output as its input.
+OUTPUT_TOOL = "output"
+
+# Statuses of an API that does not take a schema to constrain the output to.
+SCHEMA_REJECTED_STATUS_CODES = (400, 422)
+
+# Options whose values are the daemon's own in runs handed to it, and their
+# defaults.
+DAEMON_SETTINGS = {
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "hedge_delay": (None, DEFAULT_HEDGE_PERCENTILE),
+    "pool_size": None,
+    "engine": "threads",
+    "cache_ttl": None,
+    "cache_size": DEFAULT_MAX_SIZE // (1024 * 1024),
+}
+
+# Requests in flight for all the clients of a `jt --serve` daemon.
+DEFAULT_SERVE_CONCURRENCY = 16
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    # One keep-alive pool per provider, sized for the number of concurrent
+    # workers so that no request has to wait for or discard a connection.
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 class ProviderType(Enum):
@@ -15,17 +126,265 @@ class ProviderType(Enum):
     LOCAL = "local"
 
 
-class LLMProvider(ABC):
+class HTTPProvider(LLMProvider):
+    session: requests.Session
+    pool_size: int = DEFAULT_POOL_SIZE
+    usage_tracker: Optional[UsageTracker] = None
+    rate_limiter: Optional[RateLimiter] = None
+    stream_request_options: Dict = {}
+    stream_format: str = SSE
+    # Whether a schema is also given to the API to constrain the output to;
+    # turned off by the first constrained request it rejects.
+    structured_outputs: bool = True
+    _async_session: Optional[AsyncSession] = None
+    _native_async: Optional[bool] = None
+
+    @abstractmethod
+    def _get_url(self) -> str:
+        pass
+
+    def cache_key(self, text: str, schema: Optional[str] = None) -> str:
+        # Endpoints serving the same model, such as a proxy and the API it
+        # fronts or two Ollama hosts, do not share answers.
+        return make_cache_key(
+            self.name, self._prepare_request_data(text, schema), self._get_url()
+        )
+
+    @abstractmethod
+    def _get_headers(self) -> Dict[str, str]:
+        pass
+
     @abstractmethod
+    def _parse_response(self, result: Dict) -> dict[str, any]:
+        pass
+
+    @abstractmethod
+    def _parse_usage(self, result: Dict) -> Dict[str, Optional[int]]:
+        pass
+
+    @abstractmethod
+    def _parse_stream_event(
+        self, event: Optional[str], message: Dict
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        # Returns the text and the usage counts carried by a stream event.
+        pass
+
+    def _constrain_output(self, data: Dict, schema: str):
+        # Adds the JSON schema of schema to the request data, for the APIs
+        # that can constrain their output to one.
+        pass
+
+    def _request_data(
+        self, text: str, schema: Optional[str], stream: bool, structured: bool = False
+    ) -> Dict:
+        data = self._prepare_request_data(text, schema)
+        data["stream"] = stream
+        if stream:
+            data.update(self.stream_request_options)
+        # Left out of the cache key: the answer to the prompt is the same.
+        if structured:
+            self._constrain_output(data, schema)
+        return data
+
+    def _use_structured_outputs(self, schema: Optional[str]) -> bool:
+        # Objects are the root type every structured output API takes.
+        if not (schema and self.structured_outputs):
+            return False
+        json_schema = to_json_schema(schema)
+        return json_schema is not None and json_schema.get("type") == "object"
+
+    def _is_rejected(self, structured: bool, response) -> bool:
+        return structured and response.status_code in SCHEMA_REJECTED_STATUS_CODES
+
+    def _request(
+        self, text: str, schema: Optional[str], stream: bool
+    ) -> requests.Response:
+        structured = self._use_structured_outputs(schema)
+        response = self._send(
+            self._request_data(text, schema, stream, structured), stream
+        )
+        if self._is_rejected(structured, response):
+            # The model or the API does not take this schema. The prompt alone
+            # describes it from now on, unless the API rejects that too.
+            response.close()
+            response = self._send(self._request_data(text, schema, stream), stream)
+            if not self._is_rejected(True, response):
+                self.structured_outputs = False
+        return response
+
+    def _complete(self, result: Dict, usage: RequestUsage) -> dict[str, any]:
+        usage.update(**self._parse_usage(result))
+        usage.time_to_first_token = usage.latency = usage.elapsed()
+        self._record_usage(usage)
+        return self._parse_response(result)
+
     def transform_text_to_json(
         self, text: str, schema: Optional[str] = None, stream: bool = False
     ) -> Union[dict[str, any], Generator[str, None, None]]:
-        pass
+        usage = RequestUsage()
+        response = self._request(text, schema, stream)
+        usage.time_to_first_byte = response.elapsed.total_seconds()
+        response.raise_for_status()
+
+        if stream:
+            return ResponseStream(self._track_stream(response, usage), response)
+        else:
+            return self._complete(response.json(), usage)
+
+    def _send(self, data: Dict, stream: bool) -> requests.Response:
+        def send():
+            return self.session.post(
+                self._get_url(),
+                headers=self._get_headers(),
+                json=data,
+                stream=stream,
+                timeout=REQUEST_TIMEOUT,
+            )
+
+        if self.rate_limiter is None:
+            return send()
+        return self.rate_limiter.call(send, cost=estimate_tokens(json.dumps(data)))
+
+    def _stream_response(
+        self, response: requests.Response, usage: RequestUsage
+    ) -> Generator[str, None, None]:
+        chunks = iter_response_chunks(response)
+        for event, message in decode_events(chunks, self.stream_format):
+            text, event_usage = self._parse_stream_event(event, message)
+            if event_usage:
+                usage.update(**event_usage)
+            if text:
+                yield text
+        # Read what is left of the response, usually only the end of the
+        # chunked body, so that the connection goes back to the pool.
+        for _ in chunks:
+            pass
+        response.close()
+
+    def _track_stream(
+        self, response: requests.Response, usage: RequestUsage
+    ) -> Generator[str, None, None]:
+        for chunk in self._stream_response(response, usage):
+            if usage.time_to_first_token is None:
+                usage.time_to_first_token = usage.elapsed()
+            yield chunk
+        usage.latency = usage.elapsed()
+        self._record_usage(usage)
 
     @property
-    @abstractmethod
-    def supports_streaming(self) -> bool:
-        pass
+    def async_session(self) -> AsyncSession:
+        # Created on first use, and again in a new event loop, whose
+        # connections the previous session's can not serve.
+        import asyncio
+
+        session = self._async_session
+        if session is None or session.loop is not asyncio.get_running_loop():
+            from .asynchttp import AsyncSession
+
+            if session is not None:
+                session.discard()
+            self._async_session = AsyncSession(self.pool_size)
+        return self._async_session
+
+    @property
+    def native_async(self) -> bool:
+        # The asyncio transport knows neither proxies nor custom CA bundles:
+        # with either, async requests go through requests on a thread.
+        if self._native_async is None:
+            import requests
+
+            url = self._get_url()
+            ca_bundle = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get(
+                "CURL_CA_BUNDLE"
+            )
+            self._native_async = not (
+                requests.utils.get_environ_proxies(url)
+                or (ca_bundle and url.startswith("https:"))
+            )
+        return self._native_async
+
+    async def transform_text_to_json_async(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], AsyncGenerator[str, None]]:
+        if not self.native_async:
+            return await super().transform_text_to_json_async(text, schema, stream)
+        usage = RequestUsage()
+        response = await self._request_async(text, schema, stream)
+        usage.time_to_first_byte = response.elapsed.total_seconds()
+        response.raise_for_status()
+
+        if stream:
+            return self._track_stream_async(response, usage)
+        else:
+            return self._complete(response.json(), usage)
+
+    async def _request_async(
+        self, text: str, schema: Optional[str], stream: bool
+    ) -> AsyncResponse:
+        structured = self._use_structured_outputs(schema)
+        data = self._request_data(text, schema, stream, structured)
+        response = await self._send_async(data, stream)
+        if self._is_rejected(structured, response):
+            response.close()
+            data = self._request_data(text, schema, stream)
+            response = await self._send_async(data, stream)
+            if not self._is_rejected(True, response):
+                self.structured_outputs = False
+        return response
+
+    async def _send_async(self, data: Dict, stream: bool) -> AsyncResponse:
+        async def send():
+            return await self.async_session.post(
+                self._get_url(),
+                headers=self._get_headers(),
+                json=data,
+                stream=stream,
+                timeout=REQUEST_TIMEOUT,
+            )
+
+        if self.rate_limiter is None:
+            return await send()
+        return await self.rate_limiter.call_async(
+            send, cost=estimate_tokens(json.dumps(data))
+        )
+
+    async def _stream_response_async(
+        self, response: AsyncResponse, usage: RequestUsage
+    ) -> AsyncGenerator[str, None]:
+        chunks = response.aiter_chunks()
+        try:
+            async for event, message in decode_events_async(chunks, self.stream_format):
+                text, event_usage = self._parse_stream_event(event, message)
+                if event_usage:
+                    usage.update(**event_usage)
+                if text:
+                    yield text
+            async for _ in chunks:
+                pass
+        finally:
+            response.close()
+
+    async def _track_stream_async(
+        self, response: AsyncResponse, usage: RequestUsage
+    ) -> AsyncGenerator[str, None]:
+        async for chunk in self._stream_response_async(response, usage):
+            if usage.time_to_first_token is None:
+                usage.time_to_first_token = usage.elapsed()
+            yield chunk
+        usage.latency = usage.elapsed()
+        self._record_usage(usage)
+
+    def _record_usage(self, usage: RequestUsage):
+        if self.usage_tracker:
+            self.usage_tracker.record(usage)
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        if self._async_session is not None:
+            await self._async_session.aclose()
+            self._async_session = None
 
 
 class ProviderInfo:
@@ -40,6 +399,7 @@ class ProviderRegistry:
     @classmethod
     def register(cls, name: str, provider_type: ProviderType):
         def decorator(provider_class: Type[LLMProvider]):
+            provider_class.name = name
             cls._providers[name] = ProviderInfo(provider_class, provider_type)
             return provider_class
 
@@ -58,344 +418,678 @@ class ProviderRegistry:
 
 
 @ProviderRegistry.register("openai", ProviderType.CLOUD)
-class OpenAIProvider(LLMProvider):
+class OpenAIProvider(HTTPProvider):
     supports_streaming = True
     default_model = "gpt-4o"
+    stream_request_options = {"stream_options": {"include_usage": True}}
+    default_api_base = "https://api.openai.com/v1"
 
-    def __init__(self, api_key: str, model: str | None = None):
+    def __init__(
+        self,
+        api_key: str,
+        model: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        api_base: str | None = None,
+    ):
         self.api_key = api_key
         self.model = model or self.default_model
+        self.api_base = api_base or self.default_api_base
+        self.pool_size = pool_size
+        self.session = create_session(pool_size)
 
-    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
-        system_message = "Transform the raw text to JSON\n"
-        if schema:
-            system_message += (
-                f"Use the following JSON schema to structure the output: {schema}\n"
-            )
-            system_message += (
-                "Without including extra schema information back in the response."
-            )
+    def _get_url(self) -> str:
+        return f"{self.api_base}/chat/completions"
 
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        # The system message is the static prefix picked up by the automatic
+        # prompt caching of the API.
         return {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": system_message},
-                {
-                    "role": "user",
-                    "content": f"Transform the following text into a JSON format: {text}",
-                },
+                {"role": "system", "content": build_system_prompt(schema)},
+                {"role": "user", "content": build_user_prompt(text)},
             ],
             "temperature": 0,
             "response_format": {"type": "json_object"},
         }
 
+    def _constrain_output(self, data: Dict, schema: str):
+        data["response_format"] = build_response_format(schema)
+
     def _get_headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
-    def transform_text_to_json(
-        self, text: str, schema: Optional[str] = None, stream: bool = False
-    ) -> Union[dict[str, any], Generator[str, None, None]]:
-        headers = self._get_headers()
-        data = self._prepare_request_data(text, schema)
-        data["stream"] = stream
-
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            stream=stream,
-        )
-        response.raise_for_status()
+    def _parse_response(self, result: Dict) -> dict[str, any]:
+        return json.loads(result["choices"][0]["message"]["content"])
 
-        if stream:
-            return self._stream_response(response)
-        else:
-            result = response.json()
-            transformed_text = result["choices"][0]["message"]["content"]
-            return json.loads(transformed_text)
+    def _parse_usage(self, result: Dict) -> Dict[str, Optional[int]]:
+        usage = result.get("usage") or {}
+        return {
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get(
+                "cached_tokens"
+            ),
+        }
 
-    def _stream_response(
-        self, response: requests.Response
-    ) -> Generator[str, None, None]:
-        for line in response.iter_lines():
-            if line:
-                line = line.decode("utf-8")
-                if line.startswith("data: "):
-                    line = line[6:]  # Remove 'data: ' prefix
-                    if line.strip() == "[DONE]":
-                        break
-                    try:
-                        json_response = json.loads(line)
-                        content = json_response["choices"][0]["delta"].get(
-                            "content", ""
-                        )
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+    def _parse_stream_event(
+        self, event: Optional[str], message: Dict
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        usage = self._parse_usage(message) if message.get("usage") else None
+        # The usage chunk comes last and has no choices.
+        choices = message.get("choices")
+        text = choices[0]["delta"].get("content") if choices else None
+        return text, usage
 
 
 @ProviderRegistry.register("mistral", ProviderType.CLOUD)
-class MistralProvider(LLMProvider):
+class MistralProvider(HTTPProvider):
     supports_streaming = True
     default_model = "mistral-large-latest"
+    default_api_base = "https://api.mistral.ai/v1"
 
-    def __init__(self, api_key: str, model: str | None = None):
+    def __init__(
+        self,
+        api_key: str,
+        model: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        api_base: str | None = None,
+    ):
         self.api_key = api_key
         self.model = model or self.default_model
+        self.api_base = api_base or self.default_api_base
+        self.pool_size = pool_size
+        self.session = create_session(pool_size)
 
-    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
-        system_message = "Transform the raw text to JSON\n"
-        if schema:
-            system_message += (
-                f"Use the following JSON schema to structure the output: {schema}\n"
-            )
-            system_message += (
-                "Without including extra schema information back in the response."
-            )
+    def _get_url(self) -> str:
+        return f"{self.api_base}/chat/completions"
 
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        # The system message is the static prefix picked up by the automatic
+        # prompt caching of the API.
         return {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": system_message},
-                {
-                    "role": "user",
-                    "content": f"Transform the following text into a JSON format: {text}",
-                },
+                {"role": "system", "content": build_system_prompt(schema)},
+                {"role": "user", "content": build_user_prompt(text)},
             ],
             "temperature": 0,
             "response_format": {"type": "json_object"},
         }
 
+    def _constrain_output(self, data: Dict, schema: str):
+        data["response_format"] = build_response_format(schema)
+
     def _get_headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
-    def transform_text_to_json(
-        self, text: str, schema: Optional[str] = None, stream: bool = False
-    ) -> Union[dict[str, any], Generator[str, None, None]]:
-        headers = self._get_headers()
-        data = self._prepare_request_data(text, schema)
-        data["stream"] = stream
-
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers=headers,
-            json=data,
-            stream=stream,
-        )
-        response.raise_for_status()
+    def _parse_response(self, result: Dict) -> dict[str, any]:
+        return json.loads(result["choices"][0]["message"]["content"])
 
-        if stream:
-            return self._stream_response(response)
-        else:
-            result = response.json()
-            transformed_text = result["choices"][0]["message"]["content"]
-            return json.loads(transformed_text)
+    def _parse_usage(self, result: Dict) -> Dict[str, Optional[int]]:
+        usage = result.get("usage") or {}
+        return {
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get(
+                "cached_tokens"
+            ),
+        }
 
-    def _stream_response(
-        self, response: requests.Response
-    ) -> Generator[str, None, None]:
-        for line in response.iter_lines():
-            if line:
-                line = line.decode("utf-8")
-                if line.startswith("data: "):
-                    line = line[6:]  # Remove 'data: ' prefix
-                    if line.strip() == "[DONE]":
-                        break
-                    try:
-                        json_response = json.loads(line)
-                        content = json_response["choices"][0]["delta"].get(
-                            "content", ""
-                        )
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+    def _parse_stream_event(
+        self, event: Optional[str], message: Dict
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        usage = self._parse_usage(message) if message.get("usage") else None
+        # The usage chunk comes last and has no choices.
+        choices = message.get("choices")
+        text = choices[0]["delta"].get("content") if choices else None
+        return text, usage
 
 
 @ProviderRegistry.register("claude", ProviderType.CLOUD)
-class ClaudeProvider(LLMProvider):
+class ClaudeProvider(HTTPProvider):
     supports_streaming = True
     default_model = "claude-3-5-sonnet-20240620"
+    default_api_base = "https://api.anthropic.com/v1"
 
-    def __init__(self, api_key: str, model: str | None = None):
+    def __init__(
+        self,
+        api_key: str,
+        model: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        api_base: str | None = None,
+    ):
         self.api_key = api_key
         self.model = model or self.default_model
+        self.api_base = api_base or self.default_api_base
+        self.pool_size = pool_size
+        self.session = create_session(pool_size)
 
-    def transform_text_to_json(
-        self, text: str, schema: Optional[str] = None, stream: bool = False
-    ) -> Union[dict[str, any], Generator[str, None, None]]:
-        headers = {
-            "x-api-key": self.api_key,
-            "Content-Type": "application/json",
-            "anthropic-version": "2023-06-01",
-        }
-
-        system_message = "transform the raw text to json\n"
-        if schema:
-            system_message += (
-                f" Use the following JSON schema to structure the output: {schema}\n"
-            )
-            system_message += (
-                "Without including extra schema information back in the response."
-            )
-
-        full_user_message = (
-            system_message
-            + f"\nTransform the following text into a JSON format: {text}\n\nOnly output json response without any comment or extra information."
-        )
+    def _get_url(self) -> str:
+        return f"{self.api_base}/messages"
 
-        data = {
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        return {
             "model": self.model,
             "max_tokens": 1024,
-            "messages": [{"role": "user", "content": full_user_message}],
+            # Marking the static prefix lets every record after the first read
+            # it from the prompt cache.
+            "system": [
+                {
+                    "type": "text",
+                    "text": build_system_prompt(schema),
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            "messages": [{"role": "user", "content": build_user_prompt(text)}],
             "temperature": 0,  # Set temperature to 0 for deterministic output,
-            "stream": stream,
         }
 
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            stream=stream,
-        )
-        response.raise_for_status()
+    def _get_headers(self) -> Dict[str, str]:
+        return {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json",
+            "anthropic-version": "2023-06-01",
+        }
 
-        if stream:
-            return self._stream_response(response)
-        else:
-            result = response.json()
-            transformed_text = result["content"][0]["text"]
-            return json.loads(transformed_text)
+    def _constrain_output(self, data: Dict, schema: str):
+        # The model is made to call a tool that takes the output as its
+        # input. The tool comes before the cached system prompt, so it is
+        # cached along with it.
+        data["tools"] = [
+            {
+                "name": OUTPUT_TOOL,
+                "description": "Record the JSON output.",
+                "input_schema": to_json_schema(schema),
+            }
+        ]
+        data["tool_choice"] = {"type": "tool", "name": OUTPUT_TOOL}
+
+    def _parse_response(self, result: Dict) -> dict[str, any]:
+        for block in result["content"]:
+            if block.get("type") == "tool_use":
+                return block["input"]
+        return json.loads(result["content"][0]["text"])
+
+    def _parse_usage(self, result: Dict) -> Dict[str, Optional[int]]:
+        usage = result.get("usage") or {}
+        # input_tokens excludes the tokens read from or written to the cache.
+        input_tokens = usage.get("input_tokens")
+        cached_tokens = usage.get("cache_read_input_tokens")
+        prompt_tokens = None
+        if input_tokens is not None:
+            prompt_tokens = (
+                input_tokens
+                + (cached_tokens or 0)
+                + (usage.get("cache_creation_input_tokens") or 0)
+            )
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": usage.get("output_tokens"),
+            "cached_tokens": cached_tokens,
+        }
 
-    def _stream_response(
-        self, response: requests.Response
-    ) -> Generator[str, None, None]:
-        for line in response.iter_lines():
-            if line:
-                line = line.decode("utf-8")
-                if line.startswith("event: content_block_stop") or line.startswith(
-                    "event: message_stop"
-                ):
-                    break
-                if line.startswith("data: "):
-                    line = line[6:]  # Remove 'data: ' prefix
-                    try:
-                        json_response = json.loads(line)
-                        type_msg = json_response.get("type")
-                        if type_msg == "content_block_start":
-                            content = json_response.get("ccontent_block", None)
-                            if content:
-                                text = content.get("text", None)
-                                if text:
-                                    yield text
-                        elif type_msg == "content_block_delta":
-                            content = json_response.get("delta", None)
-                            if content:
-                                text = content.get("text", None)
-                                if text:
-                                    yield text
-                    except json.JSONDecodeError:
-                        continue
+    def _parse_stream_event(
+        self, event: Optional[str], message: Dict
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        # The output token count only arrives in message_delta, after the
+        # last content block.
+        type_msg = message.get("type")
+        if type_msg == "message_start":
+            return None, self._parse_usage(message.get("message", {}))
+        if type_msg == "message_delta":
+            return None, self._parse_usage(message)
+        if type_msg == "content_block_start":
+            return (message.get("content_block") or {}).get("text"), None
+        if type_msg == "content_block_delta":
+            # The input of the output tool streams as partial JSON.
+            delta = message.get("delta") or {}
+            return delta.get("text", delta.get("partial_json")), None
+        return None, None
 
 
 @ProviderRegistry.register("ollama", ProviderType.LOCAL)
-class OllamaProvider(LLMProvider):
+class OllamaProvider(HTTPProvider):
     supports_streaming = True
+    stream_format = NDJSON
     default_model = "llama3.1"
 
     def __init__(
-        self, api_url: str = "http://127.0.0.1:11434", model: str | None = None
+        self,
+        api_url: str = "http://127.0.0.1:11434",
+        model: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        keep_alive: Union[str, float, None] = None,
+        num_ctx: Union[int, str, None] = None,
+        num_predict: Optional[int] = None,
+        preload: bool = False,
     ):
         self.api_url = api_url
         self.model = model or self.default_model
+        self.pool_size = pool_size
+        self.session = create_session(pool_size)
+        # How long the server keeps the model loaded after a request.
+        self.keep_alive = keep_alive
+        # A context window size, or "auto" to size it from the prompts.
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.preload = preload
+        self.context_size = num_ctx if isinstance(num_ctx, int) else MIN_CONTEXT
+        self._context_lock = threading.Lock()
+
+    def _get_url(self) -> str:
+        return f"{self.api_url}/api/generate"
 
-    def transform_text_to_json(
-        self, text: str, schema: Optional[str] = None, stream: bool = False
-    ) -> Union[dict[str, any], Generator[str, None, None]]:
-        headers = {
-            "Content-Type": "application/json",
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        # Ollama keeps the evaluated prompt of the previous request and only
+        # evaluates what follows the longest common prefix.
+        options = {
+            "temperature": 0,  # Set temperature to 0 for deterministic output
+        }
+        if self.num_predict:
+            options["num_predict"] = self.num_predict
+        return {
+            "system": build_system_prompt(schema),
+            "prompt": build_user_prompt(text),
+            "model": self.model,
+            "format": "json",
+            "options": options,
         }
 
-        prompt = f"Transform the following text into a JSON format: {text}\n"
-        if schema:
-            prompt += (
-                f"Use the following JSON schema to structure the output: {schema}\n"
+    def _constrain_output(self, data: Dict, schema: str):
+        # The schema constrains the sampling of the model to it.
+        data["format"] = to_json_schema(schema)
+
+    def _request_data(
+        self, text: str, schema: Optional[str], stream: bool, structured: bool = False
+    ) -> Dict:
+        # Settings of the server rather than of the answer, so left out of
+        # the cache key.
+        data = super()._request_data(text, schema, stream, structured)
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+        if self.num_ctx == "auto":
+            self._fit_context(data["system"] + data["prompt"])
+        if self.num_ctx is not None:
+            data["options"]["num_ctx"] = self.context_size
+        return data
+
+    def _fit_context(self, prompt: str):
+        # Prompts longer than the context are truncated by the server, and
+        # every other context size reloads the model: the context only grows,
+        # doubling, to fit the longest prompt so far and its answer.
+        needed = estimate_tokens(prompt) + (self.num_predict or OUTPUT_TOKENS)
+        with self._context_lock:
+            context_size = self.context_size
+            while context_size < needed and context_size < MAX_CONTEXT:
+                context_size *= 2
+            self.context_size = context_size
+
+    def warm_up(self):
+        # A request without a prompt loads the model and returns, so that the
+        # first record does not wait for the load.
+        data = {"model": self.model, "stream": False}
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+        if self.num_ctx is not None:
+            data["options"] = {"num_ctx": self.context_size}
+        import requests
+
+        try:
+            self.session.post(
+                self._get_url(),
+                headers=self._get_headers(),
+                json=data,
+                timeout=REQUEST_TIMEOUT,
             )
-        prompt += "Only output json response without any comment or extra information."
+        except requests.RequestException:
+            pass  # reported by the first request instead
 
-        data = {
-            "prompt": prompt,
-            "model": self.model,
-            "format": "json",
-            "stream": stream,
-            "options": {
-                "temperature": 0,  # Set temperature to 0 for deterministic output
-            },
+    def _get_headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+        }
+
+    def _parse_response(self, result: Dict) -> dict[str, any]:
+        return json.loads(result["response"])
+
+    def _parse_usage(self, result: Dict) -> Dict[str, Optional[int]]:
+        return {
+            "prompt_tokens": result.get("prompt_eval_count"),
+            "completion_tokens": result.get("eval_count"),
         }
 
-        response = requests.post(
-            f"{self.api_url}/api/generate",
-            headers=headers,
-            json=data,
-            stream=stream,
+    def _parse_stream_event(
+        self, event: Optional[str], message: Dict
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        usage = self._parse_usage(message) if message.get("done") else None
+        return message.get("response"), usage
+
+
+class ResponseStream(abc.Generator):
+    # The chunks of a streamed response. Closing it closes the response even
+    # before the first chunk is read, which closing a generator that has not
+    # started does not.
+
+    def __init__(self, chunks: Generator[str, None, None], response):
+        self.chunks = chunks
+        self.response = response
+
+    def send(self, value):
+        return self.chunks.send(value)
+
+    def throw(self, *args):
+        return self.chunks.throw(*args)
+
+    def close(self):
+        self.chunks.close()
+        self.response.close()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_batches(
+    lines: Iterable[str],
+    max_records: int = 1,
+    max_tokens: int = 4000,
+    key: Optional[Callable[[any], str]] = None,
+) -> Iterator[List[str]]:
+    batch: List[str] = []
+    batch_tokens = 0
+    for line in lines:
+        tokens = estimate_tokens(key(line) if key else line)
+        if batch and (len(batch) >= max_records or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(line)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def transform_record(
+    provider: LLMProvider,
+    text: str,
+    schema: Optional[str],
+    validator: Optional[CompiledSchema],
+) -> Union[dict[str, any], json.JSONDecodeError]:
+    # With a validator, an answer that is not JSON is returned as its parse
+    # error, to be retried like one that does not match the schema rather
+    # than failing the whole run.
+    try:
+        return provider.transform_text_to_json(text, schema)
+    except json.JSONDecodeError as error:
+        if validator is None:
+            raise
+        return error
+
+
+def output_errors(
+    output: Union[dict[str, any], json.JSONDecodeError], validator: CompiledSchema
+) -> List[str]:
+    if isinstance(output, json.JSONDecodeError):
+        return [f"not valid JSON: {output}"]
+    return validator.validate(output)
+
+
+def invalid_output(
+    text: str, output: Union[dict[str, any], json.JSONDecodeError], errors: List[str]
+) -> InvalidOutput:
+    if isinstance(output, json.JSONDecodeError):
+        output = output.doc
+    return InvalidOutput(text, output, errors)
+
+
+def validate_output(
+    provider: LLMProvider,
+    text: str,
+    output: Union[dict[str, any], json.JSONDecodeError],
+    schema: Optional[str],
+    validator: CompiledSchema,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+) -> Union[dict[str, any], InvalidOutput]:
+    errors = output_errors(output, validator)
+    for _ in range(retries):
+        if not errors:
+            break
+        # Only the failing record is sent again, with the errors as feedback,
+        # past the response cache.
+        output = transform_record(
+            provider.uncached, build_retry_prompt(text, errors), schema, validator
         )
-        response.raise_for_status()
+        errors = output_errors(output, validator)
+    return invalid_output(text, output, errors) if errors else output
+
+
+def transform_batch(
+    provider: LLMProvider,
+    texts: List[str],
+    schema: Optional[str] = None,
+    validator: Optional[CompiledSchema] = None,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+) -> List[Union[dict[str, any], InvalidOutput]]:
+    if len(texts) == 1:
+        outputs = [transform_record(provider, texts[0], schema, validator)]
+    else:
+        try:
+            outputs = provider.transform_batch_to_json(texts, schema)
+        except json.JSONDecodeError:
+            # Usually a response truncated by the output token limit: halve the
+            # batch and try again rather than failing every record in it.
+            middle = len(texts) // 2
+            return transform_batch(
+                provider, texts[:middle], schema, validator, retries
+            ) + transform_batch(provider, texts[middle:], schema, validator, retries)
+
+        # Only the records the model failed to align are sent again, one by one.
+        outputs = [
+            output
+            if output is not None
+            else transform_record(provider, text, schema, validator)
+            for text, output in zip(texts, outputs)
+        ]
+
+    if validator is None:
+        return outputs
+    return [
+        validate_output(provider, text, output, schema, validator, retries)
+        for text, output in zip(texts, outputs)
+    ]
+
+
+def transform_lines(
+    provider: LLMProvider,
+    lines: Iterable[str],
+    schema: Optional[str] = None,
+    concurrency: int = 1,
+    ordered: bool = True,
+    batch_size: int = 1,
+    batch_tokens: int = 4000,
+    validator: Optional[CompiledSchema] = None,
+    retries: int = DEFAULT_SCHEMA_RETRIES,
+    keyed: bool = False,
+    coalescer: Optional[RecordCoalescer] = None,
+) -> Iterator[Union[dict[str, any], InvalidOutput]]:
+    # With keyed=True, lines are (key, text) pairs and (key, result) pairs
+    # are returned, so that results can be traced back to their input even
+    # when they are output out of order.
+    pairs = lines if keyed else ((None, line) for line in lines)
+    results = transform_keyed_lines(
+        provider,
+        pairs,
+        schema,
+        concurrency,
+        ordered,
+        batch_size,
+        batch_tokens,
+        validator,
+        retries,
+        coalescer,
+    )
+    if keyed:
+        return results
+    return (result for _, result in results)
+
+
+def transform_keyed_lines(
+    provider: LLMProvider,
+    pairs: Iterable[Tuple[any, str]],
+    schema: Optional[str],
+    concurrency: int,
+    ordered: bool,
+    batch_size: int,
+    batch_tokens: int,
+    validator: Optional[CompiledSchema],
+    retries: int,
+    coalescer: Optional[RecordCoalescer] = None,
+) -> Iterator[Tuple[any, Union[dict[str, any], InvalidOutput]]]:
+    batches = pack_batches(pairs, batch_size, batch_tokens, key=itemgetter(1))
+
+    def transform(texts: List[str]) -> List[Union[dict[str, any], InvalidOutput]]:
+        return transform_batch(provider, texts, schema, validator, retries)
+
+    def run(batch: List[Tuple[any, str]]):
+        keys, texts = zip(*batch)
+        if coalescer is not None:
+            return zip(keys, coalescer.run(list(texts), transform))
+        return zip(keys, transform(list(texts)))
+
+    if concurrency <= 1:
+        for batch in batches:
+            yield from run(batch)
+        return
 
-        if stream:
-            return self._stream_response(response)
+    # Keep a bounded window of in-flight requests so a huge input is never
+    # fully queued in memory, while workers always have the next batch ready.
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    window = concurrency * 2
+    in_flight = deque() if ordered else set()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for batch in batches:
+            if len(in_flight) >= window:
+                if ordered:
+                    yield from in_flight.popleft().result()
+                else:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        in_flight.remove(future)
+                        yield from future.result()
+            future = executor.submit(run, batch)
+            if ordered:
+                in_flight.append(future)
+            else:
+                in_flight.add(future)
+
+        while in_flight:
+            if ordered:
+                yield from in_flight.popleft().result()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    yield from future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def display_streaming_response(
+    generator: Generator[str, None, None], writer: OutputWriter
+):
+    for chunk in generator:
+        writer.write_text(chunk)
+    writer.write_text("\n")
+
+
+def display_partial_response(
+    generator: Generator[str, None, None], mode: str, writer: OutputWriter
+):
+    parser = IncrementalJSONParser()
+
+    def emit(events):
+        if not events:
+            return
+        if mode == "patch":
+            for event in events:
+                writer.write_text(json.dumps(event) + "\n")
         else:
-            result = response.json()
-            transformed_text = result["response"]
-            return json.loads(transformed_text)
+            writer.write_text(json.dumps(parser.value) + "\n")
 
-    def _stream_response(
-        self, response: requests.Response
-    ) -> Generator[str, None, None]:
-        for line in response.iter_lines():
-            if line:
-                line = line.decode("utf-8")
-                try:
-                    json_response = json.loads(line)
-                    if json_response.get("done", False):
-                        break
-                    response = json_response.get("response", None)
-                    if response:
-                        yield response
-                except json.JSONDecodeError:
-                    continue
-
-
-def display_streaming_response(generator: Generator[str, None, None]):
     for chunk in generator:
-        sys.stdout.write(chunk)
-        sys.stdout.flush()
-    sys.stdout.write("\n")
-    sys.stdout.flush()
+        emit(parser.feed(chunk))
+    emit(parser.close())
+
+
+def get_config_file_path() -> str:
+    config_dir = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+    return os.path.join(config_dir, "jsonthat", "config.yaml")
 
 
 class Config:
-    def __init__(self):
+    def __init__(self, config: Optional[Dict] = None):
+        # A config given in full is used instead of config.yaml.
         self.config_file = self.get_config_file_path()
-        self.config = self.load_config()
+        self.config = self.load_config() if config is None else config
 
     def get_config_file_path(self):
-        config_dir = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
-        return os.path.join(config_dir, "jsonthat", "config.yaml")
+        return get_config_file_path()
+
+    def get_snapshot_path(self):
+        import hashlib
+
+        cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        digest = hashlib.sha1(self.config_file.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(cache_dir, "jsonthat", f"config-{digest}.json")
 
     def load_config(self):
-        if os.path.exists(self.config_file):
-            with open(self.config_file, "r") as f:
-                return yaml.safe_load(f)
-        return {"providers": {}, "default_provider": None}
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return {"providers": {}, "default_provider": None}
+
+        # Parsing YAML requires importing yaml, which is slow. A JSON copy of
+        # the parsed config is kept and reused until the file changes.
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        snapshot_path = self.get_snapshot_path()
+        try:
+            with open(snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            if snapshot["stamp"] == stamp:
+                return snapshot["config"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        import yaml
+
+        with open(self.config_file, "r") as f:
+            config = yaml.safe_load(f)
+        self.save_snapshot(snapshot_path, stamp, config)
+        return config
+
+    def save_snapshot(self, snapshot_path: str, stamp: List[int], config: Dict):
+        # The config holds API keys: only its owner may read the copy.
+        try:
+            os.makedirs(os.path.dirname(snapshot_path), mode=0o700, exist_ok=True)
+            tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w") as f:
+                json.dump({"stamp": stamp, "config": config}, f)
+            os.replace(tmp_path, snapshot_path)
+        except (OSError, TypeError, ValueError):
+            pass
 
     def save_config(self):
+        import yaml
+
         os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
         with open(self.config_file, "w") as f:
             yaml.dump(self.config, f)
@@ -431,10 +1125,17 @@ class Config:
         ):
             print("Configuration is empty. Run 'jt --setup' to configure the tool.")
         else:
+            import yaml
+
             print(yaml.dump(self.config, default_flow_style=False))
 
 
-def get_provider(config: Config, provider_name: Optional[str] = None) -> LLMProvider:
+def get_provider(
+    config: Config,
+    provider_name: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    options: Optional[Dict] = None,
+) -> LLMProvider:
     if not provider_name:
         provider_name = (
             os.environ.get("LLM_PROVIDER") or config.get_default_provider() or "openai"
@@ -443,26 +1144,154 @@ def get_provider(config: Config, provider_name: Optional[str] = None) -> LLMProv
     provider_info = ProviderRegistry.get_provider_info(provider_name)
     provider_config = config.get_provider_config(provider_name)
 
+    # Pools of keys or endpoints are lists whose items are either a value or
+    # a mapping with the value and a weight.
     if provider_info.provider_type == ProviderType.CLOUD:
-        api_key = os.environ.get("LLM_API_KEY") or provider_config.get("api_key")
-        if not api_key:
+        pool = parse_pool(provider_config, "api_key", os.environ.get("LLM_API_KEY"))
+        if not pool:
             raise ValueError(
                 f"API key not found for {provider_name}.\nPlease run the setup command:\njt --setup\n"
             )
         model = os.environ.get("LLM_MODEL") or provider_config.get("model")
-        provider_config = {"api_key": api_key, "model": model}
+        api_base = os.environ.get("LLM_API_BASE") or provider_config.get("api_base")
+        members = [
+            {"api_key": api_key, "model": model, "api_base": api_base}
+            for api_key, _ in pool
+        ]
     elif provider_name == "ollama":
-        api_url = os.environ.get("OLLAMA_API_URL") or provider_config.get(
-            "api_url", "http://127.0.0.1:11434"
-        )
+        pool = parse_pool(
+            provider_config, "api_url", os.environ.get("OLLAMA_API_URL")
+        ) or [("http://127.0.0.1:11434", 1.0)]
         model = os.environ.get("OLLAMA_MODEL") or provider_config.get("model")
-        provider_config = {"api_url": api_url, "model": model}
+        # Options given on the command line override those of config.yaml.
+        tuning = {
+            name: value
+            for name in OLLAMA_OPTIONS
+            if (value := (options or {}).get(name, provider_config.get(name)))
+            is not None
+        }
+        members = [
+            {"api_url": api_url, "model": model, **tuning} for api_url, _ in pool
+        ]
+    else:
+        pool = [(None, 1.0)]
+        members = [provider_config]
+
+    providers = [
+        provider_info.provider_class(**member, pool_size=pool_size)
+        for member in members
+    ]
+    if len(providers) == 1:
+        return providers[0]
+    return LoadBalancedProvider(
+        providers,
+        [weight for _, weight in pool],
+        provider_config.get("balance", "least-outstanding"),
+    )
 
-    return provider_info.provider_class(**provider_config)
+
+def build_provider(
+    config: Config,
+    provider_names: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    concurrency: int = 1,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    hedge_delay: Optional[float] = None,
+    hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+    usage_tracker: Optional[UsageTracker] = None,
+    options: Optional[Dict] = None,
+) -> Tuple[LLMProvider, List[Tuple[str, HTTPProvider]]]:
+    # Returns the provider for a comma-separated list of provider names, in
+    # order of preference, and its endpoints with a label for each.
+    providers = [
+        get_provider(config, name, pool_size=pool_size, options=options)
+        for name in (provider_names.split(",") if provider_names else [None])
+    ]
+    if len(providers) > 1:
+        provider = HedgedProvider(providers, hedge_delay, hedge_percentile)
+    else:
+        provider = providers[0]
+
+    # Each provider, API key and endpoint is paced by its own rate limits.
+    # The members of a pool leave the retries to the pool.
+    endpoints = []
+    for member in providers:
+        if isinstance(member, LoadBalancedProvider):
+            member.max_retries = max_retries
+            for index, endpoint in enumerate(member.members, start=1):
+                endpoint.rate_limiter = RateLimiter(concurrency, max_retries=0)
+                endpoints.append((f"{member.name}#{index} ", endpoint))
+        else:
+            member.rate_limiter = RateLimiter(concurrency, max_retries=max_retries)
+            endpoints.append((f"{member.name} " if len(providers) > 1 else "", member))
+    for _, endpoint in endpoints:
+        endpoint.usage_tracker = usage_tracker
+        if isinstance(endpoint, OllamaProvider) and endpoint.preload:
+            # Daemon threads: the model keeps loading if jt exits first.
+            threading.Thread(target=endpoint.warm_up, daemon=True).start()
+    return provider, endpoints
+
+
+def get_default_concurrency(config: Config, provider_names: Optional[str]) -> int:
+    # Enough requests to fill the parallel slots of the Ollama servers, as
+    # set with OLLAMA_NUM_PARALLEL on the server; one for other providers.
+    name = provider_names.split(",")[0] if provider_names else None
+    name = name or os.environ.get("LLM_PROVIDER") or config.get_default_provider()
+    if name != "ollama":
+        return 1
+    provider_config = config.get_provider_config("ollama")
+    slots = provider_config.get("num_parallel") or os.environ.get("OLLAMA_NUM_PARALLEL")
+    if not slots:
+        return 1
+    try:
+        count = int(slots)
+    except (TypeError, ValueError):
+        count = 0
+    if count < 1:
+        raise ValueError(
+            f"num_parallel of ollama must be a positive integer, got {slots!r}"
+        )
+    endpoints = parse_pool(provider_config, "api_url", os.environ.get("OLLAMA_API_URL"))
+    return count * max(len(endpoints), 1)
 
 
-def read_stdin() -> str:
-    return sys.stdin.read().strip()
+def parse_keep_alive(value: str) -> Union[str, float]:
+    # Ollama takes a number of seconds or a duration such as "10m"; a
+    # negative value keeps the model loaded until the server stops.
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_num_ctx(value: str) -> Union[int, str]:
+    if value == "auto":
+        return value
+    try:
+        if int(value) > 0:
+            return int(value)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected a token count or auto, got {value!r}")
+
+
+def parse_pool(
+    provider_config: Dict, field: str, override: Optional[str] = None
+) -> List[Tuple[str, float]]:
+    if override:
+        return [(override, 1.0)]
+    items = provider_config.get(f"{field}s") or [provider_config.get(field)]
+    pool = []
+    for item in items:
+        if isinstance(item, dict):
+            value, weight = item.get(field), float(item.get("weight", 1))
+            if weight <= 0:
+                raise ValueError(f"Weight of a {field} must be positive")
+        else:
+            value, weight = item, 1.0
+        if value:
+            pool.append((value, weight))
+    return pool
 
 
 def read_schema_file(file_path: str) -> str:
@@ -554,6 +1383,14 @@ def example():
     print("  echo 'raw text' | jt --schema schema.json")
     print("  echo 'raw text' | jt --provider openai")
     print("  echo 'raw text' | jt --stream")
+    print("  echo 'raw text' | jt --partial patch")
+    print("  cat logs.txt | jt --line --concurrency 8")
+    print("  cat logs.txt | jt --line --batch-size 20")
+    print("  cat logs.txt | jt batch submit")
+    print("  jt batch collect <job-id>")
+    print("  cat book.txt | jt --long --concurrency 4")
+    print("  cat logs.txt | jt --line --usage --usage-json usage.json")
+    print("  jt --serve &")
     print("""
   echo 'my name is jay' | jt
   {
@@ -562,6 +1399,155 @@ def example():
     print()
 
 
+def parse_hedge_delay(value: str) -> Tuple[Optional[float], float]:
+    # Returns a fixed delay, or None and the latency percentile to use.
+    try:
+        if value.startswith("p"):
+            rank = float(value[1:])
+            if 0 < rank <= 100:
+                return None, rank
+        elif float(value) >= 0:
+            return float(value), DEFAULT_HEDGE_PERCENTILE
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(
+        f"expected a number of seconds or a percentile such as p95, got {value!r}"
+    )
+
+
+async def output_async(
+    provider: LLMProvider,
+    lines: Iterable[Tuple[any, str]],
+    schema: Optional[str],
+    output: Callable,
+    options: Dict,
+):
+    from .aio import transform_lines_async
+
+    try:
+        async for key, result in transform_lines_async(
+            provider, lines, schema, **options
+        ):
+            output(result, key)
+    finally:
+        # The connections belong to this event loop.
+        await provider.aclose()
+
+
+def get_ollama_options(args: argparse.Namespace) -> Dict:
+    options = {
+        "keep_alive": args.ollama_keep_alive,
+        "num_ctx": args.ollama_num_ctx,
+        "num_predict": args.ollama_num_predict,
+        "preload": args.ollama_preload,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def serve_command(config: Config, args: argparse.Namespace):
+    from .daemon import Daemon, get_socket_path, serve
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            max_size=args.cache_size * 1024 * 1024, ttl=args.cache_ttl
+        )
+    hedge_delay, hedge_percentile = args.hedge_delay
+    daemon = Daemon(
+        config,
+        concurrency=args.concurrency,
+        pool_size=args.pool_size,
+        max_retries=args.max_retries,
+        hedge_delay=hedge_delay,
+        hedge_percentile=hedge_percentile,
+        cache=cache,
+        options=get_ollama_options(args),
+    )
+    try:
+        # Built up front, so that a preloaded model is loading already.
+        daemon.get_provider(args.provider)
+    except ValueError:
+        pass
+    try:
+        serve(daemon, args.socket or get_socket_path())
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run_forwarded(
+    args: argparse.Namespace, paths: List[str], delimiter
+) -> Optional[int]:
+    # Returns the exit status, or None when no daemon takes the run.
+    from .daemon import connect, forward, get_socket_path
+
+    connection = connect(args.socket or get_socket_path())
+    if connection is None:
+        return None
+
+    schema = read_schema_file(args.schema) if args.schema else None
+    if args.line:
+        lines = iter_records(paths, delimiter, numbered=True)
+    else:
+        # Read only once the daemon takes the run, so that stdin is left to
+        # the local run when it declines it.
+        lines = (((path, 1), text) for path in paths if (text := read_text(path)))
+    request = {
+        "provider": args.provider,
+        "schema": schema,
+        "concurrency": args.concurrency,
+        "ordered": not args.unordered,
+        "batch_size": args.batch_size,
+        "batch_tokens": args.batch_tokens,
+        "schema_retries": args.schema_retries,
+        "dedupe": args.line and not args.no_dedupe,
+        "cache": not args.no_cache,
+        "refresh": args.refresh,
+    }
+
+    # The writer is only made once the daemon takes the run: closing one
+    # opens and ends a --output json array, which the local run that
+    # follows a decline writes on its own.
+    writer = None
+    invalid_records = 0
+    empty = False
+    try:
+        results = forward(connection, request, lines)
+        if results is None:
+            return None
+        writer = OutputWriter(mode=args.output, line_numbers=args.line_numbers)
+        for key, result in results:
+            if isinstance(result, InvalidOutput):
+                invalid_records += 1
+                print(f"Error: {result.format()}", file=sys.stderr)
+            else:
+                writer.write(result, key)
+        empty = not args.line and writer.records == invalid_records == 0
+        if empty:
+            print("Error: No input provided.", file=sys.stderr)
+            return 1
+    except KeyboardInterrupt:
+        print("\nProcessing aborted.")
+        return 1
+    except OSError as e:
+        print(f"Error: Failed to read input. {e}", file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if writer is not None and not empty:
+            writer.close()
+
+    if invalid_records:
+        print(
+            f"Error: {invalid_records} records did not match the schema.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
 class CustomHelpParser(argparse.ArgumentParser):
     def print_help(self):
         super().print_help()
@@ -569,12 +1555,29 @@ class CustomHelpParser(argparse.ArgumentParser):
 
 
 def main():
-    config = Config()
+    if sys.argv[1:2] == ["batch"]:
+        from .batch import batch_command
+
+        batch_command(Config(), sys.argv[2:])
+        return
 
     parser = CustomHelpParser(description="Text to JSON CLI")
     parser.add_argument("--setup", action="store_true", help="Run the setup command")
     parser.add_argument("--schema", type=str, help="Path to the schema file")
-    parser.add_argument("--provider", type=str, help="Specify the LLM provider to use")
+    parser.add_argument(
+        "--provider",
+        type=str,
+        help="Specify the LLM provider to use, or a comma-separated list of "
+        "providers to hedge slow requests and fail over to in order",
+    )
+    parser.add_argument(
+        "--hedge-delay",
+        type=parse_hedge_delay,
+        metavar="SECONDS|pNN",
+        help="Wait before also sending a request to the next provider: a number "
+        "of seconds, or a percentile of the observed latency of the provider "
+        f"(default: p{DEFAULT_HEDGE_PERCENTILE})",
+    )
     parser.add_argument(
         "--version", action="store_true", help="Show the version and exit"
     )
@@ -582,34 +1585,390 @@ def main():
         "--config", action="store_true", help="Display current configuration"
     )
     parser.add_argument("--stream", action="store_true", help="Stream the output")
+    parser.add_argument(
+        "--output",
+        choices=OUTPUT_MODES,
+        default="pretty",
+        help="Output indented JSON, one compact JSON record per line, or a "
+        "single JSON array (default: pretty)",
+    )
+    parser.add_argument(
+        "--line-numbers",
+        action="store_true",
+        help='Output {"line": n, "output": ...} for each record (with --line)',
+    )
+    parser.add_argument(
+        "--partial",
+        choices=["snapshot", "patch"],
+        help="Stream completed fields as JSON snapshots or JSON Patch events",
+    )
     parser.add_argument(
         "--line", action="store_true", help="Process input line by line"
     )
+    parser.add_argument(
+        "--input",
+        action="append",
+        metavar="PATH",
+        help="Read input from PATH instead of stdin, gzip and zstd files included "
+        "(repeatable, accepts globs)",
+    )
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="Records are separated by NUL characters (with --line)",
+    )
+    parser.add_argument(
+        "--delimiter",
+        metavar="REGEX",
+        help="Records are separated by matches of REGEX (with --line)",
+    )
+    parser.add_argument(
+        "--no-dedupe",
+        action="store_true",
+        help="Send every record, even those identical to an earlier one (with --line)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="PATH",
+        help="Record each completed record in a journal at PATH (with --line)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the records completed in the --checkpoint journal",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of lines to transform in parallel (with --line), or the "
+        "number of requests in flight for all clients (with --serve)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        help="Send concurrent requests from worker threads, or as asyncio tasks "
+        "for hundreds of requests in flight (default: threads)",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Output lines as soon as they are ready instead of in input order",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Pack up to this many lines into a single request (with --line)",
+    )
+    parser.add_argument(
+        "--batch-tokens",
+        type=int,
+        default=4000,
+        help="Approximate input token budget of a packed request (default: 4000)",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="Number of pooled HTTP connections (default: --concurrency)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Disable the response cache"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached responses but store the new ones",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Maximum age in seconds of a cached response",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        help="Maximum size of the response cache in MB (default: 100)",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print cache hit and miss counts to stderr",
+    )
+    parser.add_argument(
+        "--long",
+        action="store_true",
+        help="Split long input into chunks and merge the extracted JSON",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=4000,
+        help="Approximate size of a chunk in tokens (with --long, default: 4000)",
+    )
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=200,
+        help="Approximate overlap between chunks in tokens (with --long, default: 200)",
+    )
+    parser.add_argument(
+        "--usage",
+        action="store_true",
+        help="Print token, latency, throughput and cache usage to stderr",
+    )
+    parser.add_argument(
+        "--usage-json",
+        type=str,
+        metavar="PATH",
+        help="Write a JSON usage report to PATH",
+    )
+    parser.add_argument(
+        "--schema-retries",
+        type=int,
+        default=DEFAULT_SCHEMA_RETRIES,
+        help="Retries of a record whose output does not match the schema "
+        f"(default: {DEFAULT_SCHEMA_RETRIES})",
+    )
+    parser.add_argument(
+        "--ollama-keep-alive",
+        type=parse_keep_alive,
+        metavar="DURATION",
+        help="Keep the Ollama model loaded this long after a request, in seconds "
+        "or as 10m, -1 for ever",
+    )
+    parser.add_argument(
+        "--ollama-num-ctx",
+        type=parse_num_ctx,
+        metavar="TOKENS|auto",
+        help="Ollama context window size, or auto to fit the longest prompt",
+    )
+    parser.add_argument(
+        "--ollama-num-predict",
+        type=int,
+        metavar="TOKENS",
+        help="Maximum number of tokens Ollama generates for a record",
+    )
+    parser.add_argument(
+        "--ollama-preload",
+        action="store_true",
+        default=None,
+        help="Load the Ollama model as soon as jt starts",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a daemon that keeps providers, connections and the cache warm "
+        "for other jt calls",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Unix socket of the daemon (default: $XDG_RUNTIME_DIR/jsonthat.sock)",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Do not hand the work to a running daemon",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        help="Retries of a request on rate limit, server and connection errors "
+        f"(default: {DEFAULT_MAX_RETRIES})",
+    )
     args = parser.parse_args()
 
+    # Settings a daemon has its own values for: a run that gives any of them
+    # is not handed to it. Their defaults are filled in once that is known.
+    local_settings = [
+        name for name in DAEMON_SETTINGS if getattr(args, name) is not None
+    ]
+    for name, default in DAEMON_SETTINGS.items():
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+
+    if args.serve and args.concurrency is None:
+        args.concurrency = DEFAULT_SERVE_CONCURRENCY
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.long and args.line:
+        parser.error("--long cannot be used with --line")
+    if (args.null or args.delimiter) and not args.line:
+        parser.error("--null and --delimiter require --line")
+    if args.line_numbers and not args.line:
+        parser.error("--line-numbers requires --line")
+    if args.checkpoint and not args.line:
+        parser.error("--checkpoint requires --line")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if args.checkpoint and (args.stream or args.partial):
+        # Streamed records are printed as they arrive, never journaled.
+        parser.error("--checkpoint cannot be used with --stream or --partial")
+    if args.resume and args.output == "json":
+        # The resumed run would append a second array to the output.
+        parser.error("--resume cannot be used with --output json")
+    if args.no_dedupe and not args.line:
+        parser.error("--no-dedupe requires --line")
+    if args.null and args.delimiter:
+        parser.error("--null cannot be used with --delimiter")
+    if args.partial and args.output == "json":
+        # A stream of events, not records to gather in an array.
+        parser.error("--partial cannot be used with --output json")
+    if args.chunk_tokens < 1:
+        parser.error("--chunk-tokens must be at least 1")
+    if not 0 <= args.chunk_overlap < args.chunk_tokens:
+        # Each chunk must start past the start of the one before it.
+        parser.error("--chunk-overlap must be at least 0 and below --chunk-tokens")
+    if args.max_retries < 0:
+        parser.error("--max-retries must be at least 0")
+    if args.schema_retries < 0:
+        parser.error("--schema-retries must be at least 0")
+
     if args.version:
         print(f"jsonthat CLI version {__version__}")
         return
+
     if args.setup:
-        setup_command(config)
+        setup_command(Config())
         return
     if args.config:
-        config.display_config()
+        Config().display_config()
+        return
+    if args.serve:
+        serve_command(Config(), args)
         return
 
-    if sys.stdin.isatty() and not args.line:
+    if sys.stdin.isatty() and not args.line and not args.input:
         parser.print_help()
         return
 
     try:
-        provider = get_provider(config, args.provider)
+        paths = expand_inputs(args.input or ["-"])
+        delimiter = make_delimiter(args.null, args.delimiter)
     except ValueError as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
-    schema = read_schema_file(args.schema) if args.schema else None
+    # Runs that only need results are handed to a running daemon, and read
+    # and written here. The others, and all runs without a daemon, go on.
+    ollama_options = get_ollama_options(args)
+    if not args.no_daemon and not (
+        args.stream
+        or args.partial
+        or args.long
+        or args.checkpoint
+        or args.usage
+        or args.usage_json
+        or args.cache_stats
+        or ollama_options
+        or local_settings
+    ):
+        status = run_forwarded(args, paths, delimiter)
+        if status is not None:
+            sys.exit(status)
+
+    config = Config()
+    if args.concurrency is None:
+        # Only parallel runs without streaming follow the provider's default.
+        args.concurrency = 1
+        if (args.line or args.long) and not (args.stream or args.partial):
+            try:
+                args.concurrency = get_default_concurrency(config, args.provider)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+
+    usage_tracker = None
+    if args.usage or args.usage_json:
+        usage_tracker = UsageTracker()
 
-    stream = args.stream
+    try:
+        hedge_delay, hedge_percentile = args.hedge_delay
+        provider, endpoints = build_provider(
+            config,
+            args.provider,
+            pool_size=args.pool_size or args.concurrency,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            hedge_delay=hedge_delay,
+            hedge_percentile=hedge_percentile,
+            usage_tracker=usage_tracker,
+            options=ollama_options,
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    hedged = provider if isinstance(provider, HedgedProvider) else None
+    balanced = [
+        member
+        for member in (hedged.providers if hedged else [provider])
+        if isinstance(member, LoadBalancedProvider)
+    ]
+
+    validator = None
+    schema = None
+    if args.schema:
+        validator = CompiledSchema.parse(read_schema_file(args.schema))
+        schema = str(validator)
+
+    journal = None
+    if args.checkpoint:
+        try:
+            journal = CheckpointJournal(
+                args.checkpoint,
+                paths,
+                schema,
+                resume=args.resume,
+                output=sys.stdout,
+            )
+        except (OSError, ValueError) as e:
+            provider.close()
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    writer = OutputWriter(
+        mode=args.output,
+        line_numbers=args.line_numbers,
+        on_flush=journal.flush if journal else None,
+    )
+    invalid_records = 0
+    coalescer = None
+
+    def output(
+        result: Union[dict[str, any], InvalidOutput],
+        key: Optional[Tuple[str, int]] = None,
+    ):
+        nonlocal invalid_records
+        if isinstance(result, InvalidOutput):
+            invalid_records += 1
+            print(f"Error: {result.format()}", file=sys.stderr)
+            return
+        # A record is journaled only once its output has been written out.
+        on_written = None
+        if journal and key is not None:
+            on_written = partial(journal.record, key, result)
+        writer.write(result, key, on_written)
+        if usage_tracker:
+            usage_tracker.add_records()
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            max_size=args.cache_size * 1024 * 1024, ttl=args.cache_ttl
+        )
+        # Chunks of --long inputs only hold part of the fields, so their
+        # outputs are cached without being checked against the schema.
+        provider = CachedProvider(
+            provider,
+            cache,
+            refresh=args.refresh,
+            validator=None if args.long else validator,
+        )
+
+    stream = args.stream or args.partial is not None
     if stream and not provider.supports_streaming:
         print(
             f"Warning: {args.provider or 'Provider'} does not support streaming. "
@@ -617,23 +1976,90 @@ def main():
             file=sys.stderr,
         )
         stream = False
+    if stream and not args.partial and args.output != "pretty":
+        print(
+            f"Warning: --stream is not supported with --output {args.output}. "
+            "Falling back to non-streaming mode.",
+            file=sys.stderr,
+        )
+        stream = False
+    if stream and (args.concurrency > 1 or args.batch_size > 1 or args.long):
+        print(
+            "Warning: --stream is not supported with --concurrency, --batch-size "
+            "or --long. Falling back to non-streaming mode.",
+            file=sys.stderr,
+        )
+        stream = False
 
-    if args.line:
-        lines = (line.strip() for line in sys.stdin if line.strip())
-    else:
-        input_text = read_stdin().strip()
-        if not input_text:
-            print("Error: No input provided.", file=sys.stderr)
-            sys.exit(1)
-        lines = [input_text]
+    import requests
 
     try:
-        for text_chunk in lines:
-            result = provider.transform_text_to_json(text_chunk, schema, stream=stream)
-            if isinstance(result, Generator):
-                display_streaming_response(result)
+        # Lines are (key, text) pairs, the key locating the text in the input.
+        if args.line:
+            lines = iter_records(paths, delimiter, numbered=True)
+            if journal:
+                lines = journal.pending_records(lines)
+        elif not args.long:
+            # Without --line, each input is transformed as a whole.
+            lines = [((path, 1), text) for path in paths if (text := read_text(path))]
+            if not lines:
+                print("Error: No input provided.", file=sys.stderr)
+                sys.exit(1)
+
+        if args.long:
+            # Each input is chunked and merged on its own.
+            for path in paths:
+                with open_text(path) as f:
+                    chunks = iter_chunks(f, args.chunk_tokens, args.chunk_overlap)
+                    results = transform_lines(
+                        provider, chunks, schema, concurrency=args.concurrency
+                    )
+                    result = merge_results(
+                        results, validator.schema if validator else None
+                    )
+                if result is None:
+                    print("Error: No input provided.", file=sys.stderr)
+                    sys.exit(1)
+                # Chunks only hold part of the fields, so only the merged
+                # result is checked against the schema.
+                errors = validator.validate(result) if validator else []
+                output(InvalidOutput(path, result, errors) if errors else result)
+        elif stream:
+            for _, text_chunk in lines:
+                result = provider.transform_text_to_json(
+                    text_chunk, schema, stream=True
+                )
+                if isinstance(result, Generator) and args.partial:
+                    display_partial_response(result, args.partial, writer)
+                elif isinstance(result, Generator):
+                    display_streaming_response(result, writer)
+                else:
+                    writer.write(result)
+                if usage_tracker:
+                    usage_tracker.add_records()
+        else:
+            if args.line and not args.no_dedupe:
+                from .dedupe import RecordCoalescer
+
+                coalescer = RecordCoalescer()
+            options = dict(
+                concurrency=args.concurrency,
+                ordered=not args.unordered,
+                batch_size=args.batch_size,
+                batch_tokens=args.batch_tokens,
+                validator=validator,
+                retries=args.schema_retries,
+                keyed=True,
+                coalescer=coalescer,
+            )
+            if args.engine == "asyncio":
+                import asyncio
+
+                asyncio.run(output_async(provider, lines, schema, output, options))
             else:
-                print(json.dumps(result, indent=2))
+                results = transform_lines(provider, lines, schema, **options)
+                for key, result in results:
+                    output(result, key)
 
     except KeyboardInterrupt:
         print("\nProcessing aborted.")
@@ -642,6 +2068,8 @@ def main():
         print(f"Error: Failed to communicate with the API.\n{e}", file=sys.stderr)
         if e.response is not None:
             try:
+                import yaml
+
                 err = e.response.json()
                 err_yaml = yaml.dump(err)
                 print(err_yaml, file=sys.stderr)
@@ -652,9 +2080,47 @@ def main():
     except json.JSONDecodeError as e:
         print(f"Error: Failed to parse API response as JSON. {e}", file=sys.stderr)
         sys.exit(1)
+    except OSError as e:
+        print(f"Error: Failed to read input. {e}", file=sys.stderr)
+        sys.exit(1)
     except ValueError as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        writer.close()
+        provider.close()
+        if journal:
+            journal.close()
+            if journal.skipped:
+                print(
+                    f"Checkpoint: skipped {journal.skipped} completed records",
+                    file=sys.stderr,
+                )
+        if cache and (args.cache_stats or args.usage):
+            stats = cache.stats()
+            print(
+                f"Cache: {stats['hits']} hits, {stats['misses']} misses",
+                file=sys.stderr,
+            )
+        if usage_tracker and args.usage:
+            print(usage_tracker.format_summary(), file=sys.stderr)
+            for label, endpoint in endpoints:
+                print(label + endpoint.rate_limiter.format_summary(), file=sys.stderr)
+            for member in balanced:
+                print(member.format_summary(), file=sys.stderr)
+            if hedged:
+                print(hedged.format_summary(), file=sys.stderr)
+            if coalescer:
+                print(coalescer.format_summary(), file=sys.stderr)
+        if usage_tracker and args.usage_json:
+            usage_tracker.write_report(args.usage_json)
+
+    if invalid_records:
+        print(
+            f"Error: {invalid_records} records did not match the schema.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+import json
+from typing import Dict, List, Optional, Union
+
+LITERAL_CHARS = set("0123456789+-.eEtrufalsn")
+
+Path = List[Union[str, int]]
+
+
+def json_pointer(path: Path) -> str:
+    return "".join(
+        "/" + str(part).replace("~", "~0").replace("/", "~1") for part in path
+    )
+
+
+class _Frame:
+    def __init__(self, container: Union[dict, list], path: Path):
+        self.container = container
+        self.path = path
+        self.key: Optional[str] = None
+        self.expect_key = isinstance(container, dict)
+
+
+class IncrementalJSONParser:
+    # Parses a JSON document fed in arbitrary fragments and reports every
+    # value as soon as it is complete, as JSON Patch "add" operations. A
+    # container is reported empty when it opens and its members are added as
+    # they close, so applying the events in order rebuilds the document and
+    # `value` is always valid JSON holding everything completed so far.
+
+    def __init__(self):
+        self.value = None
+        self.done = False
+        self._stack: List[_Frame] = []
+        self._token: Optional[str] = None
+        self._buffer: List[str] = []
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        events = []
+        for char in chunk:
+            self._consume(char, events)
+        return events
+
+    def close(self) -> List[Dict]:
+        events = []
+        if self._token == "literal":
+            self._finish_literal(events)
+        return events
+
+    def _consume(self, char: str, events: List[Dict]):
+        if self.done:
+            return
+        if self._token == "string":
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._token = None
+                self._finish_string(
+                    json.loads('"' + "".join(self._buffer) + '"'), events
+                )
+                return
+            self._buffer.append(char)
+            return
+
+        if self._token == "literal":
+            if char in LITERAL_CHARS:
+                self._buffer.append(char)
+                return
+            self._finish_literal(events)
+
+        if char.isspace() or char == ":":
+            return
+        if not self._stack and char not in '{["':
+            # Skip anything a model may print before the document, such as a
+            # markdown code fence.
+            return
+        if char == '"':
+            self._token = "string"
+            self._buffer = []
+        elif char == "{":
+            self._open({}, events)
+        elif char == "[":
+            self._open([], events)
+        elif char in "}]":
+            if self._stack:
+                self._stack.pop()
+            self.done = not self._stack
+        elif char == ",":
+            if self._stack and isinstance(self._stack[-1].container, dict):
+                self._stack[-1].expect_key = True
+        else:
+            self._token = "literal"
+            self._buffer = [char]
+
+    def _finish_string(self, value: str, events: List[Dict]):
+        frame = self._stack[-1] if self._stack else None
+        if frame and frame.expect_key:
+            frame.key = value
+            frame.expect_key = False
+        else:
+            self._add(value, events)
+
+    def _finish_literal(self, events: List[Dict]):
+        self._token = None
+        self._add(json.loads("".join(self._buffer)), events)
+
+    def _open(self, container: Union[dict, list], events: List[Dict]):
+        path = self._add(container, events, reported=type(container)())
+        self._stack.append(_Frame(container, path))
+
+    def _add(self, value: any, events: List[Dict], reported: any = None) -> Path:
+        if not self._stack:
+            path = []
+            self.value = value
+            self.done = not isinstance(value, (dict, list))
+        else:
+            frame = self._stack[-1]
+            if isinstance(frame.container, dict):
+                path = frame.path + [frame.key]
+                frame.container[frame.key] = value
+            else:
+                path = frame.path + [len(frame.container)]
+                frame.container.append(value)
+
+        events.append(
+            {
+                "op": "add",
+                "path": json_pointer(path),
+                "value": value if reported is None else reported,
+            }
+        )
+        return path
@@ -0,0 +1,105 @@
+import json
+from typing import Dict, List, Optional, Union
+
+from .schema import to_json_schema, to_strict_schema
+
+# The prompts and response formats sent to the providers, and the splitting
+# of the answer to a batch of records.
+
+
+def build_system_prompt(schema: Optional[str] = None) -> str:
+    # Identical for every record of a run, and sent before the record itself,
+    # so that provider prompt caches can reuse it.
+    prompt = (
+        "Transform the raw text to JSON.\n"
+        "Only output json response without any comment or extra information.\n"
+    )
+    if schema:
+        prompt += (
+            "Use the following JSON schema to structure the output, without "
+            f"including extra schema information back in the response:\n{schema}"
+        )
+    return prompt
+
+
+def build_response_format(schema: str) -> Dict:
+    # The OpenAI and Mistral response format of a schema: strict mode
+    # guarantees the output matches it, but only takes schemas without
+    # optional properties; the others only guide the model.
+    strict_schema = to_strict_schema(schema)
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "output",
+            "schema": strict_schema or to_json_schema(schema),
+            "strict": strict_schema is not None,
+        },
+    }
+
+
+def build_user_prompt(text: str) -> str:
+    return f"Transform the following text into a JSON format: {text}"
+
+
+def build_batch_prompt(texts: List[str]) -> str:
+    records = "\n".join(f"[{index}] {text}" for index, text in enumerate(texts))
+    return (
+        f"The input contains {len(texts)} independent records, each prefixed with "
+        "its index in brackets. Transform each record into JSON separately.\n"
+        'Respond with a JSON object of the form {"results": [{"index": 0, '
+        '"output": <JSON for record 0>}, ...]} containing exactly one item per '
+        "record.\n\n"
+        f"{records}"
+    )
+
+
+def build_retry_prompt(text: str, errors: List[str]) -> str:
+    return (
+        f"{text}\n\nA previous answer for this text did not match the schema:\n"
+        + "\n".join(f"- {error}" for error in errors)
+    )
+
+
+def build_batch_schema(schema: Optional[str] = None) -> str:
+    output_schema = {"type": "object"}
+    if schema:
+        output_schema = to_json_schema(schema) or {
+            "type": "object",
+            "description": f"Follow this schema: {schema}",
+        }
+    return json.dumps(
+        {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "output": output_schema,
+                        },
+                        "required": ["index", "output"],
+                    },
+                }
+            },
+            "required": ["results"],
+        }
+    )
+
+
+def split_batch_result(
+    result: Union[dict[str, any], list], size: int
+) -> List[Optional[dict[str, any]]]:
+    items = result.get("results") if isinstance(result, dict) else result
+    outputs: List[Optional[dict[str, any]]] = [None] * size
+    if not isinstance(items, list):
+        return outputs
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or "output" not in item:
+            continue
+        index = item.get("index", position if len(items) == size else None)
+        if isinstance(index, int) and 0 <= index < size and outputs[index] is None:
+            outputs[index] = item["output"]
+    return outputs
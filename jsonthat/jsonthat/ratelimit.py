@@ -0,0 +1,368 @@
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+DEFAULT_MAX_RETRIES = 5
+
+# 529 is Anthropic's "overloaded" status.
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUS_CODES = {429, 529}
+
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# (limit, remaining, reset) header names for each kind of limit, as sent by
+# OpenAI and by Anthropic.
+RATE_LIMIT_HEADERS = {
+    "requests": [
+        (
+            "x-ratelimit-limit-requests",
+            "x-ratelimit-remaining-requests",
+            "x-ratelimit-reset-requests",
+        ),
+        (
+            "anthropic-ratelimit-requests-limit",
+            "anthropic-ratelimit-requests-remaining",
+            "anthropic-ratelimit-requests-reset",
+        ),
+    ],
+    "tokens": [
+        (
+            "x-ratelimit-limit-tokens",
+            "x-ratelimit-remaining-tokens",
+            "x-ratelimit-reset-tokens",
+        ),
+        (
+            "anthropic-ratelimit-input-tokens-limit",
+            "anthropic-ratelimit-input-tokens-remaining",
+            "anthropic-ratelimit-input-tokens-reset",
+        ),
+        (
+            "anthropic-ratelimit-tokens-limit",
+            "anthropic-ratelimit-tokens-remaining",
+            "anthropic-ratelimit-tokens-reset",
+        ),
+    ],
+}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    # Durations come as seconds ("2", "0.5"), Go-style durations ("6m0s",
+    # "20ms"), RFC 3339 timestamps (Anthropic) or HTTP dates (Retry-After).
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    parts = DURATION.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def parse_rate_limit_headers(
+    headers: Mapping[str, str],
+) -> Dict[str, Tuple[float, float, float]]:
+    limits = {}
+    for kind, names in RATE_LIMIT_HEADERS.items():
+        for limit_name, remaining_name, reset_name in names:
+            try:
+                limit = float(headers[limit_name])
+                remaining = float(headers[remaining_name])
+            except (KeyError, TypeError, ValueError):
+                continue
+            reset = parse_duration(headers.get(reset_name))
+            limits[kind] = (limit, remaining, reset or 0.0)
+            break
+    return limits
+
+
+class TokenBucket:
+    # Unlimited until the server reports its limits, then refilled at the
+    # rate that brings it back to the full limit by the reported reset time.
+
+    def __init__(self):
+        self.capacity: Optional[float] = None
+        self.tokens = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.capacity is not None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def update(self, limit: float, remaining: float, reset: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.capacity = max(limit, 1.0)
+            self.tokens = min(remaining, self.capacity)
+            if reset > 0:
+                self.rate = (self.capacity - self.tokens) / reset
+            elif self.tokens < self.capacity:
+                self.tokens = self.capacity
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def reserve(self, cost: float = 1.0) -> float:
+        # Takes cost tokens and returns 0, or returns how long to wait before
+        # trying again.
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.capacity is None:
+                return 0.0
+            cost = min(cost, self.capacity)
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            # Without a refill rate, poll until a response updates it.
+            return (cost - self.tokens) / self.rate if self.rate else 1.0
+
+    def acquire(self, cost: float = 1.0, sleep: Callable[[float], None] = time.sleep):
+        while delay := self.reserve(cost):
+            sleep(delay)
+
+    async def acquire_async(self, cost: float = 1.0):
+        import asyncio
+
+        while delay := self.reserve(cost):
+            await asyncio.sleep(delay)
+
+
+def wake_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveConcurrency:
+    # AIMD: each successful request grows the limit by 1/limit, so by about
+    # one per round of requests, and a throttled request halves it. Only
+    # requests started after the last decrease can shrink it again, so one
+    # burst of 429s counts as a single congestion signal.
+
+    def __init__(self, maximum: int = 1, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.active = 0
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+        # The (loop, future) of each coroutine waiting for a slot, woken in
+        # turn as slots free up.
+        self._waiters = deque()
+
+    def acquire(self) -> float:
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+            return time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        with self._condition:
+            if self.active >= int(self.limit):
+                return None
+            self.active += 1
+            return time.monotonic()
+
+    async def acquire_async(self) -> float:
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.active < int(self.limit):
+                    self.active += 1
+                    return time.monotonic()
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    else:
+                        # Woken for a slot it no longer takes: pass it on.
+                        self._wake()
+                raise
+
+    def _wake(self):
+        free = int(self.limit) - self.active
+        while free > 0 and self._waiters:
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(wake_waiter, future)
+            except RuntimeError:
+                # Its event loop has closed.
+                continue
+            free -= 1
+
+    def release(self, started: float, throttled: bool = False):
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                if started >= self.last_decrease:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self.last_decrease = time.monotonic()
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            self._wake()
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        concurrency: int = 1,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = 0.5,
+        max_backoff: float = 60.0,
+        seed: Optional[int] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        import random
+
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.concurrency = AdaptiveConcurrency(concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def update(self, headers: Mapping[str, str]):
+        limits = parse_rate_limit_headers(headers)
+        if "requests" in limits:
+            self.requests.update(*limits["requests"])
+        if "tokens" in limits:
+            self.tokens.update(*limits["tokens"])
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # Full jitter spreads out the retries of concurrent workers.
+        delay = self.random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None:
+            delay += retry_after
+        return delay
+
+    def call(self, send: Callable, cost: float = 1.0):
+        # Sends a request through the limits and returns the response of the
+        # first attempt that is not retryable, or of the last attempt.
+        import requests
+
+        attempt = 0
+        while True:
+            self.requests.acquire(1, self.sleep)
+            self.tokens.acquire(cost, self.sleep)
+            started = self.concurrency.acquire()
+            response = None
+            throttled = False
+            try:
+                response = send()
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                self.update(response.headers)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                self.concurrency.release(started, throttled)
+
+            if self._is_final(response, attempt):
+                return response
+            self.sleep(self._retry_delay(response, throttled, attempt))
+            attempt += 1
+
+    async def call_async(self, send: Callable, cost: float = 1.0):
+        # The same as call(), for a coroutine function send.
+        import asyncio
+
+        import requests
+
+        attempt = 0
+        while True:
+            await self.requests.acquire_async(1)
+            await self.tokens.acquire_async(cost)
+            started = await self.concurrency.acquire_async()
+            response = None
+            throttled = False
+            try:
+                response = await send()
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                self.update(response.headers)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                self.concurrency.release(started, throttled)
+
+            if self._is_final(response, attempt):
+                return response
+            await asyncio.sleep(self._retry_delay(response, throttled, attempt))
+            attempt += 1
+
+    def _is_final(self, response, attempt: int) -> bool:
+        return response is not None and (
+            response.status_code not in RETRY_STATUS_CODES
+            or attempt >= self.max_retries
+        )
+
+    def _retry_delay(self, response, throttled: bool, attempt: int) -> float:
+        retry_after = None
+        if response is not None:
+            retry_after = parse_retry_after(response.headers)
+            response.close()
+        if throttled and retry_after:
+            # Hold back every worker, not only the one that was throttled.
+            self.requests.pause(retry_after)
+
+        with self._lock:
+            self.retries += 1
+            self.throttled += throttled
+        return self.backoff_delay(attempt, retry_after)
+
+    def format_summary(self) -> str:
+        return (
+            f"Rate limit: {self.retries} retries ({self.throttled} throttled), "
+            f"concurrency {int(self.concurrency.limit)}/{self.concurrency.maximum}"
+        )
@@ -0,0 +1,425 @@
+import json
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional
+
+DEFAULT_SCHEMA_RETRIES = 2
+
+# Keys that only document a JSON schema and cost prompt tokens without
+# changing what the model has to produce.
+METADATA_KEYS = {"$schema", "$id", "$comment", "examples", "deprecated", "readOnly"}
+# Keywords whose value maps names of the user's choosing to schemas.
+SCHEMA_MAPS = {"properties", "patternProperties", "$defs", "definitions"}
+
+# Keywords OpenAI's strict mode rejects, and those that give a value a type.
+STRICT_UNSUPPORTED_KEYS = {
+    "allOf",
+    "oneOf",
+    "not",
+    "if",
+    "then",
+    "else",
+    "patternProperties",
+    "dependentRequired",
+    "dependentSchemas",
+}
+STRICT_TYPED_KEYS = {"type", "anyOf", "$ref", "enum", "const"}
+
+PLAIN_FIELD = re.compile(r"^(\s*)([^:#\s][^:]*?)\s*:\s*(.*?)\s*$")
+PLAIN_TYPES = {
+    "string": {"type": "string"},
+    "str": {"type": "string"},
+    "text": {"type": "string"},
+    "number": {"type": "number"},
+    "float": {"type": "number"},
+    "integer": {"type": "integer"},
+    "int": {"type": "integer"},
+    "boolean": {"type": "boolean"},
+    "bool": {"type": "boolean"},
+    "array": {"type": "array"},
+    "list": {"type": "array"},
+    "object": {"type": "object"},
+    "null": {"type": "null"},
+    "date": {"type": "string", "format": "date"},
+    "datetime": {"type": "string", "format": "date-time"},
+}
+
+
+def is_number(value: any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_integer(value: any) -> bool:
+    return is_number(value) and float(value).is_integer()
+
+
+JSON_TYPES = {
+    "string": lambda value: isinstance(value, str),
+    "number": is_number,
+    "integer": is_integer,
+    "boolean": lambda value: isinstance(value, bool),
+    "array": lambda value: isinstance(value, list),
+    "object": lambda value: isinstance(value, dict),
+    "null": lambda value: value is None,
+}
+
+Validator = Callable[[any, str], Iterator[str]]
+
+
+def strip_metadata(node: any) -> any:
+    # Keywords are only dropped from schemas, never from the maps of names
+    # to schemas, where they are the names of fields.
+    if isinstance(node, dict):
+        stripped = {}
+        for key, value in node.items():
+            if key in METADATA_KEYS:
+                continue
+            if key in SCHEMA_MAPS and isinstance(value, dict):
+                value = {name: strip_metadata(item) for name, item in value.items()}
+            elif key not in ("enum", "const", "default"):
+                value = strip_metadata(value)
+            stripped[key] = value
+        return stripped
+    if isinstance(node, list):
+        return [strip_metadata(item) for item in node]
+    return node
+
+
+def plain_type(name: str) -> Dict:
+    name = name.strip()
+    if name.endswith("[]"):
+        return {"type": "array", "items": plain_type(name[:-2])}
+    return dict(PLAIN_TYPES.get(name.lower(), {"description": name}))
+
+
+def parse_plain_schema(text: str) -> Optional[Dict]:
+    # `name: type` lines, one per field. A field without a type followed by
+    # more indented lines is a nested object.
+    fields = []
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        match = PLAIN_FIELD.match(line)
+        if not match:
+            return None
+        indent, name, type_name = match.groups()
+        fields.append((len(indent.expandtabs()), name, type_name))
+    if not fields:
+        return None
+
+    def build(position: int, indent: int):
+        properties = {}
+        while position < len(fields) and fields[position][0] == indent:
+            _, name, type_name = fields[position]
+            position += 1
+            if position < len(fields) and fields[position][0] > indent:
+                node, position = build(position, fields[position][0])
+                if type_name.endswith("[]") or type_name.lower() in ("array", "list"):
+                    node = {"type": "array", "items": node}
+            else:
+                node = plain_type(type_name) if type_name else {}
+            properties[name] = node
+        # Free-form descriptions are guidance for the model, only typed
+        # fields are required.
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": [name for name, node in properties.items() if "type" in node],
+        }, position
+
+    schema, position = build(0, fields[0][0])
+    return schema if position == len(fields) else None
+
+
+@lru_cache(maxsize=32)
+def to_json_schema(text: str) -> Optional[Dict]:
+    # The JSON Schema of a schema given to a provider, for the APIs that
+    # constrain their output to one; None for free-form descriptions. The
+    # result is shared between calls and must not be modified.
+    try:
+        schema = json.loads(text)
+    except json.JSONDecodeError:
+        return parse_plain_schema(text)
+    return strip_metadata(schema) if isinstance(schema, dict) else None
+
+
+@lru_cache(maxsize=32)
+def to_strict_schema(text: str) -> Optional[Dict]:
+    # The schema for OpenAI's strict mode, in which every object lists all
+    # its properties as required and allows no others; None when the schema
+    # asks for something strict mode can not express, such as an optional
+    # property.
+    schema = to_json_schema(text)
+    if schema is None:
+        return None
+    try:
+        return strict_node(schema)
+    except ValueError:
+        return None
+
+
+def strict_node(node: any) -> Dict:
+    if not isinstance(node, dict) or STRICT_UNSUPPORTED_KEYS & node.keys():
+        raise ValueError(node)
+    if not STRICT_TYPED_KEYS & node.keys():
+        raise ValueError(node)  # free-form values
+    node = dict(node)
+    types = node.get("type")
+    if isinstance(types, str):
+        types = [types]
+    if "properties" in node or "object" in (types or []):
+        properties = node.get("properties") or {}
+        # An object without properties is free-form unless it is empty.
+        allowed = node.get("additionalProperties", not properties)
+        if allowed is not False:
+            raise ValueError(node)
+        if set(node.get("required", [])) != set(properties):
+            raise ValueError(node)
+        node["properties"] = {
+            name: strict_node(value) for name, value in properties.items()
+        }
+        node["required"] = list(properties)
+        node["additionalProperties"] = False
+    if "items" in node:
+        node["items"] = strict_node(node["items"])
+    if "anyOf" in node:
+        node["anyOf"] = [strict_node(item) for item in node["anyOf"]]
+    for key in ("$defs", "definitions"):
+        if key in node:
+            node[key] = {name: strict_node(value) for name, value in node[key].items()}
+    return node
+
+
+def compile_validator(schema: any, root: Optional[Dict] = None) -> Validator:
+    # Turn the schema into nested closures once, so validating a record is a
+    # walk over the value without re-interpreting the schema.
+    root = root if root is not None else schema
+    if schema is False:
+        return lambda value, path: iter([f"{path or '/'}: not allowed"])
+    if not isinstance(schema, dict):
+        return lambda value, path: iter(())
+
+    checks: List[Validator] = []
+
+    if "$ref" in schema:
+        reference = schema["$ref"]
+        resolved: Dict = {}
+
+        def check_ref(value, path):
+            if "schema" not in resolved:
+                resolved["schema"] = compile_validator(
+                    resolve_ref(root, reference), root
+                )
+            return resolved["schema"](value, path)
+
+        checks.append(check_ref)
+
+    types = schema.get("type")
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        predicates = [JSON_TYPES[name] for name in types if name in JSON_TYPES]
+        expected = " or ".join(types)
+
+        def check_type(value, path):
+            if predicates and not any(predicate(value) for predicate in predicates):
+                yield f"{path or '/'}: expected {expected}, got {json_type(value)}"
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value, path):
+            if value not in allowed:
+                yield f"{path or '/'}: {json.dumps(value)} is not one of {json.dumps(allowed)}"
+
+        checks.append(check_enum)
+
+    if "const" in schema:
+        constant = schema["const"]
+
+        def check_const(value, path):
+            if value != constant:
+                yield f"{path or '/'}: expected {json.dumps(constant)}"
+
+        checks.append(check_const)
+
+    checks.extend(compile_bounds(schema))
+
+    properties = {
+        name: compile_validator(node, root)
+        for name, node in schema.get("properties", {}).items()
+    }
+    required = schema.get("required", [])
+    additional = schema.get("additionalProperties", True)
+    additional_check = (
+        compile_validator(additional, root) if isinstance(additional, dict) else None
+    )
+    if properties or required or additional is not True:
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    yield f"{path or '/'}: missing required property {name!r}"
+            for name, item in value.items():
+                item_path = f"{path}/{escape_pointer(name)}"
+                if name in properties:
+                    yield from properties[name](item, item_path)
+                elif additional is False:
+                    yield f"{path or '/'}: unexpected property {name!r}"
+                elif additional_check:
+                    yield from additional_check(item, item_path)
+
+        checks.append(check_object)
+
+    if isinstance(schema.get("items"), dict):
+        items_check = compile_validator(schema["items"], root)
+
+        def check_items(value, path):
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    yield from items_check(item, f"{path}/{index}")
+
+        checks.append(check_items)
+
+    for keyword in ("allOf", "anyOf", "oneOf"):
+        if keyword in schema:
+            checks.append(compile_combinator(keyword, schema[keyword], root))
+
+    def validate(value, path):
+        for check in checks:
+            yield from check(value, path)
+
+    return validate
+
+
+def compile_bounds(schema: Dict) -> List[Validator]:
+    checks: List[Validator] = []
+    bounds = [
+        ("minimum", (int, float), lambda value, bound: value >= bound, "at least"),
+        ("maximum", (int, float), lambda value, bound: value <= bound, "at most"),
+        ("minLength", str, lambda value, bound: len(value) >= bound, "length >="),
+        ("maxLength", str, lambda value, bound: len(value) <= bound, "length <="),
+        ("minItems", list, lambda value, bound: len(value) >= bound, "items >="),
+        ("maxItems", list, lambda value, bound: len(value) <= bound, "items <="),
+    ]
+    for keyword, kind, holds, description in bounds:
+        if keyword not in schema:
+            continue
+
+        def check_bound(
+            value, path, bound=schema[keyword], kind=kind, holds=holds, text=description
+        ):
+            if (
+                isinstance(value, kind)
+                and not isinstance(value, bool)
+                and not holds(value, bound)
+            ):
+                yield f"{path or '/'}: expected {text} {bound}"
+
+        checks.append(check_bound)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(value, path):
+            if isinstance(value, str) and not pattern.search(value):
+                yield f"{path or '/'}: does not match {pattern.pattern!r}"
+
+        checks.append(check_pattern)
+    return checks
+
+
+def compile_combinator(keyword: str, schemas: List, root: Dict) -> Validator:
+    validators = [compile_validator(schema, root) for schema in schemas]
+
+    def check(value, path):
+        matches = sum(
+            not any(True for _ in validate(value, path)) for validate in validators
+        )
+        if keyword == "allOf" and matches < len(validators):
+            for validate in validators:
+                yield from validate(value, path)
+        elif keyword == "anyOf" and not matches:
+            yield f"{path or '/'}: does not match any schema in anyOf"
+        elif keyword == "oneOf" and matches != 1:
+            yield f"{path or '/'}: matches {matches} schemas in oneOf, expected 1"
+
+    return check
+
+
+def resolve_ref(root: Dict, reference: str) -> any:
+    if not reference.startswith("#"):
+        return True  # remote references are not followed
+    node = root
+    for part in reference[1:].split("/")[1:]:
+        part = part.replace("~1", "/").replace("~0", "~")
+        node = node[int(part)] if isinstance(node, list) else node.get(part, True)
+    return node
+
+
+def escape_pointer(name: str) -> str:
+    return str(name).replace("~", "~0").replace("/", "~1")
+
+
+def json_type(value: any) -> str:
+    for name in ("null", "boolean", "integer", "number", "string", "array", "object"):
+        if JSON_TYPES[name](value):
+            return name
+    return type(value).__name__
+
+
+class CompiledSchema:
+    # A schema parsed once from a --schema file: the JSON schema itself, its
+    # rendering for prompts and a validator for the outputs.
+
+    def __init__(self, schema: Optional[Dict], text: str):
+        self.schema = schema
+        self.text = text
+        self._validate = compile_validator(schema) if schema is not None else None
+
+    @classmethod
+    def parse(cls, text: str) -> "CompiledSchema":
+        text = text.strip()
+        try:
+            schema = json.loads(text)
+        except json.JSONDecodeError:
+            schema = None
+        if isinstance(schema, dict):
+            schema = strip_metadata(schema)
+            return cls(schema, json.dumps(schema, separators=(",", ":")))
+
+        # The plain `name: type` format already is the most compact rendering,
+        # so it is kept as written, minus comments and blank lines.
+        schema = parse_plain_schema(text)
+        if schema is not None:
+            lines = [
+                line.rstrip()
+                for line in text.splitlines()
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+            return cls(schema, "\n".join(lines))
+        return cls(None, text)
+
+    def validate(self, value: any) -> List[str]:
+        if self._validate is None:
+            return []
+        return list(self._validate(value, ""))
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class InvalidOutput:
+    # Stands in for a record whose output still does not match the schema
+    # after all retries, so that the caller can report it instead of the JSON.
+
+    def __init__(self, text: str, output: any, errors: List[str]):
+        self.text = text
+        self.output = output
+        self.errors = errors
+
+    def format(self) -> str:
+        return f"Invalid output for {self.text[:80]!r}: " + "; ".join(self.errors)
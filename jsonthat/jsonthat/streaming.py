@@ -0,0 +1,207 @@
+import json
+from functools import partial
+from itertools import chain
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+READ_SIZE = 64 * 1024
+
+# Skips the encoding detection json.loads does on every call.
+_decode_json = json.JSONDecoder().decode
+# The C scanner under it, which also skips the whitespace matching that
+# decode() does around every payload.
+_scan_json = json.JSONDecoder().scan_once
+
+SSE = "sse"
+NDJSON = "ndjson"
+
+
+class StreamError(ValueError):
+    pass
+
+
+def iter_response_chunks(response, size: int = READ_SIZE) -> Iterator[bytes]:
+    # read1 returns whatever has arrived, up to size bytes, instead of
+    # waiting for a full buffer like iter_lines() and iter_content() do.
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is None:
+        return iter(response.iter_content(chunk_size=None))
+    from urllib3.response import HTTPResponse
+
+    if isinstance(response.raw, HTTPResponse):
+        # requests leaves the raw stream encoded: urllib3 decodes gzip and
+        # deflate bodies as they are read.
+        return iter(partial(read1, size, decode_content=True), b"")
+    return iter(partial(read1, size), b"")
+
+
+class SSEDecoder:
+    # Incremental parser for server-sent events: feed() takes raw bytes as
+    # they arrive and returns the complete (event, data) frames, and None
+    # at the end of the body to flush the last frame.
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data: Optional[bytes]) -> List[Tuple[Optional[str], bytes]]:
+        if data is None:
+            block, self.buffer = self.buffer, b""
+            return [frame] if (frame := self.parse_frame(block)) else []
+        if (
+            not self.buffer
+            and data.endswith(b"\n\n")
+            and data.find(b"\n\n") == len(data) - 2
+            and b"\r" not in data
+        ):
+            # Fast path for a read that holds exactly one frame, as when
+            # every event is read as soon as it arrives.
+            if data.startswith(b"data: ") and data.find(b"\n") == len(data) - 2:
+                return [(None, data[6:-2])]
+            return [frame] if (frame := self.parse_frame(data[:-2])) else []
+        buffer = self.buffer + data if self.buffer else data
+        if b"\r" in buffer:
+            buffer = buffer.replace(b"\r\n", b"\n")
+        end = buffer.rfind(b"\n\n")
+        if end == -1:
+            self.buffer = buffer
+            return []
+        self.buffer = buffer[end + 2 :]
+        return [
+            frame
+            for frame in map(self.parse_frame, buffer[:end].split(b"\n\n"))
+            if frame
+        ]
+
+    @staticmethod
+    def parse_frame(block: bytes) -> Optional[Tuple[Optional[str], bytes]]:
+        # Fast paths for the frames APIs actually send: a single data line,
+        # optionally preceded by an event line.
+        lines = block.split(b"\n")
+        if len(lines) == 1 and block.startswith(b"data: "):
+            return None, block[6:]
+        if (
+            len(lines) == 2
+            and lines[0].startswith(b"event: ")
+            and lines[1].startswith(b"data: ")
+        ):
+            return lines[0][7:].decode("utf-8"), lines[1][6:]
+        event = None
+        data = []
+        for line in lines:
+            if line.startswith(b"data:"):
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+            elif line.startswith(b"event:"):
+                event = line[6:].strip().decode("utf-8")
+        if not data:
+            return None
+        return event, b"\n".join(data)
+
+
+class NDJSONDecoder:
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data: Optional[bytes]) -> List[Tuple[Optional[str], bytes]]:
+        if data is None:
+            line, self.buffer = self.buffer, b""
+            return [(None, line)] if line.strip() else []
+        buffer = self.buffer + data if self.buffer else data
+        end = buffer.rfind(b"\n")
+        if end == -1:
+            self.buffer = buffer
+            return []
+        self.buffer = buffer[end + 1 :]
+        return [(None, line) for line in buffer[:end].split(b"\n") if line.strip()]
+
+
+def is_final(event: Optional[str], data: Dict) -> bool:
+    # Anthropic ends with a message_stop event, Ollama with "done": true.
+    return (
+        event == "message_stop"
+        or data.get("type") == "message_stop"
+        or (data.get("done") is True)
+    )
+
+
+def make_decoder(stream_format: str = SSE):
+    return SSEDecoder() if stream_format == SSE else NDJSONDecoder()
+
+
+def decode_frame(event: Optional[str], payload: bytes) -> Optional[Dict]:
+    # Returns the JSON event carried by a frame, or None for frames that
+    # carry none, and raises StreamError on error events.
+    try:
+        # Frames are complete, so the payload holds whole characters.
+        text = payload.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    try:
+        message, end = _scan_json(text, 0)
+    except (StopIteration, json.JSONDecodeError):
+        message, end = None, 0
+    if end != len(text):
+        # Surrounding whitespace, trailing data or no JSON value at all.
+        try:
+            message = _decode_json(text)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(message, dict):
+        return None
+    if event == "error" or "error" in message:
+        error = message.get("error")
+        if isinstance(error, dict):
+            error = error.get("message")
+        raise StreamError(f"Stream failed: {error or json.dumps(message)}")
+    return message
+
+
+def decode_events(
+    chunks: Iterable[bytes], stream_format: str = SSE
+) -> Iterator[Tuple[Optional[str], Dict]]:
+    # Yields the decoded JSON events of a stream up to and including the
+    # final one, whichever of the termination conventions the API uses.
+    decoder = make_decoder(stream_format)
+    frames = chain.from_iterable(map(decoder.feed, chain(chunks, [None])))
+    for event, payload in frames:
+        if payload == b"[DONE]":  # OpenAI and Mistral
+            return
+        message = decode_frame(event, payload)
+        if message is None:
+            continue
+        yield event, message
+        if is_final(event, message):
+            return
+
+
+async def iter_frames_async(
+    chunks: AsyncIterable[bytes], stream_format: str = SSE
+) -> AsyncIterator[Tuple[Optional[str], bytes]]:
+    decoder = make_decoder(stream_format)
+    async for data in chunks:
+        for frame in decoder.feed(data):
+            yield frame
+    for frame in decoder.feed(None):
+        yield frame
+
+
+async def decode_events_async(
+    chunks: AsyncIterable[bytes], stream_format: str = SSE
+) -> AsyncIterator[Tuple[Optional[str], Dict]]:
+    # The same as decode_events(), for a body read with asyncio.
+    async for event, payload in iter_frames_async(chunks, stream_format):
+        if payload == b"[DONE]":
+            return
+        message = decode_frame(event, payload)
+        if message is None:
+            continue
+        yield event, message
+        if is_final(event, message):
+            return
@@ -0,0 +1,137 @@
+import json
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class RequestUsage:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.time_to_first_byte: Optional[float] = None
+        self.time_to_first_token: Optional[float] = None
+        self.latency: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def update(
+        self,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        cached_tokens: Optional[int] = None,
+    ):
+        # Streaming APIs report usage across several events, so only the
+        # counts present in a given event are updated.
+        if prompt_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            self.completion_tokens = completion_tokens
+        if cached_tokens is not None:
+            self.cached_tokens = cached_tokens
+
+    def to_dict(self) -> Dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "time_to_first_byte": self.time_to_first_byte,
+            "time_to_first_token": self.time_to_first_token,
+            "latency": self.latency,
+        }
+
+
+def percentile(values: List[float], rank: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(rank / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def distribution(values: List[Optional[float]]) -> Dict[str, Optional[float]]:
+    values = [value for value in values if value is not None]
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+class UsageTracker:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requests: List[RequestUsage] = []
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage: RequestUsage):
+        with self._lock:
+            self.requests.append(usage)
+
+    def add_records(self, count: int = 1):
+        with self._lock:
+            self.records += count
+
+    def summary(self) -> Dict:
+        with self._lock:
+            requests = list(self.requests)
+            records = self.records
+        elapsed = time.perf_counter() - self.start
+        completion_tokens = sum(usage.completion_tokens for usage in requests)
+        return {
+            "requests": len(requests),
+            "records": records,
+            "elapsed": elapsed,
+            "prompt_tokens": sum(usage.prompt_tokens for usage in requests),
+            "completion_tokens": completion_tokens,
+            "cached_tokens": sum(usage.cached_tokens for usage in requests),
+            "records_per_second": records / elapsed if elapsed else 0.0,
+            "tokens_per_second": completion_tokens / elapsed if elapsed else 0.0,
+            "latency": distribution([usage.latency for usage in requests]),
+            "time_to_first_byte": distribution(
+                [usage.time_to_first_byte for usage in requests]
+            ),
+            "time_to_first_token": distribution(
+                [usage.time_to_first_token for usage in requests]
+            ),
+        }
+
+    def report(self) -> Dict:
+        report = self.summary()
+        with self._lock:
+            report["per_request"] = [usage.to_dict() for usage in self.requests]
+        return report
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+
+        def format_distribution(values: Dict[str, Optional[float]]) -> str:
+            return ", ".join(
+                f"{name} {value:.3f}s" if value is not None else f"{name} -"
+                for name, value in values.items()
+            )
+
+        return "\n".join(
+            [
+                f"Usage: {summary['requests']} requests, {summary['records']} records "
+                f"in {summary['elapsed']:.2f}s "
+                f"({summary['records_per_second']:.2f} records/s)",
+                f"Tokens: {summary['prompt_tokens']} prompt "
+                f"({summary['cached_tokens']} cached), "
+                f"{summary['completion_tokens']} completion "
+                f"({summary['tokens_per_second']:.1f} tokens/s)",
+                f"Latency: {format_distribution(summary['latency'])}",
+                "Time to first byte: "
+                f"{format_distribution(summary['time_to_first_byte'])}",
+                "Time to first token: "
+                f"{format_distribution(summary['time_to_first_token'])}",
+            ]
+        )
+
+    def write_report(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
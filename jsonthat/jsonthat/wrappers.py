@@ -0,0 +1,635 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Union,
+)
+
+from .base import LLMProvider
+from .cache import ResponseCache
+from .ratelimit import DEFAULT_MAX_RETRIES, parse_retry_after
+from .schema import CompiledSchema
+from .usage import percentile
+
+# Providers that wrap others: a response cache in front of one, a load
+# balanced pool of providers of one kind, and hedging across several.
+
+# Before enough requests have been timed, requests are hedged after this many
+# seconds; then after the given percentile of the last LATENCY_WINDOW ones.
+DEFAULT_HEDGE_DELAY = 2.0
+DEFAULT_HEDGE_PERCENTILE = 95
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# A pool member failing this many requests in a row is left out for
+# EJECT_TIME seconds, doubling up to MAX_EJECT_TIME while it keeps failing.
+BALANCE_STRATEGIES = ["least-outstanding", "round-robin"]
+EJECT_AFTER_FAILURES = 3
+EJECT_TIME = 10.0
+MAX_EJECT_TIME = 300.0
+# Backoff before a request that every member of a pool has failed is sent
+# to them again.
+POOL_BACKOFF = 0.5
+MAX_POOL_BACKOFF = 60.0
+
+
+class CachedProvider(LLMProvider):
+    def __init__(
+        self,
+        provider: LLMProvider,
+        cache: ResponseCache,
+        refresh: bool = False,
+        validator: Optional[CompiledSchema] = None,
+    ):
+        self.provider = provider
+        self.cache = cache
+        self.refresh = refresh
+        self.validator = validator
+        self.name = provider.name
+
+    @property
+    def supports_streaming(self) -> bool:
+        return self.provider.supports_streaming
+
+    @property
+    def uncached(self) -> LLMProvider:
+        return self.provider.uncached
+
+    def _store(self, key: str, output: dict[str, any]):
+        # Outputs that do not match the schema are not kept, so that a later
+        # run asks for them again rather than replaying the failure.
+        if self.validator is not None and self.validator.validate(output):
+            return
+        self.cache.set(key, output)
+
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        return self.provider._prepare_request_data(text, schema)
+
+    def cache_key(self, text: str, schema: Optional[str] = None) -> str:
+        return self.provider.cache_key(text, schema)
+
+    def _lookup(self, text: str, schema: Optional[str] = None):
+        key = self.cache_key(text, schema)
+        # --refresh skips reads but still writes, to repopulate stale entries.
+        cached = None if self.refresh else self.cache.get(key)
+        return key, cached
+
+    def transform_text_to_json(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], Generator[str, None, None]]:
+        key, cached = self._lookup(text, schema)
+        if cached is not None:
+            return replay_response(cached) if stream else cached
+
+        result = self.provider.transform_text_to_json(text, schema, stream=stream)
+        if isinstance(result, Generator):
+            return self._record_stream(key, result)
+        self._store(key, result)
+        return result
+
+    async def transform_text_to_json_async(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], AsyncGenerator[str, None]]:
+        key, cached = self._lookup(text, schema)
+        if cached is not None:
+            return replay_response_async(cached) if stream else cached
+
+        result = await self.provider.transform_text_to_json_async(
+            text, schema, stream=stream
+        )
+        if not isinstance(result, dict):
+            return self._record_stream_async(key, result)
+        self._store(key, result)
+        return result
+
+    def _lookup_batch(self, texts: List[str], schema: Optional[str] = None):
+        lookups = [self._lookup(text, schema) for text in texts]
+        outputs = [cached for _, cached in lookups]
+        missing = [index for index, output in enumerate(outputs) if output is None]
+        return lookups, outputs, missing
+
+    def _store_batch(self, lookups, outputs, missing, fresh):
+        for index, output in zip(missing, fresh):
+            outputs[index] = output
+            if output is not None:
+                self._store(lookups[index][0], output)
+        return outputs
+
+    def transform_batch_to_json(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        lookups, outputs, missing = self._lookup_batch(texts, schema)
+        if not missing:
+            return outputs
+
+        if len(missing) == 1:
+            fresh = [self.provider.transform_text_to_json(texts[missing[0]], schema)]
+        else:
+            fresh = self.provider.transform_batch_to_json(
+                [texts[index] for index in missing], schema
+            )
+        return self._store_batch(lookups, outputs, missing, fresh)
+
+    async def transform_batch_to_json_async(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        lookups, outputs, missing = self._lookup_batch(texts, schema)
+        if not missing:
+            return outputs
+
+        if len(missing) == 1:
+            fresh = [
+                await self.provider.transform_text_to_json_async(
+                    texts[missing[0]], schema
+                )
+            ]
+        else:
+            fresh = await self.provider.transform_batch_to_json_async(
+                [texts[index] for index in missing], schema
+            )
+        return self._store_batch(lookups, outputs, missing, fresh)
+
+    def _record_stream(
+        self, key: str, generator: Generator[str, None, None]
+    ) -> Generator[str, None, None]:
+        chunks = []
+        for chunk in generator:
+            chunks.append(chunk)
+            yield chunk
+        try:
+            self._store(key, json.loads("".join(chunks)))
+        except json.JSONDecodeError:
+            pass
+
+    async def _record_stream_async(
+        self, key: str, generator: AsyncGenerator[str, None]
+    ) -> AsyncGenerator[str, None]:
+        chunks = []
+        async for chunk in generator:
+            chunks.append(chunk)
+            yield chunk
+        try:
+            self._store(key, json.loads("".join(chunks)))
+        except json.JSONDecodeError:
+            pass
+
+    def close(self):
+        self.provider.close()
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+
+class LoadBalancedProvider(LLMProvider):
+    # Spreads requests over a pool of providers of the same kind, one per API
+    # key or endpoint: to the member with the fewest requests in flight for
+    # its weight, or in weighted round robin. Members that fail repeatedly
+    # are ejected for a while, and a request that hits a failing member is
+    # sent to another one.
+
+    def __init__(
+        self,
+        members: List[LLMProvider],
+        weights: Optional[List[float]] = None,
+        balance: str = "least-outstanding",
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        if balance not in BALANCE_STRATEGIES:
+            raise ValueError(f"Unsupported balance strategy: {balance}")
+        self.members = members
+        # Members do not retry on their own: a failed request goes to the
+        # next member at once, and back to all of them up to max_retries
+        # times once each has failed it.
+        self.max_retries = max_retries
+        self.name = members[0].name
+        self.weights = weights or [1.0] * len(members)
+        self.balance = balance
+        self.outstanding = [0] * len(members)
+        self.requests = [0] * len(members)
+        self.failures = [0] * len(members)
+        self.ejections = [0] * len(members)
+        self.ejected_until = [0.0] * len(members)
+        self._current = [0.0] * len(members)
+        self._lock = threading.Lock()
+
+    @property
+    def supports_streaming(self) -> bool:
+        return self.members[0].supports_streaming
+
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        return self.members[0]._prepare_request_data(text, schema)
+
+    def cache_key(self, text: str, schema: Optional[str] = None) -> str:
+        return self.members[0].cache_key(text, schema)
+
+    def transform_text_to_json(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], Generator[str, None, None]]:
+        return self._call(
+            lambda member: member.transform_text_to_json(text, schema, stream)
+        )
+
+    def transform_batch_to_json(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        return self._call(lambda member: member.transform_batch_to_json(texts, schema))
+
+    async def transform_text_to_json_async(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], AsyncGenerator[str, None]]:
+        return await self._call_async(
+            lambda member: member.transform_text_to_json_async(text, schema, stream)
+        )
+
+    async def transform_batch_to_json_async(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        return await self._call_async(
+            lambda member: member.transform_batch_to_json_async(texts, schema)
+        )
+
+    def _choose(self, tried: set) -> Optional[int]:
+        now = time.monotonic()
+        candidates = [
+            index
+            for index in range(len(self.members))
+            if index not in tried and self.ejected_until[index] <= now
+        ]
+        if not candidates:
+            # With every member ejected, the one back soonest is still tried.
+            remaining = [i for i in range(len(self.members)) if i not in tried]
+            if not remaining:
+                return None
+            candidates = [min(remaining, key=lambda i: self.ejected_until[i])]
+        if self.balance == "round-robin":
+            # Smooth weighted round robin, as in nginx.
+            total = sum(self.weights[index] for index in candidates)
+            for index in candidates:
+                self._current[index] += self.weights[index]
+            choice = max(candidates, key=lambda index: self._current[index])
+            self._current[choice] -= total
+            return choice
+        return min(
+            candidates,
+            key=lambda index: (
+                (self.outstanding[index] + 1) / self.weights[index],
+                self.requests[index],
+            ),
+        )
+
+    def _checkout(
+        self, tried: set, error: Optional[Exception], rounds: int
+    ) -> Optional[int]:
+        # Returns None when every member has failed the request and it is to
+        # be retried.
+        with self._lock:
+            index = self._choose(tried)
+            if index is None:
+                if rounds >= self.max_retries:
+                    raise error
+                return None
+            tried.add(index)
+            self.outstanding[index] += 1
+            self.requests[index] += 1
+            return index
+
+    def _checkin(self, index: int, error: Optional[Exception] = None):
+        # Raises the error unless it is one to fail over from.
+        import requests
+
+        with self._lock:
+            self.outstanding[index] -= 1
+            if error is None:
+                self.failures[index] = 0
+                self.ejections[index] = 0
+                return
+        if not isinstance(error, requests.RequestException):
+            raise error
+        if not is_member_failure(error):
+            raise error
+        self._record_failure(index)
+
+    def _call(self, call: Callable[[LLMProvider], any]) -> any:
+        tried = set()
+        error = None
+        rounds = 0
+        while True:
+            index = self._checkout(tried, error, rounds)
+            if index is None:
+                rounds += 1
+                tried.clear()
+                time.sleep(self._retry_delay(rounds, error))
+                continue
+            try:
+                result = call(self.members[index])
+            except BaseException as e:
+                self._checkin(index, e)
+                error = e
+                continue
+            self._checkin(index)
+            return result
+
+    async def _call_async(self, call: Callable[[LLMProvider], Awaitable]) -> any:
+        import asyncio
+
+        tried = set()
+        error = None
+        rounds = 0
+        while True:
+            index = self._checkout(tried, error, rounds)
+            if index is None:
+                rounds += 1
+                tried.clear()
+                await asyncio.sleep(self._retry_delay(rounds, error))
+                continue
+            try:
+                result = await call(self.members[index])
+            except BaseException as e:
+                self._checkin(index, e)
+                error = e
+                continue
+            self._checkin(index)
+            return result
+
+    def _retry_delay(self, rounds: int, error: Exception) -> float:
+        # Full jitter, after the Retry-After of a throttled member if any.
+        import random
+
+        delay = random.uniform(
+            0, min(MAX_POOL_BACKOFF, POOL_BACKOFF * 2 ** (rounds - 1))
+        )
+        response = getattr(error, "response", None)
+        if response is not None:
+            delay += parse_retry_after(response.headers) or 0.0
+        return delay
+
+    def _record_failure(self, index: int):
+        with self._lock:
+            self.failures[index] += 1
+            if self.failures[index] < EJECT_AFTER_FAILURES:
+                return
+            # Ejected for longer each time it fails again once back.
+            self.failures[index] = 0
+            self.ejections[index] += 1
+            self.ejected_until[index] = time.monotonic() + min(
+                EJECT_TIME * 2 ** (self.ejections[index] - 1), MAX_EJECT_TIME
+            )
+
+    def format_summary(self) -> str:
+        now = time.monotonic()
+        ejected = sum(until > now for until in self.ejected_until)
+        return (
+            f"Balance: {self.name} requests per member "
+            f"{'/'.join(map(str, self.requests))}, {ejected} ejected"
+        )
+
+    def close(self):
+        for member in self.members:
+            member.close()
+
+    async def aclose(self):
+        for member in self.members:
+            await member.aclose()
+
+
+def is_member_failure(error: Exception) -> bool:
+    # Connection errors, server errors and rejected keys or quotas count
+    # against a member; other client errors are a problem with the request.
+    response = getattr(error, "response", None)
+    if response is None:
+        return True
+    return response.status_code >= 500 or response.status_code in (401, 403, 429)
+
+
+class HedgedProvider(LLMProvider):
+    # Sends each request to the first provider and, if no answer has come
+    # within the hedge delay, to the next one as well, keeping whichever
+    # answers first. A provider that fails hands the request over to the
+    # next one straight away.
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+    ):
+        self.providers = providers
+        self.name = providers[0].name
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.latencies = [deque(maxlen=LATENCY_WINDOW) for _ in providers]
+        self.hedges = 0
+        self.backup_wins = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    @property
+    def supports_streaming(self) -> bool:
+        return all(provider.supports_streaming for provider in self.providers)
+
+    def _prepare_request_data(self, text: str, schema: Optional[str] = None) -> Dict:
+        return self.providers[0]._prepare_request_data(text, schema)
+
+    def cache_key(self, text: str, schema: Optional[str] = None) -> str:
+        # Answers from any of the providers are cached as the first one's.
+        return self.providers[0].cache_key(text, schema)
+
+    def get_hedge_delay(self, index: int) -> float:
+        # Without a fixed delay, a request is hedged once it has taken longer
+        # than most recent requests to the same provider.
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self._lock:
+            latencies = list(self.latencies[index])
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return percentile(latencies, self.hedge_percentile)
+
+    def transform_text_to_json(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], Generator[str, None, None]]:
+        # A stream is raced up to its response headers.
+        return self._race(
+            lambda provider: provider.transform_text_to_json(text, schema, stream)
+        )
+
+    def transform_batch_to_json(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        return self._race(
+            lambda provider: provider.transform_batch_to_json(texts, schema)
+        )
+
+    async def transform_text_to_json_async(
+        self, text: str, schema: Optional[str] = None, stream: bool = False
+    ) -> Union[dict[str, any], AsyncGenerator[str, None]]:
+        return await self._race_async(
+            lambda provider: provider.transform_text_to_json_async(text, schema, stream)
+        )
+
+    async def transform_batch_to_json_async(
+        self, texts: List[str], schema: Optional[str] = None
+    ) -> List[Optional[dict[str, any]]]:
+        return await self._race_async(
+            lambda provider: provider.transform_batch_to_json_async(texts, schema)
+        )
+
+    def _attempt(self, index: int, call: Callable[[LLMProvider], any]):
+        from concurrent.futures import Future
+
+        future = Future()
+
+        def run():
+            start = time.perf_counter()
+            try:
+                result = call(self.providers[index])
+            except Exception as e:
+                future.set_exception(e)
+                return
+            with self._lock:
+                self.latencies[index].append(time.perf_counter() - start)
+            future.set_result(result)
+
+        # Daemon threads, so that a request left behind by a faster provider
+        # never delays the exit.
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _race(self, call: Callable[[LLMProvider], any]) -> any:
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        attempts = {}
+        next_index = 0
+        hedge_at = 0.0
+        error = None
+
+        def launch():
+            nonlocal next_index, hedge_at
+            attempts[self._attempt(next_index, call)] = next_index
+            hedge_at = time.monotonic() + self.get_hedge_delay(next_index)
+            next_index += 1
+
+        launch()
+        while attempts:
+            timeout = None
+            if next_index < len(self.providers):
+                timeout = max(hedge_at - time.monotonic(), 0)
+            done, _ = wait(attempts, timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.hedges += 1
+                launch()
+                continue
+            for future in done:
+                index = attempts.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    if next_index < len(self.providers):
+                        with self._lock:
+                            self.failovers += 1
+                        launch()
+                    continue
+                for loser in attempts:
+                    loser.add_done_callback(discard_result)
+                if index > 0:
+                    with self._lock:
+                        self.backup_wins += 1
+                return result
+        raise error
+
+    async def _attempt_async(self, index: int, call: Callable[[LLMProvider], any]):
+        start = time.perf_counter()
+        result = await call(self.providers[index])
+        with self._lock:
+            self.latencies[index].append(time.perf_counter() - start)
+        return result
+
+    async def _race_async(self, call: Callable[[LLMProvider], Awaitable]) -> any:
+        # The same race as _race(), with tasks instead of threads: the losing
+        # requests are cancelled rather than left to finish.
+        import asyncio
+
+        attempts = {}
+        next_index = 0
+        hedge_at = 0.0
+        error = None
+
+        def launch():
+            nonlocal next_index, hedge_at
+            task = asyncio.ensure_future(self._attempt_async(next_index, call))
+            attempts[task] = next_index
+            hedge_at = time.monotonic() + self.get_hedge_delay(next_index)
+            next_index += 1
+
+        launch()
+        try:
+            while attempts:
+                timeout = None
+                if next_index < len(self.providers):
+                    timeout = max(hedge_at - time.monotonic(), 0)
+                done, _ = await asyncio.wait(
+                    attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    with self._lock:
+                        self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    index = attempts.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        if next_index < len(self.providers):
+                            with self._lock:
+                                self.failovers += 1
+                            launch()
+                        continue
+                    if index > 0:
+                        with self._lock:
+                            self.backup_wins += 1
+                    return result
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def format_summary(self) -> str:
+        return (
+            f"Hedging: {self.hedges} hedged requests, {self.backup_wins} answered "
+            f"by a backup provider, {self.failovers} failovers"
+        )
+
+    def close(self):
+        for provider in self.providers:
+            provider.close()
+
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.aclose()
+
+
+def discard_result(future):
+    # The losing request of a race can not be interrupted once sent, so its
+    # answer is dropped when it arrives, closing a stream without reading it.
+    if not future.exception() and isinstance(future.result(), Generator):
+        future.result().close()
+
+
+def replay_response(result: dict[str, any]) -> Generator[str, None, None]:
+    yield json.dumps(result, indent=2)
+
+
+async def replay_response_async(result: dict[str, any]) -> AsyncGenerator[str, None]:
+    yield json.dumps(result, indent=2)
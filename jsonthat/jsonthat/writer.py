@@ -0,0 +1,143 @@
+import json
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, TextIO, Tuple
+
+OUTPUT_MODES = ["pretty", "jsonl", "json"]
+FLUSH_INTERVAL = 0.2
+FLUSH_SIZE = 64 * 1024
+
+
+class OutputWriter:
+    # Buffers output and writes it in large pieces: when the buffer reaches
+    # flush_size, or from a background thread once data has been waiting
+    # for flush_interval. Interactive terminals are flushed on every write.
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        mode: str = "pretty",
+        line_numbers: bool = False,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+        on_flush: Optional[Callable[[], None]] = None,
+    ):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"Unsupported output mode: {mode}")
+        self.stream = stream or sys.stdout
+        self.mode = mode
+        self.line_numbers = line_numbers
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # Runs once written output has reached the stream, e.g. to record it
+        # as done in a checkpoint journal.
+        self.on_flush = on_flush
+        self.records = 0
+        self._buffer: List[str] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._size = 0
+        self._interactive = self.stream.isatty()
+        self._closed = False
+        self._error: Optional[OSError] = None
+        self._pending_since = 0.0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flusher: Optional[threading.Thread] = None
+
+    def format(self, result: any, key: Optional[Tuple[str, int]] = None) -> str:
+        if self.line_numbers and key is not None:
+            path, number = key
+            tagged = {"line": number}
+            if path != "-":
+                tagged["input"] = path
+            tagged["output"] = result
+            result = tagged
+        if self.mode == "pretty":
+            return json.dumps(result, indent=2) + "\n"
+        text = json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+        if self.mode == "json":
+            # One JSON array for the whole run, one element per line.
+            return ("[\n" if self.records == 0 else ",\n") + text
+        return text + "\n"
+
+    def write(
+        self,
+        result: any,
+        key: Optional[Tuple[str, int]] = None,
+        on_written: Optional[Callable[[], None]] = None,
+    ):
+        # on_written runs once this result has reached the stream.
+        text = self.format(result, key)
+        self.records += 1
+        self.write_text(text, on_written)
+
+    def write_text(self, text: str, on_written: Optional[Callable[[], None]] = None):
+        with self._lock:
+            if self._error:
+                raise self._error
+            if not self._buffer:
+                self._pending_since = time.monotonic()
+                self._wake.notify()
+            self._buffer.append(text)
+            self._size += len(text)
+            if on_written:
+                self._callbacks.append(on_written)
+            flush = self._interactive or self._size >= self.flush_size
+            if not flush and self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, daemon=True)
+                self._flusher.start()
+        if flush:
+            self._flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if not self._buffer:
+                        self._wake.wait()
+                        continue
+                    remaining = (
+                        self._pending_since + self.flush_interval - time.monotonic()
+                    )
+                    if remaining <= 0:
+                        break
+                    self._wake.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self._flush()
+            except OSError as e:
+                # Reported to the main thread on its next write.
+                with self._lock:
+                    self._error = e
+                return
+
+    def _flush(self):
+        # The buffer is swapped out under the lock and written outside it,
+        # so that a slow reader of the stream holds up the flush but not
+        # the threads writing results. The I/O lock keeps flushes in order.
+        with self._io_lock:
+            with self._lock:
+                text = "".join(self._buffer)
+                callbacks = self._callbacks
+                self._buffer, self._callbacks, self._size = [], [], 0
+            if text:
+                self.stream.write(text)
+            self.stream.flush()
+            for callback in callbacks:
+                callback()
+            if self.on_flush:
+                self.on_flush()
+
+    def flush(self):
+        self._flush()
+
+    def close(self):
+        if self.mode == "json":
+            self.write_text("[]\n" if self.records == 0 else "\n]\n")
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        self._flush()
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.aio import transform_lines_async
+from jsonthat.asynchttp import AsyncSession
+from jsonthat.cache import ResponseCache
+from jsonthat.dedupe import RecordCoalescer
+from jsonthat.main import OpenAIProvider
+from jsonthat.usage import UsageTracker
+from jsonthat.wrappers import CachedProvider, HedgedProvider
+from tests.test_mock_server import make_providers
+
+
+@pytest.fixture
+def server():
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        yield server
+
+
+async def collect(result):
+    if isinstance(result, dict):
+        return result
+    return json.loads("".join([chunk async for chunk in result]))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_providers_async(server, stream):
+    async def run(provider):
+        try:
+            first = await provider.transform_text_to_json_async("a", stream=stream)
+            first = await collect(first)
+            second = await provider.transform_text_to_json_async("b", stream=stream)
+            second = await collect(second)
+            # Both requests went over the same kept-alive connection.
+            assert sum(map(len, provider.async_session._idle.values())) == 1
+            return first, second
+        finally:
+            await provider.aclose()
+
+    for provider in make_providers(server.url):
+        provider.usage_tracker = UsageTracker()
+        first, second = asyncio.run(run(provider))
+        assert (first["text"], second["text"]) == ("a", "b"), provider.name
+        usage = provider.usage_tracker.requests[0]
+        assert usage.prompt_tokens > 0 and usage.completion_tokens > 0, provider.name
+
+
+def test_new_event_loop_drops_the_previous_pool(server):
+    provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+    asyncio.run(provider.transform_text_to_json_async("a"))
+    previous = provider._async_session
+    [[(_, writer)]] = previous._idle.values()
+
+    asyncio.run(provider.transform_text_to_json_async("b"))
+    assert provider._async_session is not previous
+    assert not previous._idle
+    # The connection of the closed loop has been shut down.
+    sock = writer.get_extra_info("socket").dup()
+    with pytest.raises(OSError):
+        sock.send(b"x")
+    sock.close()
+    provider.close()
+
+
+def test_http_errors_are_raised_as_requests_errors():
+    settings = MockSettings(latency=0, token_rate=0, error_rate=1.0, seed=1)
+    with MockLLMServer(settings) as server:
+        provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+        with pytest.raises(requests.HTTPError) as error:
+            asyncio.run(provider.transform_text_to_json_async("a"))
+    assert error.value.response.status_code in (429, 500)
+
+    provider = OpenAIProvider("mock", api_base="http://127.0.0.1:9/v1")
+    with pytest.raises(requests.ConnectionError):
+        asyncio.run(provider.transform_text_to_json_async("a"))
+
+
+def test_structured_outputs_fall_back_async():
+    settings = MockSettings(latency=0, token_rate=0, structured_outputs=False)
+    with MockLLMServer(settings) as server:
+        provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+
+        async def run():
+            try:
+                return [
+                    await provider.transform_text_to_json_async(text, "text: string")
+                    for text in ["a", "b"]
+                ]
+            finally:
+                await provider.aclose()
+
+        assert [result["text"] for result in asyncio.run(run())] == ["a", "b"]
+    assert (settings.rejected, settings.requests) == (1, 3)
+
+
+def test_pool_slot_is_released_on_cancel_and_bad_body():
+    # The first response stalls in its body, the second has a malformed
+    # chunk size and the third is complete.
+    heads = [
+        b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n{",
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+        b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}",
+    ]
+
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(heads.pop(0))
+        await writer.drain()
+        await asyncio.sleep(5)
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        session = AsyncSession(pool_size=1)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(session.post(url, json={}), 0.2)
+            with pytest.raises(requests.ConnectionError):
+                await asyncio.wait_for(session.post(url, json={}), 2)
+            response = await asyncio.wait_for(session.post(url, json={}), 2)
+            return response.json()
+        finally:
+            await session.aclose()
+            server.close()
+
+    assert asyncio.run(run()) == {}
+
+
+def test_headers_are_sent_once_and_reads_time_out():
+    heads = []
+
+    async def handle(reader, writer):
+        heads.append(await reader.readuntil(b"\r\n\r\n"))
+        if len(heads) == 1:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+            await writer.drain()
+        await asyncio.sleep(5)
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        session = AsyncSession()
+        try:
+            headers = {"content-type": "application/json; charset=utf-8"}
+            response = await session.post(url, headers, json={}, timeout=(1, 1))
+            assert response.json() == {}
+            # The kept-alive connection gets no answer this time.
+            with pytest.raises(requests.ReadTimeout):
+                await session.post(url, json={}, timeout=(1, 0.1))
+        finally:
+            await session.aclose()
+            server.close()
+
+    asyncio.run(run())
+    lines = heads[0].decode().lower().split("\r\n")
+    assert [line for line in lines if line.startswith("content-type")] == [
+        "content-type: application/json; charset=utf-8"
+    ]
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_transform_lines_async(server, ordered):
+    provider = OpenAIProvider("mock", api_base=f"{server.url}/v1", pool_size=50)
+    lines = [f"line {i % 150}" for i in range(200)]
+
+    async def run():
+        results = transform_lines_async(
+            provider,
+            lines,
+            concurrency=50,
+            ordered=ordered,
+            coalescer=RecordCoalescer(),
+        )
+        try:
+            return [result["text"] async for result in results]
+        finally:
+            await provider.aclose()
+
+    texts = asyncio.run(run())
+    assert texts == lines if ordered else sorted(texts) == sorted(lines)
+    assert server.settings.requests == 150
+
+
+def test_slow_input_does_not_block_the_loop():
+    provider = SlowProvider("a", 0)
+    beats = []
+
+    def lines():
+        yield "first"
+        time.sleep(0.3)
+        yield "second"
+
+    async def heartbeat():
+        while True:
+            beats.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        beating = asyncio.ensure_future(heartbeat())
+        results = [result async for result in transform_lines_async(provider, lines())]
+        beating.cancel()
+        return results
+
+    assert asyncio.run(run()) == [{"provider": "a"}] * 2
+    assert len(beats) > 10
+
+
+def test_cached_provider_async(server, tmp_path):
+    provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+    cached = CachedProvider(provider, ResponseCache(str(tmp_path)))
+
+    async def run():
+        results = await cached.transform_batch_to_json_async(["a", "b"])
+        streamed = await collect(
+            await cached.transform_text_to_json_async("a", stream=True)
+        )
+        await cached.aclose()
+        return results, streamed
+
+    results, streamed = asyncio.run(run())
+    assert [result["text"] for result in results] == ["a", "b"]
+    assert streamed == results[0]
+    assert server.settings.requests == 1
+
+
+class SlowProvider:
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.cancelled = False
+
+    async def transform_text_to_json_async(self, text, schema=None, stream=False):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return {"provider": self.name}
+
+
+def test_hedged_async_cancels_the_loser():
+    primary, backup = SlowProvider("a", 1.0), SlowProvider("b", 0)
+    provider = HedgedProvider([primary, backup], hedge_delay=0.02)
+
+    async def run():
+        result = await provider.transform_text_to_json_async("x")
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == {"provider": "b"}
+    assert primary.cancelled
+    assert (provider.hedges, provider.backup_wins) == (1, 1)
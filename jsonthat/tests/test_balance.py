@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import Config, build_provider
+from jsonthat.wrappers import EJECT_AFTER_FAILURES, LoadBalancedProvider
+
+
+class Member:
+    supports_streaming = False
+    name = "ollama"
+
+    def __init__(self, label, error=None, wait=None):
+        self.label = label
+        self.error = error
+        self.wait = wait
+        self.calls = 0
+
+    def transform_text_to_json(self, text, schema=None, stream=False):
+        self.calls += 1
+        if self.wait:
+            self.wait.wait(2)
+        if self.error:
+            raise self.error
+        return {"member": self.label}
+
+    def close(self):
+        pass
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+def test_weighted_round_robin():
+    members = [Member("a"), Member("b"), Member("c")]
+    provider = LoadBalancedProvider(members, [3, 1, 1], balance="round-robin")
+    labels = [provider.transform_text_to_json("x")["member"] for _ in range(10)]
+    assert Counter(labels) == {"a": 6, "b": 2, "c": 2}
+    # Smooth: the heavier member is interleaved, not sent bursts.
+    assert labels[:5] == ["a", "b", "a", "c", "a"]
+
+
+def test_least_outstanding_avoids_busy_members():
+    release = threading.Event()
+    members = [Member("a", wait=release), Member("b")]
+    provider = LoadBalancedProvider(members)
+    busy = threading.Thread(target=provider.transform_text_to_json, args=("x",))
+    busy.start()
+    while provider.outstanding[0] == 0:
+        pass
+    assert [provider.transform_text_to_json("y")["member"] for _ in range(3)] == [
+        "b"
+    ] * 3
+    release.set()
+    busy.join()
+    assert provider.outstanding == [0, 0]
+
+
+def test_failing_member_is_ejected_and_requests_fail_over():
+    broken = Member("a", error=requests.ConnectionError("refused"))
+    provider = LoadBalancedProvider([broken, Member("b")], balance="round-robin")
+    for _ in range(10):
+        assert provider.transform_text_to_json("x") == {"member": "b"}
+    assert broken.calls == EJECT_AFTER_FAILURES
+    assert "1 ejected" in provider.format_summary()
+
+    # Back in the pool once the ejection has expired.
+    with patch("jsonthat.wrappers.time.monotonic", return_value=1e9):
+        broken.error = None
+        assert {provider.transform_text_to_json("x")["member"] for _ in range(2)} == {
+            "a",
+            "b",
+        }
+
+
+def test_request_errors_are_not_held_against_members():
+    members = [Member("a", error=http_error(400)), Member("b")]
+    provider = LoadBalancedProvider(members)
+    with pytest.raises(requests.HTTPError):
+        provider.transform_text_to_json("x")
+    assert provider.failures == [0, 0]
+
+    # When every member fails, the last error is raised.
+    members = [Member(label, error=http_error(503)) for label in "ab"]
+    with pytest.raises(requests.HTTPError, match="503"):
+        LoadBalancedProvider(members, max_retries=0).transform_text_to_json("x")
+
+
+def test_requests_every_member_failed_are_retried():
+    members = [Member(label, error=http_error(503)) for label in "ab"]
+    provider = LoadBalancedProvider(members, max_retries=2)
+    with patch("jsonthat.wrappers.time.sleep") as sleep:
+        with pytest.raises(requests.HTTPError):
+            provider.transform_text_to_json("x")
+        assert [member.calls for member in members] == [3, 3]
+        assert sleep.call_count == 2
+
+        members[1].error = None
+        assert provider.transform_text_to_json("x") == {"member": "b"}
+
+
+def test_pool_fails_over_without_member_retries(monkeypatch):
+    monkeypatch.delenv("OLLAMA_API_URL", raising=False)
+    config = Config()
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        config.config = {
+            "providers": {"ollama": {"api_urls": ["http://127.0.0.1:9", server.url]}},
+            "default_provider": "ollama",
+        }
+        provider, endpoints = build_provider(config, "ollama")
+        start = time.perf_counter()
+        for text in ["a", "b", "c", "d"]:
+            assert provider.transform_text_to_json(text)["text"] == text
+        elapsed = time.perf_counter() - start
+    assert elapsed < 1
+    assert endpoints[0][1].rate_limiter.retries == 0
@@ -0,0 +1,252 @@
+import io
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from jsonthat.batch import (
+    BatchJobStore,
+    batch_command,
+    collect_results,
+    get_batch_backend,
+    wait_for_batch,
+)
+from jsonthat.main import ClaudeProvider, Config, MistralProvider, OpenAIProvider
+
+
+class BatchStandIn(BaseHTTPRequestHandler):
+    # Minimal stand-in for the OpenAI Batch API and Anthropic Message Batches:
+    # every record is answered with {"input": <user message>}, except records
+    # containing "fail". A job reports itself complete on the second poll.
+    files = {}
+    batches = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read(self) -> bytes:
+        return self.rfile.read(int(self.headers["Content-Length"]))
+
+    def _base(self) -> str:
+        return f"http://{self.headers['Host']}"
+
+    def do_POST(self):
+        if self.path == "/v1/files":
+            body = self._read()
+            start = body.index(b"\r\n\r\n", body.index(b'name="file"')) + 4
+            content = body[start : body.index(b"\r\n--", start)]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = content.decode()
+            self._send({"id": file_id})
+        elif self.path == "/v1/batches":
+            request = json.loads(self._read())
+            batch_id = f"batch_{len(self.batches)}"
+            self.batches[batch_id] = {
+                "kind": "openai",
+                # Jobs are only visible to the key that submitted them.
+                "key": self.headers["Authorization"],
+                "polls": 0,
+                "requests": [
+                    json.loads(line)
+                    for line in self.files[request["input_file_id"]].splitlines()
+                ],
+            }
+            self._send({"id": batch_id, "status": "validating"})
+        elif self.path == "/v1/messages/batches":
+            request = json.loads(self._read())
+            batch_id = f"msgbatch_{len(self.batches)}"
+            self.batches[batch_id] = {
+                "kind": "claude",
+                "polls": 0,
+                "requests": request["requests"],
+            }
+            self._send({"id": batch_id, "processing_status": "in_progress"})
+        else:
+            self._send({"error": "not found"}, 404)
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/(messages/)?batches/([\w-]+)(/results)?", self.path)
+        batch = self.batches.get(match.group(2)) if match else None
+        if (
+            batch
+            and batch.get("key", self.headers["Authorization"])
+            == (self.headers["Authorization"])
+        ):
+            batch_id = match.group(2)
+            if match.group(3):
+                self._send(self._claude_results(batch_id))
+            else:
+                self._send(self._describe(batch_id))
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            batch_id = self.path.split("/")[3].replace("output-", "")
+            self._send(self._openai_results(batch_id))
+        else:
+            self._send({"error": "not found"}, 404)
+
+    def _describe(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        done = batch["polls"] > 1
+        total = len(batch["requests"])
+        if batch["kind"] == "openai":
+            return {
+                "id": batch_id,
+                "status": "completed" if done else "in_progress",
+                "output_file_id": f"output-{batch_id}" if done else None,
+                "request_counts": {
+                    "total": total,
+                    "completed": total if done else 0,
+                    "failed": 0,
+                },
+            }
+        return {
+            "id": batch_id,
+            "processing_status": "ended" if done else "in_progress",
+            "results_url": f"{self._base()}/v1/messages/batches/{batch_id}/results"
+            if done
+            else None,
+            "request_counts": {
+                "processing": 0 if done else total,
+                "succeeded": total if done else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+        }
+
+    def _openai_results(self, batch_id):
+        lines = []
+        # Results are returned out of order, like the real API may do.
+        for request in reversed(self.batches[batch_id]["requests"]):
+            text = request["body"]["messages"][-1]["content"]
+            lines.append(
+                {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "choices": [
+                                {"message": {"content": json.dumps({"input": text})}}
+                            ]
+                        },
+                    },
+                    "error": None,
+                }
+            )
+        return "\n".join(json.dumps(line) for line in lines).encode()
+
+    def _claude_results(self, batch_id):
+        lines = []
+        for request in reversed(self.batches[batch_id]["requests"]):
+            text = request["params"]["messages"][-1]["content"]
+            if "fail" in text:
+                result = {"type": "errored", "error": {"type": "overloaded_error"}}
+            else:
+                result = {
+                    "type": "succeeded",
+                    "message": {"content": [{"text": json.dumps({"input": text})}]},
+                }
+            lines.append({"custom_id": request["custom_id"], "result": result})
+        return "\n".join(json.dumps(line) for line in lines).encode()
+
+
+@pytest.fixture
+def server():
+    BatchStandIn.files = {}
+    BatchStandIn.batches = {}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), BatchStandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/v1"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_openai_batch_roundtrip(server):
+    provider = OpenAIProvider("test_key", api_base=server)
+    backend = get_batch_backend(provider)
+
+    job_id = backend.submit(["first", "second", "third"])
+    assert not backend.status(job_id).done
+    status = wait_for_batch(backend, job_id, poll_interval=0)
+    assert status.done and status.completed == 3
+
+    results = collect_results(backend, job_id, 3)
+    inputs = [result["output"]["input"].split(": ")[-1] for result in results]
+    assert inputs == ["first", "second", "third"]
+
+
+def test_claude_batch_reports_failed_records(server):
+    provider = ClaudeProvider("test_key", api_base=server)
+    backend = get_batch_backend(provider)
+
+    job_id = backend.submit(["first", "please fail", "third"])
+    wait_for_batch(backend, job_id, poll_interval=0)
+    results = collect_results(backend, job_id, 3)
+
+    assert "first" in results[0]["output"]["input"]
+    assert "error" in results[1]
+    assert "third" in results[2]["output"]["input"]
+
+
+@pytest.mark.parametrize("provider_class", [OpenAIProvider, ClaudeProvider])
+def test_batch_requests_time_out(server, provider_class, monkeypatch):
+    provider = provider_class("test_key", api_base=server)
+    timeouts = []
+    request = provider.session.request
+
+    def timed_request(method, url, **kwargs):
+        timeouts.append(kwargs.get("timeout"))
+        return request(method, url, **kwargs)
+
+    monkeypatch.setattr(provider.session, "request", timed_request)
+    backend = get_batch_backend(provider)
+    job_id = backend.submit(["first"])
+    wait_for_batch(backend, job_id, poll_interval=0)
+    collect_results(backend, job_id, 1)
+
+    assert timeouts and None not in timeouts
+
+
+def test_batch_unsupported_provider():
+    with pytest.raises(ValueError):
+        get_batch_backend(MistralProvider("test_key"))
+
+
+def test_batch_job_store(tmp_path):
+    store = BatchJobStore(str(tmp_path))
+    store.save("batch_1", "openai", 42)
+    assert store.load("batch_1")["count"] == 42
+    assert store.load("missing") is None
+
+
+def test_batch_with_a_key_pool(server, tmp_path, monkeypatch, capsys):
+    for name in ["LLM_PROVIDER", "LLM_API_KEY", "LLM_MODEL", "LLM_API_BASE"]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    config = Config()
+    config.config = {
+        "providers": {"openai": {"api_keys": ["k1", "k2"], "api_base": server}},
+        "default_provider": "openai",
+    }
+    monkeypatch.setattr("sys.stdin", io.StringIO("first\n\nsecond\n"))
+    batch_command(config, ["submit", "--key-index", "1"])
+    job_id = capsys.readouterr().out.strip()
+    assert BatchStandIn.batches[job_id]["key"] == "Bearer k2"
+
+    batch_command(config, ["collect", job_id, "--poll-interval", "0"])
+    outputs = capsys.readouterr().out
+    assert "first" in outputs and "second" in outputs
+
+    with pytest.raises(SystemExit):
+        batch_command(config, ["status", job_id, "--key-index", "2"])
+    assert "out of range" in capsys.readouterr().err
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from unittest.mock import patch
+
+from jsonthat.cache import ResponseCache
+from jsonthat.main import OpenAIProvider, transform_lines
+from jsonthat.schema import CompiledSchema, InvalidOutput
+from jsonthat.wrappers import CachedProvider
+
+
+def openai_response(content):
+    return {"choices": [{"message": {"content": json.dumps(content)}}]}
+
+
+def test_cache_get_set(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("abcd") is None
+    cache.set("abcd", {"key": "value"})
+    assert cache.get("abcd") == {"key": "value"}
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_cache_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    cache.set("abcd", {"key": "value"})
+    with patch("time.time", return_value=time.time() + 120):
+        assert cache.get("abcd") is None
+    assert not os.path.exists(cache._path("abcd"))
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    value = {"data": "x" * 100}
+    cache = ResponseCache(str(tmp_path), max_size=400)
+    cache.set("aa01", value)
+    cache.set("aa02", value)
+    os.utime(cache._path("aa01"), (1, 1))
+    os.utime(cache._path("aa02"), (2, 2))
+    cache.get("aa01")  # aa01 becomes the most recently used entry
+    cache.set("aa03", value)
+
+    assert os.path.exists(cache._path("aa01"))
+    assert not os.path.exists(cache._path("aa02"))
+    assert os.path.exists(cache._path("aa03"))
+
+
+def test_rewritten_entry_keeps_its_size(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.set("aa01", {"data": "x" * 100})
+    for _ in range(5):
+        # As with --refresh, which stores every response again.
+        cache.set("aa02", {"data": "x" * 100})
+    assert cache._size == cache._scan_size()
+
+
+def test_unwritable_cache_is_skipped(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    cache = ResponseCache(str(blocker / "responses"))
+    provider = CachedProvider(OpenAIProvider("test_key"), cache)
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = openai_response({"key": "value"})
+        assert provider.transform_text_to_json("test text") == {"key": "value"}
+    assert cache.get(provider.cache_key("test text")) is None
+
+
+def test_cached_provider_skips_network(tmp_path):
+    provider = CachedProvider(OpenAIProvider("test_key"), ResponseCache(str(tmp_path)))
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = openai_response({"key": "value"})
+        assert provider.transform_text_to_json("test text") == {"key": "value"}
+        assert provider.transform_text_to_json("test text") == {"key": "value"}
+        assert provider.transform_text_to_json("test text", "name: string")
+    assert mock_post.call_count == 2
+
+
+def test_cached_provider_replays_stream(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    provider = CachedProvider(OpenAIProvider("test_key"), cache)
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = openai_response({"key": "value"})
+        provider.transform_text_to_json("test text")
+        chunks = list(provider.transform_text_to_json("test text", stream=True))
+    assert json.loads("".join(chunks)) == {"key": "value"}
+    assert mock_post.call_count == 1
+
+
+def test_cached_provider_refresh(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    provider = CachedProvider(OpenAIProvider("test_key"), cache, refresh=True)
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = openai_response({"key": "value"})
+        provider.transform_text_to_json("test text")
+        provider.transform_text_to_json("test text")
+    assert mock_post.call_count == 2
+    assert cache.get(provider.cache_key("test text")) == {"key": "value"}
+
+
+def test_outputs_failing_the_schema_are_not_cached(tmp_path):
+    schema = CompiledSchema.parse("name: string\nage: integer")
+    cache = ResponseCache(str(tmp_path))
+
+    def run():
+        provider = CachedProvider(OpenAIProvider("test_key"), cache, validator=schema)
+        return list(
+            transform_lines(provider, ["Jay 30"], str(schema), validator=schema)
+        )
+
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = openai_response({"name": "Jay"})
+        assert isinstance(run()[0], InvalidOutput)
+        assert mock_post.call_count == 3
+        # The retries reached the provider, and a rerun asks again.
+        assert isinstance(run()[0], InvalidOutput)
+        assert mock_post.call_count == 6
+
+        valid = {"name": "Jay", "age": 30}
+        mock_post.return_value.json.return_value = openai_response(valid)
+        assert run() == [valid]
+        assert run() == [valid]
+        assert mock_post.call_count == 7
+
+
+def test_cache_key_includes_the_endpoint():
+    api = OpenAIProvider("test_key")
+    proxy = OpenAIProvider("test_key", api_base="http://127.0.0.1:8080/v1")
+    assert api.cache_key("test text") != proxy.cache_key("test text")
+    assert api.cache_key("test text") == OpenAIProvider("other").cache_key("test text")
@@ -0,0 +1,56 @@
+import io
+import json
+
+import pytest
+
+from jsonthat.chunking import iter_chunks, merge_results
+from jsonthat.schema import CompiledSchema
+
+
+def test_iter_chunks_short_input():
+    assert list(iter_chunks(io.StringIO("  hello world \n"))) == ["hello world"]
+
+
+def test_iter_chunks_splits_on_boundaries_with_overlap():
+    paragraphs = [f"Paragraph {i} " + "word " * 30 for i in range(10)]
+    text = "\n\n".join(paragraphs)
+    chunks = list(iter_chunks(io.StringIO(text), chunk_tokens=100, overlap_tokens=10))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 400 for chunk in chunks)
+    # Every chunk but the first repeats the end of the previous one.
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.split()[0] in previous.split()[-12:]
+    # Nothing from the input is lost.
+    assert set(text.split()) == set(" ".join(chunks).split())
+
+
+def test_merge_results_deep_merge():
+    results = [
+        {"title": "Doc", "authors": ["Ann"], "meta": {"pages": 10}},
+        {"title": "Other", "authors": ["Ann", "Bob"], "meta": {"lang": "en"}},
+        {"title": None, "tags": ["x"]},
+    ]
+    assert merge_results(results) == {
+        "title": "Doc",
+        "authors": ["Ann", "Bob"],
+        "meta": {"pages": 10, "lang": "en"},
+        "tags": ["x"],
+    }
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        json.dumps({"type": "object", "properties": {"names": {"type": "array"}}}),
+        "names: string[]",
+    ],
+)
+def test_merge_results_uses_schema_arrays(text):
+    schema = CompiledSchema.parse(text).schema
+    results = [{"names": "Ann"}, {"names": "Bob"}, {"names": "Ann"}]
+    assert merge_results(results, schema) == {"names": ["Ann", "Bob"]}
+
+
+def test_merge_results_empty():
+    assert merge_results([]) is None
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import jsonthat
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import OpenAIProvider
+
+CONFIG = {
+    "providers": {"openai": {"api_key": "test_key"}},
+    "default_provider": "openai",
+}
+
+
+@pytest.fixture
+def mock_post():
+    def reply(url, **kwargs):
+        # Echoes the record, one response object per request.
+        text = kwargs["json"]["messages"][-1]["content"].split(": ", 1)[1]
+        response = MagicMock(status_code=200)
+        response.json.return_value = {
+            "choices": [{"message": {"content": json.dumps({"text": text})}}]
+        }
+        return response
+
+    with patch("requests.Session.post", side_effect=reply) as mock:
+        yield mock
+
+
+def test_client_reuses_provider(mock_post):
+    with jsonthat.Client(config=CONFIG, cache=False) as client:
+        assert isinstance(client.provider, OpenAIProvider)
+        assert client.transform("a") == {"text": "a"}
+        session = client.provider.session
+        assert client.transform("b") == {"text": "b"}
+        assert client.provider.session is session
+    assert mock_post.call_count == 2
+
+
+def test_transform_many_keeps_order_and_dedupes(mock_post):
+    client = jsonthat.Client(config=CONFIG, cache=False, concurrency=3, usage=True)
+    results = list(client.transform_many(["a", "b", "a", "c"]))
+    assert results == [{"text": "a"}, {"text": "b"}, {"text": "a"}, {"text": "c"}]
+    assert mock_post.call_count == 3
+    assert client.usage.records == 4
+    client.close()
+
+
+def test_transform_many_reads_records_like_line(mock_post, monkeypatch):
+    # An explicit config replaces config.yaml, which is never read.
+    monkeypatch.setattr(
+        "jsonthat.main.Config.load_config", MagicMock(side_effect=OSError)
+    )
+    client = jsonthat.Client(config=CONFIG, cache=False)
+    results = list(client.transform_many(["a\n", "\n", "  b  \n", ""]))
+    assert results == [{"text": "a"}, {"text": "b"}]
+    assert mock_post.call_count == 2
+    client.close()
+
+
+def test_schema_mismatch(mock_post):
+    schema = {"type": "object", "required": ["name"]}
+    client = jsonthat.Client(config=CONFIG, schema=schema, cache=False)
+    with pytest.raises(jsonthat.TransformError) as error:
+        client.transform("a")
+    assert error.value.result.errors
+    [result] = client.transform_many(["b"])
+    assert isinstance(result, jsonthat.InvalidOutput)
+
+
+def test_stream_from_cache(mock_post, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    client = jsonthat.Client(config=CONFIG)
+    assert client.transform("a") == {"text": "a"}
+    # Served from the cache, so replayed in one piece.
+    assert json.loads("".join(client.stream("a"))) == {"text": "a"}
+    assert mock_post.call_count == 1
+
+
+def test_async_client():
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        config = {
+            "providers": {
+                "openai": {"api_key": "mock", "api_base": f"{server.url}/v1"}
+            },
+            "default_provider": "openai",
+        }
+
+        async def run():
+            async with jsonthat.AsyncClient(config=config, cache=False) as client:
+                single = await client.transform("a")
+                many = [result async for result in client.transform_many(["b", "c"])]
+                streamed = "".join([chunk async for chunk in client.stream("d")])
+                return single, many, json.loads(streamed)
+
+        single, many, streamed = asyncio.run(run())
+    assert single["text"] == "a"
+    assert [result["text"] for result in many] == ["b", "c"]
+    assert streamed["text"] == "d"
+
+
+def test_async_client_behind_a_proxy(monkeypatch):
+    # The mock server stands in for the proxy of an API that does not
+    # resolve, which only requests knows to go through.
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        for name in ["NO_PROXY", "no_proxy", "ALL_PROXY", "all_proxy"]:
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setenv("HTTP_PROXY", server.url)
+        config = {
+            "providers": {
+                "openai": {"api_key": "mock", "api_base": "http://api.invalid/v1"}
+            },
+            "default_provider": "openai",
+        }
+
+        async def run():
+            async with jsonthat.AsyncClient(config=config, cache=False) as client:
+                return await client.transform("a")
+
+        assert asyncio.run(run())["text"] == "a"
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        jsonthat.Missing
@@ -0,0 +1,147 @@
+import argparse
+import io
+import socket
+import sys
+import threading
+
+import pytest
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.daemon import (
+    Daemon,
+    DaemonError,
+    connect,
+    create_server,
+    forward,
+)
+from jsonthat.inputs import read_text
+from jsonthat.main import Config, run_forwarded
+from jsonthat.schema import InvalidOutput
+
+
+@pytest.fixture
+def server():
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        yield server
+
+
+@pytest.fixture
+def daemon(server, tmp_path, monkeypatch):
+    for name in ["LLM_PROVIDER", "LLM_API_KEY", "LLM_MODEL", "LLM_API_BASE"]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    config = Config()
+    config.config = {
+        "providers": {"openai": {"api_key": "mock", "api_base": f"{server.url}/v1"}},
+        "default_provider": "openai",
+    }
+    daemon = Daemon(config, concurrency=4)
+    path = str(tmp_path / "jt.sock")
+    unix_server = create_server(daemon, path)
+    thread = threading.Thread(target=unix_server.serve_forever, daemon=True)
+    thread.start()
+    yield daemon, path
+    unix_server.shutdown()
+    unix_server.server_close()
+    daemon.close()
+
+
+def run(path, texts, **request):
+    records = [(("-", number), text) for number, text in enumerate(texts, start=1)]
+    results = forward(connect(path), {"concurrency": 2, **request}, records)
+    return None if results is None else list(results)
+
+
+def test_clients_share_the_daemon_provider(daemon, server):
+    daemon, path = daemon
+    results = run(path, ["a", "b", "a"], dedupe=True)
+    assert [(key, output["text"]) for key, output in results] == [
+        (("-", 1), "a"),
+        (("-", 2), "b"),
+        (("-", 3), "a"),
+    ]
+    [provider] = daemon.providers.values()
+    session = provider.session
+    assert [output["text"] for _, output in run(path, ["c"])] == ["c"]
+    assert provider.session is session
+    assert (daemon.clients, server.settings.requests) == (2, 3)
+
+
+def test_invalid_outputs_and_errors(daemon):
+    daemon, path = daemon
+    [(_, result)] = run(path, ["a"], schema="name: string", schema_retries=0)
+    assert isinstance(result, InvalidOutput)
+    assert result.errors
+
+    with pytest.raises(DaemonError, match="Unsupported LLM provider"):
+        run(path, ["a"], provider="nope")
+
+
+def test_mismatched_client_falls_back(daemon, monkeypatch):
+    _, path = daemon
+    monkeypatch.setenv("LLM_MODEL", "other")
+    assert run(path, ["a"]) is None
+
+
+def forwarded_args(path, **options):
+    return argparse.Namespace(
+        **{
+            "socket": path,
+            "schema": None,
+            "line": False,
+            "provider": None,
+            "concurrency": None,
+            "unordered": False,
+            "batch_size": 1,
+            "batch_tokens": 4000,
+            "schema_retries": 0,
+            "no_dedupe": False,
+            "no_cache": False,
+            "refresh": False,
+            "output": "jsonl",
+            "line_numbers": False,
+            **options,
+        }
+    )
+
+
+def test_declined_whole_input_is_left_on_stdin(daemon, monkeypatch):
+    _, path = daemon
+    monkeypatch.setenv("LLM_MODEL", "other")
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(b"my name is jay\n")))
+    assert run_forwarded(forwarded_args(path), ["-"], None) is None
+    # The local run still reads the input.
+    assert read_text("-") == "my name is jay"
+
+
+def test_declined_json_output_is_left_to_the_local_run(daemon, monkeypatch, capsys):
+    _, path = daemon
+    monkeypatch.setenv("LLM_MODEL", "other")
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(b"a\nb\n")))
+    args = forwarded_args(path, line=True, output="json")
+    assert run_forwarded(args, ["-"], None) is None
+    # Nothing is written, not even an empty array, before the local run's.
+    assert capsys.readouterr().out == ""
+
+
+def test_edited_config_falls_back(daemon, tmp_path):
+    _, path = daemon
+    config_file = tmp_path / "config" / "jsonthat" / "config.yaml"
+    config_file.parent.mkdir(parents=True)
+    config_file.write_text("default_provider: claude\n")
+    assert run(path, ["a"]) is None
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "jt.sock")
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    assert connect(path) is None
+
+    unix_server = create_server(Daemon(Config()), path)
+    threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+    with pytest.raises(DaemonError, match="already listening"):
+        create_server(Daemon(Config()), path)
+    unix_server.shutdown()
+    unix_server.server_close()
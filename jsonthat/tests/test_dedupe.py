@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from jsonthat.dedupe import RecordCoalescer, normalize_record
+from jsonthat.main import transform_lines
+
+
+class CountingProvider:
+    supports_streaming = False
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def transform_text_to_json(self, text, schema=None, stream=False):
+        with self._lock:
+            self.calls.append(text)
+        time.sleep(self.delay)
+        return {"text": text.strip()}
+
+
+def test_normalize_record():
+    assert normalize_record("  GET  /index.html\t200 ") == "GET /index.html 200"
+
+
+def test_one_request_per_distinct_record():
+    provider = CountingProvider()
+    lines = ["a", "b", " a", "a  ", "c", "b"]
+    results = list(transform_lines(provider, lines, coalescer=RecordCoalescer()))
+    assert [result["text"] for result in results] == ["a", "b", "a", "a", "c", "b"]
+    assert provider.calls == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_concurrent_duplicates_wait_for_the_request_in_flight(ordered):
+    provider = CountingProvider(delay=0.05)
+    coalescer = RecordCoalescer()
+    lines = ["x", "x", "y", "x", "y", "z"]
+    results = list(
+        transform_lines(
+            provider,
+            list(enumerate(lines)),
+            concurrency=4,
+            ordered=ordered,
+            keyed=True,
+            coalescer=coalescer,
+        )
+    )
+    assert sorted(provider.calls) == ["x", "y", "z"]
+    assert sorted(results) == [(i, {"text": line}) for i, line in enumerate(lines)]
+    if ordered:
+        assert [key for key, _ in results] == list(range(len(lines)))
+    assert (coalescer.records, coalescer.duplicates) == (6, 3)
+
+
+def test_failed_request_is_retried_by_later_duplicates():
+    coalescer = RecordCoalescer()
+
+    def fail(texts):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        coalescer.run(["a"], fail)
+    assert coalescer.run(["a", "a"], lambda texts: [t.upper() for t in texts]) == [
+        "A",
+        "A",
+    ]
+
+
+def test_oldest_results_are_dropped():
+    coalescer = RecordCoalescer(max_results=2)
+    calls = []
+
+    def transform(texts):
+        calls.extend(texts)
+        return texts
+
+    for text in ["a", "b", "c", "a"]:
+        coalescer.run([text], transform)
+    assert calls == ["a", "b", "c", "a"]
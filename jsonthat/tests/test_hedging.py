@@ -0,0 +1,108 @@
+import argparse
+import time
+from concurrent.futures import Future
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import OpenAIProvider, parse_hedge_delay
+from jsonthat.wrappers import (
+    DEFAULT_HEDGE_DELAY,
+    MIN_HEDGE_SAMPLES,
+    HedgedProvider,
+    discard_result,
+)
+
+
+class FakeProvider:
+    supports_streaming = False
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.closed = False
+
+    def _prepare_request_data(self, text, schema=None):
+        return {"text": text}
+
+    def cache_key(self, text, schema=None):
+        return f"{self.name}:{text}"
+
+    def transform_text_to_json(self, text, schema=None, stream=False):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"provider": self.name}
+
+    def close(self):
+        self.closed = True
+
+
+def test_fast_primary_is_not_hedged():
+    primary, backup = FakeProvider("a"), FakeProvider("b")
+    provider = HedgedProvider([primary, backup], hedge_delay=0.5)
+    assert provider.transform_text_to_json("x") == {"provider": "a"}
+    assert (primary.calls, backup.calls, provider.hedges) == (1, 0, 0)
+    assert provider.cache_key("x") == "a:x"
+
+
+def test_slow_primary_is_hedged_to_the_backup():
+    primary, backup = FakeProvider("a", delay=0.5), FakeProvider("b")
+    provider = HedgedProvider([primary, backup], hedge_delay=0.02)
+    start = time.perf_counter()
+    assert provider.transform_text_to_json("x") == {"provider": "b"}
+    assert time.perf_counter() - start < 0.4
+    assert (provider.hedges, provider.backup_wins) == (1, 1)
+
+
+def test_losing_stream_is_closed_unread():
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+        future = Future()
+        future.set_result(provider.transform_text_to_json("a", stream=True))
+        discard_result(future)
+        assert future.result().response.raw.closed
+
+
+def test_errors_fail_over_in_order():
+    providers = [
+        FakeProvider("a", error=requests.ConnectionError("down")),
+        FakeProvider("b", error=ValueError("bad json")),
+        FakeProvider("c"),
+    ]
+    provider = HedgedProvider(providers, hedge_delay=10)
+    assert provider.transform_text_to_json("x") == {"provider": "c"}
+    assert provider.failovers == 2
+
+    providers[2].error = RuntimeError("also down")
+    with pytest.raises(RuntimeError):
+        provider.transform_text_to_json("x")
+    provider.close()
+    assert all(member.closed for member in providers)
+
+
+def test_hedge_delay_follows_observed_latency():
+    primary = FakeProvider("a")
+    provider = HedgedProvider([primary, FakeProvider("b")], hedge_percentile=95)
+    assert provider.get_hedge_delay(0) == DEFAULT_HEDGE_DELAY
+
+    provider.latencies[0].extend([0.1] * (MIN_HEDGE_SAMPLES - 1) + [1.0])
+    assert provider.get_hedge_delay(0) == 0.1
+    provider.latencies[0].extend([1.0] * 5)
+    assert provider.get_hedge_delay(0) == 1.0
+
+    # Requests that do answer are timed.
+    provider.transform_text_to_json("x")
+    assert len(provider.latencies[0]) == MIN_HEDGE_SAMPLES + 6
+
+
+def test_parse_hedge_delay():
+    assert parse_hedge_delay("0.5") == (0.5, 95)
+    assert parse_hedge_delay("p99") == (None, 99)
+    for value in ["p0", "-1", "soon"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_hedge_delay(value)
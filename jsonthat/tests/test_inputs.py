@@ -0,0 +1,113 @@
+import gzip
+import io
+import re
+
+import pytest
+
+from jsonthat.inputs import (
+    expand_inputs,
+    iter_records,
+    make_delimiter,
+    open_text,
+    read_text,
+    split_stream,
+)
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / "a.log").write_bytes(b"first\n\n  second  \nthird")
+    (tmp_path / "b.log").write_bytes(b"fourth\n")
+    with gzip.open(tmp_path / "c.log.gz", "wb") as f:
+        f.write(b"fifth\nsixth\n")
+    (tmp_path / "empty.log").write_bytes(b"")
+    return tmp_path
+
+
+def test_expand_inputs(files):
+    assert expand_inputs([str(files / "*.log")]) == [
+        str(files / "a.log"),
+        str(files / "b.log"),
+        str(files / "empty.log"),
+    ]
+    assert expand_inputs(["-"]) == ["-"]
+    with pytest.raises(ValueError):
+        expand_inputs([str(files / "*.csv")])
+
+
+def test_iter_records_from_files(files):
+    paths = expand_inputs([str(files / "*.log"), str(files / "c.log.gz")])
+    assert list(iter_records(paths)) == [
+        "first",
+        "second",
+        "third",
+        "fourth",
+        "fifth",
+        "sixth",
+    ]
+    assert read_text(str(files / "c.log.gz")) == "fifth\nsixth"
+
+
+def test_compressed_input_closes_its_file(files):
+    with open_text(str(files / "c.log.gz")) as f:
+        stream = f.buffer.fileobj
+        assert f.read() == "fifth\nsixth\n"
+    assert stream.closed
+
+
+def zstd_compress(data: bytes) -> bytes:
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return zstd.compress(data)
+    except ImportError:
+        pass
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def test_zstd_input(tmp_path):
+    path = tmp_path / "d.log.zst"
+    path.write_bytes(zstd_compress(b"seventh\neighth\n"))
+    assert list(iter_records([str(path)])) == ["seventh", "eighth"]
+
+
+def test_nul_and_regex_delimiters(tmp_path):
+    path = tmp_path / "records"
+    path.write_bytes(b"one\ntwo\0three\0")
+    assert list(iter_records([str(path)], make_delimiter(null=True))) == [
+        "one\ntwo",
+        "three",
+    ]
+
+    path.write_bytes(b"a\n---\nb\n---\n\nc")
+    assert list(iter_records([str(path)], make_delimiter(pattern=r"\n-{3,}\n"))) == [
+        "a",
+        "b",
+        "c",
+    ]
+    with pytest.raises(ValueError):
+        make_delimiter(pattern="(")
+
+
+class SlowStream(io.RawIOBase):
+    # Returns the data a few bytes at a time, like a pipe.
+    def __init__(self, data: bytes, size: int):
+        self.data = data
+        self.size = size
+
+    def read1(self, size: int = -1) -> bytes:
+        chunk, self.data = self.data[: self.size], self.data[self.size :]
+        return chunk
+
+
+@pytest.mark.parametrize("delimiter", [b"\n", re.compile(rb"\n+")])
+def test_split_stream_across_reads(delimiter):
+    data = b"alpha\nbeta\n\ngamma delta\nepsilon"
+    for size in (1, 3, 7, 100):
+        records = [
+            record
+            for record in split_stream(SlowStream(data, size), delimiter)
+            if record
+        ]
+        assert records == ["alpha", "beta", "gamma delta", "epsilon"], size
@@ -0,0 +1,100 @@
+import io
+import os
+import json
+
+import pytest
+
+from jsonthat.journal import CheckpointJournal
+from jsonthat.writer import OutputWriter
+
+
+def records(count: int):
+    return [(("-", number), f"record {number}") for number in range(1, count + 1)]
+
+
+def test_resume_skips_completed_records(tmp_path):
+    path = str(tmp_path / "job.ckpt")
+    journal = CheckpointJournal(path, ["-"])
+    # Completed out of order, as with --unordered and several workers.
+    for key in [("-", 3), ("-", 1)]:
+        journal.record(key, {"n": key[1]})
+    journal.close()
+
+    with pytest.raises(ValueError, match="--resume"):
+        CheckpointJournal(path, ["-"])
+    with pytest.raises(ValueError, match="other inputs"):
+        CheckpointJournal(path, ["other.txt"], resume=True)
+    with pytest.raises(ValueError, match="other inputs"):
+        CheckpointJournal(path, ["-"], schema="name: string", resume=True)
+
+    journal = CheckpointJournal(path, ["-"], resume=True)
+    pending = list(journal.pending_records(records(4)))
+    assert [key for key, _ in pending] == [("-", 2), ("-", 4)]
+    assert journal.skipped == 2
+    journal.record(("-", 2), {"n": 2})
+    journal.close()
+
+    journal = CheckpointJournal(path, ["-"], resume=True)
+    assert journal.completed == {("-", 1), ("-", 2), ("-", 3)}
+    journal.close()
+
+
+def test_entry_cut_short_by_a_crash_is_dropped(tmp_path):
+    path = tmp_path / "job.ckpt"
+    journal = CheckpointJournal(str(path), ["-"])
+    journal.record(("-", 1), {"n": 1})
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b'{"input":"-","record":2,"outp')
+
+    journal = CheckpointJournal(str(path), ["-"], resume=True)
+    assert journal.completed == {("-", 1)}
+    journal.record(("-", 2), {"n": 2})
+    journal.close()
+    lines = path.read_bytes().splitlines()
+    assert [json.loads(line).get("record") for line in lines] == [None, 1, 2]
+
+
+def test_entries_follow_flushed_output(tmp_path):
+    path = tmp_path / "job.ckpt"
+    journal = CheckpointJournal(str(path), ["-"])
+    stream = io.StringIO()
+    writer = OutputWriter(stream, "jsonl", flush_interval=60, on_flush=journal.flush)
+
+    writer.write({"n": 1}, ("-", 1))
+    journal.record(("-", 1), {"n": 1})
+    assert stream.getvalue() == ""
+    assert len(path.read_bytes().splitlines()) == 1
+
+    writer.flush()
+    assert stream.getvalue() == '{"n":1}\n'
+    assert len(path.read_bytes().splitlines()) == 2
+    writer.close()
+    journal.close()
+
+
+def test_output_file_is_fsynced_before_entries(tmp_path, monkeypatch):
+    path = tmp_path / "job.ckpt"
+    synced = []
+    with open(tmp_path / "out.jsonl", "w") as out:
+        journal = CheckpointJournal(str(path), ["-"], output=out)
+        monkeypatch.setattr(
+            "jsonthat.journal.os.fsync",
+            lambda fd: synced.append((fd, len(path.read_bytes().splitlines()))),
+        )
+        writer = OutputWriter(out, "jsonl", flush_interval=60, on_flush=journal.flush)
+        writer.write({"n": 1}, ("-", 1))
+        journal.record(("-", 1), {"n": 1})
+        writer.flush()
+        # The output was synced while the journal still held only its header.
+        assert synced == [(out.fileno(), 1)]
+        writer.close()
+        journal.close()
+
+    r, w = os.pipe()
+    with open(w, "w") as pipe:
+        journal = CheckpointJournal(str(tmp_path / "pipe.ckpt"), ["-"], output=pipe)
+        journal.record(("-", 1), {"n": 1})
+        journal.flush()
+        journal.close()
+    os.close(r)
@@ -8,9 +8,17 @@ from jsonthat.main import (
     Config,
     get_provider,
     read_schema_file,
+    transform_lines,
+    pack_batches,
+    main,
 )
+from jsonthat.prompts import split_batch_result
+from jsonthat.wrappers import LoadBalancedProvider
 import os
 import json
+import subprocess
+import sys
+import time
 import yaml
 
 
@@ -28,7 +36,8 @@ def mock_config():
 
 
 @pytest.fixture
-def config(mock_config, tmp_path):
+def config(mock_config, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
     config_file = tmp_path / "config.yaml"
     with open(config_file, "w") as f:
         yaml.dump(mock_config, f)
@@ -41,7 +50,7 @@ def config(mock_config, tmp_path):
 
 def test_openai_provider():
     provider = OpenAIProvider("test_key")
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "choices": [{"message": {"content": '{"key": "value"}'}}]
         }
@@ -51,7 +60,7 @@ def test_openai_provider():
 
 def test_mistral_provider():
     provider = MistralProvider("test_key")
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "choices": [{"message": {"content": '{"key": "value"}'}}]
         }
@@ -61,7 +70,7 @@ def test_mistral_provider():
 
 def test_claude_provider():
     provider = ClaudeProvider("test_key")
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "content": [{"text": '{"key": "value"}'}]
         }
@@ -71,7 +80,7 @@ def test_claude_provider():
 
 def test_ollama_provider():
     provider = OllamaProvider("http://test.api", "test_model")
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {"response": '{"key": "value"}'}
         result = provider.transform_text_to_json("test text")
         assert result == {"key": "value"}
@@ -81,6 +90,74 @@ def test_config_load(config, mock_config):
     assert config.config == mock_config
 
 
+def test_config_snapshot(config, mock_config):
+    assert os.path.exists(config.get_snapshot_path())
+    # It holds the API keys.
+    assert os.stat(config.get_snapshot_path()).st_mode & 0o777 == 0o600
+
+    with patch("yaml.safe_load") as safe_load:
+        assert config.load_config() == mock_config
+    safe_load.assert_not_called()
+
+    with open(config.config_file, "w") as f:
+        yaml.dump({"providers": {}, "default_provider": "claude"}, f)
+    assert config.load_config()["default_provider"] == "claude"
+
+
+def test_import_does_not_load_heavy_modules():
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, jsonthat.main; print('requests' in sys.modules, 'yaml' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    assert output.strip() == "False False"
+
+
+def usage_error(argv, capsys) -> str:
+    # Runs jt in-process with arguments it rejects, and returns its message.
+    with patch.object(sys, "argv", ["jt", *argv]), pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 2
+    return capsys.readouterr().err
+
+
+def test_partial_json_output_is_rejected(capsys):
+    error = usage_error(["--partial", "patch", "--output", "json"], capsys)
+    assert "--partial cannot be used with --output json" in error
+
+
+@pytest.mark.parametrize(
+    "argv, message",
+    [
+        (
+            ["--line", "--stream", "--checkpoint", "job.ckpt"],
+            "--checkpoint cannot be used with --stream or --partial",
+        ),
+        (
+            ["--line", "--partial", "patch", "--checkpoint", "job.ckpt"],
+            "--checkpoint cannot be used with --stream or --partial",
+        ),
+        (
+            ["--line", "--output", "json", "--checkpoint", "job.ckpt", "--resume"],
+            "--resume cannot be used with --output json",
+        ),
+    ],
+)
+def test_checkpoint_conflicts_are_rejected(argv, message, capsys):
+    assert message in usage_error(argv, capsys)
+
+
+@pytest.mark.parametrize("overlap", ["-1", "100"])
+def test_invalid_chunk_overlap_is_rejected(overlap, capsys):
+    argv = ["--long", "--chunk-tokens", "100", f"--chunk-overlap={overlap}"]
+    assert "--chunk-overlap must be at least 0" in usage_error(argv, capsys)
+
+
 def test_config_save(config, tmp_path):
     new_config = {
         "providers": {"newprovider": {"api_key": "new_key"}},
@@ -102,6 +179,26 @@ def test_get_provider(config):
         assert provider.api_key == "test_env_key"
 
 
+def test_get_provider_pool_size(config):
+    provider = get_provider(config, "openai", pool_size=32)
+    adapter = provider.session.get_adapter("https://api.openai.com")
+    assert adapter._pool_maxsize == 32
+    provider.close()
+
+
+def test_provider_reuses_session():
+    provider = OpenAIProvider("test_key")
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.return_value = {
+            "choices": [{"message": {"content": '{"key": "value"}'}}]
+        }
+        with provider:
+            provider.transform_text_to_json("first")
+            provider.transform_text_to_json("second")
+    assert mock_post.call_count == 2
+    assert provider.session is not None
+
+
 def test_get_provider_default(config):
     provider = get_provider(config)
     assert isinstance(provider, OpenAIProvider)
@@ -130,7 +227,7 @@ def test_openai_provider_json_generation():
     test_input = "My name is Alice and I'm 30 years old"
     expected_output = {"name": "Alice", "age": 30}
 
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "choices": [{"message": {"content": json.dumps(expected_output)}}]
         }
@@ -148,7 +245,7 @@ def test_mistral_provider_json_generation():
     test_input = "My name is Alice and I'm 30 years old"
     expected_output = {"name": "Alice", "age": 30}
 
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "choices": [{"message": {"content": json.dumps(expected_output)}}]
         }
@@ -166,7 +263,7 @@ def test_claude_provider_json_generation():
     test_input = "The capital of France is Paris"
     expected_output = {"country": "France", "capital": "Paris"}
 
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "content": [{"text": json.dumps(expected_output)}]
         }
@@ -184,7 +281,7 @@ def test_ollama_provider_json_generation():
     test_input = "The color of the sky is blue"
     expected_output = {"object": "sky", "property": "color", "value": "blue"}
 
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "response": json.dumps(expected_output)
         }
@@ -214,7 +311,7 @@ def test_json_generation_with_schema():
         "yearsOfExperience": 5,
     }
 
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.return_value.json.return_value = {
             "choices": [{"message": {"content": json.dumps(expected_output)}}]
         }
@@ -226,6 +323,10 @@ def test_json_generation_with_schema():
         assert "json" in called_args["messages"][0]["content"].lower()
         assert "schema" in called_args["messages"][0]["content"].lower()
         assert test_schema in called_args["messages"][0]["content"]
+        # Not strict: none of the properties is required.
+        response_format = called_args["response_format"]
+        assert response_format["type"] == "json_schema"
+        assert response_format["json_schema"]["strict"] is False
 
 
 def test_config_display_file_exists(capsys, config):
@@ -256,3 +357,98 @@ def test_config_display_empty_config(capsys, config):
     assert f"Config file path: {config.config_file}" in captured.out
     assert "Configuration is empty" in captured.out
     assert "Run 'jt --setup' to configure the tool" in captured.out
+
+
+class EchoProvider:
+    supports_streaming = False
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+
+    def transform_text_to_json(self, text, schema=None, stream=False):
+        time.sleep(self.delays.get(text, 0))
+        return {"text": text}
+
+
+def test_transform_lines_sequential():
+    results = list(transform_lines(EchoProvider(), ["a", "b", "c"]))
+    assert results == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+
+
+def test_transform_lines_concurrent_keeps_order():
+    provider = EchoProvider({"a": 0.05, "b": 0.01})
+    lines = ["a", "b", "c", "d", "e"]
+    results = list(transform_lines(provider, lines, concurrency=3))
+    assert results == [{"text": line} for line in lines]
+
+
+def test_transform_lines_unordered():
+    provider = EchoProvider({"a": 0.1})
+    lines = ["a", "b", "c"]
+    results = list(transform_lines(provider, lines, concurrency=3, ordered=False))
+    assert sorted(r["text"] for r in results) == lines
+    assert results[-1] == {"text": "a"}
+
+
+def test_pack_batches():
+    lines = ["a" * 40, "b", "c", "d" * 40, "e"]
+    batches = list(pack_batches(lines, max_records=2, max_tokens=12))
+    assert batches == [["a" * 40, "b"], ["c", "d" * 40], ["e"]]
+
+
+def test_split_batch_result_aligns_by_index():
+    result = {
+        "results": [
+            {"index": 2, "output": {"v": "c"}},
+            {"index": 0, "output": {"v": "a"}},
+            {"index": 0, "output": {"v": "dup"}},
+        ]
+    }
+    assert split_batch_result(result, 3) == [{"v": "a"}, None, {"v": "c"}]
+
+
+def test_transform_lines_batch_reruns_missing_records():
+    provider = OpenAIProvider("test_key")
+    batch_response = {
+        "results": [
+            {"index": 0, "output": {"text": "a"}},
+            {"index": 2, "output": {"text": "c"}},
+        ]
+    }
+    responses = [batch_response, {"text": "b"}]
+
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.json.side_effect = lambda: {
+            "choices": [{"message": {"content": json.dumps(responses.pop(0))}}]
+        }
+        results = list(transform_lines(provider, ["a", "b", "c"], batch_size=3))
+
+    assert results == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+    assert mock_post.call_count == 2
+    retry_prompt = mock_post.call_args[1]["json"]["messages"][1]["content"]
+    assert retry_prompt.endswith(": b")
+
+
+def test_get_provider_pools(config, mock_config):
+    mock_config["providers"]["ollama"] = {
+        "api_urls": [
+            "http://gpu-1:11434",
+            {"api_url": "http://gpu-2:11434", "weight": 2},
+        ],
+        "balance": "round-robin",
+    }
+    mock_config["providers"]["openai"] = {"api_keys": ["key-1", "key-2"]}
+    config.config = mock_config
+
+    provider = get_provider(config, "ollama")
+    assert isinstance(provider, LoadBalancedProvider)
+    assert [member.api_url for member in provider.members] == [
+        "http://gpu-1:11434",
+        "http://gpu-2:11434",
+    ]
+    assert (provider.weights, provider.balance) == ([1.0, 2.0], "round-robin")
+
+    provider = get_provider(config, "openai")
+    assert [member.api_key for member in provider.members] == ["key-1", "key-2"]
+    with patch.dict(os.environ, {"LLM_API_KEY": "test_env_key"}):
+        assert isinstance(get_provider(config, "openai"), OpenAIProvider)
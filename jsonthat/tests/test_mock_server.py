@@ -0,0 +1,109 @@
+import json
+
+import pytest
+import requests
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import (
+    ClaudeProvider,
+    MistralProvider,
+    OllamaProvider,
+    OpenAIProvider,
+    transform_lines,
+)
+from jsonthat.usage import UsageTracker
+
+
+@pytest.fixture
+def server():
+    with MockLLMServer(MockSettings(latency=0, token_rate=0)) as server:
+        yield server
+
+
+def make_providers(url):
+    return [
+        OpenAIProvider("mock", api_base=f"{url}/v1"),
+        MistralProvider("mock", api_base=f"{url}/v1"),
+        ClaudeProvider("mock", api_base=f"{url}/v1"),
+        OllamaProvider(url, "mock"),
+    ]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_providers_against_mock_server(server, stream):
+    for provider in make_providers(server.url):
+        provider.usage_tracker = UsageTracker()
+        with provider:
+            result = provider.transform_text_to_json("user1 logged in", stream=stream)
+            if stream:
+                result = json.loads("".join(result))
+        assert result["text"] == "user1 logged in", provider.name
+        usage = provider.usage_tracker.requests[0]
+        assert usage.prompt_tokens > 0 and usage.completion_tokens > 0, provider.name
+
+
+def test_mock_server_batch_lines(server):
+    provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+    lines = [f"line {i}" for i in range(5)]
+    results = list(transform_lines(provider, lines, batch_size=5))
+    assert [result["text"] for result in results] == lines
+    assert server.settings.requests == 1
+
+
+def test_mock_server_error_injection():
+    settings = MockSettings(latency=0, token_rate=0, error_rate=1.0, seed=1)
+    with MockLLMServer(settings) as server:
+        provider = OllamaProvider(server.url, "mock")
+        with pytest.raises(requests.HTTPError):
+            provider.transform_text_to_json("text")
+    assert settings.errors == 1
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_static_prefix_is_cached(server, stream):
+    schema = '{"type":"object","properties":{"text":{"type":"string"}}}'
+    for provider in make_providers(server.url)[:3]:
+        first = provider._prepare_request_data("line 1", schema)
+        second = provider._prepare_request_data("line 2", schema)
+        first_text, second_text = json.dumps(first), json.dumps(second)
+        prefix = first_text[: first_text.index("line 1")]
+        assert second_text.startswith(prefix), provider.name
+        assert json.dumps(schema)[1:-1] in prefix, provider.name
+
+        provider.usage_tracker = UsageTracker()
+        with provider:
+            for text in ["line 1", "line 2"]:
+                result = provider.transform_text_to_json(text, schema, stream=stream)
+                if stream:
+                    "".join(result)
+        first_usage, second_usage = provider.usage_tracker.requests[-2:]
+        assert second_usage.cached_tokens > 0, provider.name
+        server.settings.prefixes.clear()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_structured_outputs(stream):
+    # Only the answers to requests without a schema constraint are malformed.
+    settings = MockSettings(latency=0, token_rate=0, malformed_rate=1.0)
+    with MockLLMServer(settings) as server:
+        for provider in make_providers(server.url):
+            with provider:
+                result = provider.transform_text_to_json(
+                    "user1 logged in", "text: string", stream=stream
+                )
+                if stream:
+                    result = json.loads("".join(result))
+            assert result["text"] == "user1 logged in", provider.name
+
+
+def test_structured_outputs_fall_back_to_the_prompt():
+    settings = MockSettings(latency=0, token_rate=0, structured_outputs=False)
+    with MockLLMServer(settings) as server:
+        for provider in make_providers(server.url):
+            with provider:
+                for text in ["a", "b"]:
+                    result = provider.transform_text_to_json(text, "text: string")
+                    assert result["text"] == text, provider.name
+            assert not provider.structured_outputs
+    # One rejected request per provider, the later ones go without the schema.
+    assert (settings.rejected, settings.requests) == (4, 12)
@@ -0,0 +1,118 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import (
+    MAX_CONTEXT,
+    MIN_CONTEXT,
+    Config,
+    OllamaProvider,
+    build_provider,
+    get_default_concurrency,
+    get_provider,
+    parse_keep_alive,
+    parse_num_ctx,
+)
+from jsonthat.wrappers import LoadBalancedProvider
+
+
+@pytest.fixture
+def config(monkeypatch):
+    for name in ["LLM_PROVIDER", "OLLAMA_API_URL", "OLLAMA_NUM_PARALLEL"]:
+        monkeypatch.delenv(name, raising=False)
+    config = Config()
+    config.config = {
+        "providers": {
+            "ollama": {"api_url": "http://gpu-1:11434", "keep_alive": "10m"},
+            "openai": {"api_key": "key"},
+        },
+        "default_provider": "ollama",
+    }
+    return config
+
+
+def test_request_data():
+    provider = OllamaProvider(keep_alive="1h", num_ctx=8192, num_predict=256)
+    data = provider._request_data("text", "name: string", False, structured=True)
+    assert data["keep_alive"] == "1h"
+    assert data["options"] == {"temperature": 0, "num_predict": 256, "num_ctx": 8192}
+    assert data["format"]["properties"] == {"name": {"type": "string"}}
+    # Server settings do not change the cache key.
+    assert provider._prepare_request_data("text") == OllamaProvider(
+        num_predict=256
+    )._prepare_request_data("text")
+
+    data = OllamaProvider()._request_data("text", None, stream=False)
+    assert data["format"] == "json"
+    assert "keep_alive" not in data and "num_ctx" not in data["options"]
+
+
+def test_context_only_grows():
+    provider = OllamaProvider(num_ctx="auto")
+    provider._request_data("short", None, stream=False)
+    assert provider.context_size == MIN_CONTEXT
+    data = provider._request_data("word " * 5000, None, stream=False)
+    assert data["options"]["num_ctx"] == provider.context_size == 8192
+    data = provider._request_data("short", None, stream=False)
+    assert data["options"]["num_ctx"] == 8192
+    provider._request_data("word " * 10**6, None, stream=False)
+    assert provider.context_size == MAX_CONTEXT
+
+
+def test_context_grows_once_across_threads():
+    provider = OllamaProvider(num_ctx="auto")
+    prompts = ["word " * 5000, "word " * 2000] * 50
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(provider._fit_context, prompts))
+    assert provider.context_size == 8192
+
+
+def test_options_from_config_and_command_line(config):
+    provider = get_provider(config, "ollama", options={"num_ctx": "auto"})
+    assert (provider.keep_alive, provider.num_ctx) == ("10m", "auto")
+    provider = get_provider(config, "ollama", options={"keep_alive": -1})
+    assert provider.keep_alive == -1
+
+    config.config["providers"]["ollama"]["api_urls"] = ["http://a", "http://b"]
+    provider = get_provider(config, "ollama", options={"num_predict": 64})
+    assert isinstance(provider, LoadBalancedProvider)
+    assert [member.num_predict for member in provider.members] == [64, 64]
+
+
+def test_default_concurrency(config, monkeypatch):
+    assert get_default_concurrency(config, None) == 1
+    assert get_default_concurrency(config, "openai") == 1
+    monkeypatch.setenv("OLLAMA_NUM_PARALLEL", "4")
+    assert get_default_concurrency(config, "ollama,openai") == 4
+    assert get_default_concurrency(config, "openai,ollama") == 1
+    config.config["providers"]["ollama"]["api_urls"] = ["http://a", "http://b"]
+    config.config["providers"]["ollama"]["num_parallel"] = 2
+    assert get_default_concurrency(config, None) == 4
+    for value in ["four", "-1", "2.5"]:
+        config.config["providers"]["ollama"]["num_parallel"] = value
+        with pytest.raises(ValueError, match="num_parallel"):
+            get_default_concurrency(config, None)
+
+
+def test_parse_options():
+    assert parse_keep_alive("10m") == "10m"
+    assert parse_keep_alive("-1") == -1.0
+    assert parse_num_ctx("auto") == "auto"
+    assert parse_num_ctx("4096") == 4096
+    for value in ["0", "big"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_num_ctx(value)
+
+
+def test_preload_and_keep_alive(config):
+    settings = MockSettings(latency=0, token_rate=0, load_time=0.05, keep_alive=0)
+    with MockLLMServer(settings) as server:
+        config.config["providers"]["ollama"]["api_url"] = server.url
+        provider, _ = build_provider(config, "ollama", options={"preload": True})
+        # The model is loading before the first record and stays loaded.
+        for text in ["a", "b"]:
+            assert provider.transform_text_to_json(text)["text"] == text
+        provider.close()
+    assert settings.loads == 1
@@ -0,0 +1,63 @@
+import json
+
+from jsonthat.partial import IncrementalJSONParser
+
+
+def apply_patch(document, event):
+    parts = [
+        part.replace("~1", "/").replace("~0", "~")
+        for part in event["path"].split("/")[1:]
+    ]
+    if not parts:
+        return event["value"]
+    target = document
+    for part in parts[:-1]:
+        target = target[int(part) if isinstance(target, list) else part]
+    if isinstance(target, list):
+        target.insert(int(parts[-1]), event["value"])
+    else:
+        target[parts[-1]] = event["value"]
+    return document
+
+
+def feed_in_fragments(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events += parser.feed(text[start : start + size])
+    return events + parser.close()
+
+
+def test_parser_emits_values_as_they_complete():
+    parser = IncrementalJSONParser()
+    events = parser.feed('{"name": "Jay", "age": 3')
+    assert events == [
+        {"op": "add", "path": "", "value": {}},
+        {"op": "add", "path": "/name", "value": "Jay"},
+    ]
+    assert parser.value == {"name": "Jay"}
+
+    events = parser.feed('0, "tags": ["a"')
+    assert [event["path"] for event in events] == ["/age", "/tags", "/tags/0"]
+    assert parser.value == {"name": "Jay", "age": 30, "tags": ["a"]}
+    assert not parser.done
+
+    parser.feed("]}")
+    assert parser.done
+
+
+def test_parser_events_rebuild_document():
+    document = {
+        "name": 'Jay "J"',
+        "items": [1, 2.5e3, True, None, {"a/b": ["x\\ny", -4]}],
+        "empty": {},
+        "unicode": "café",
+    }
+    text = "```json\n" + json.dumps(document, indent=2) + "\n```"
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalJSONParser()
+        rebuilt = None
+        for event in feed_in_fragments(parser, text, size):
+            rebuilt = apply_patch(rebuilt, event)
+        assert rebuilt == document
+        assert parser.value == document
+        assert parser.done
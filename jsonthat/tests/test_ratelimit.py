@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+import requests
+from unittest.mock import MagicMock
+
+from benchmarks.mock_server import MockLLMServer, MockSettings
+from jsonthat.main import OpenAIProvider, transform_lines
+from jsonthat.ratelimit import (
+    AdaptiveConcurrency,
+    RateLimiter,
+    TokenBucket,
+    parse_duration,
+    parse_rate_limit_headers,
+    parse_retry_after,
+)
+
+
+def make_response(status_code, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    return response
+
+
+def test_parse_duration():
+    assert parse_duration("2") == 2.0
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1h2m3.5s") == 3723.5
+    assert parse_duration("2000-01-01T00:00:00Z") == 0.0
+    assert parse_duration("Sat, 01 Jan 2000 00:00:00 GMT") == 0.0
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+def test_parse_headers():
+    headers = requests.structures.CaseInsensitiveDict(
+        {
+            "X-RateLimit-Limit-Requests": "60",
+            "X-RateLimit-Remaining-Requests": "59",
+            "X-RateLimit-Reset-Requests": "1s",
+            "anthropic-ratelimit-input-tokens-limit": "1000",
+            "anthropic-ratelimit-input-tokens-remaining": "400",
+            "Retry-After-Ms": "250",
+        }
+    )
+    limits = parse_rate_limit_headers(headers)
+    assert limits["requests"] == (60.0, 59.0, 1.0)
+    assert limits["tokens"] == (1000.0, 400.0, 0.0)
+    assert parse_retry_after(headers) == 0.25
+
+
+def test_token_bucket_paces_requests():
+    delays = []
+    bucket = TokenBucket()
+    bucket.acquire(1, delays.append)
+    assert delays == []
+
+    # Nothing left, the bucket refills to 10 requests over 10 seconds.
+    bucket.update(10, 0, 10)
+    bucket.acquire(1, lambda delay: (delays.append(delay), bucket.update(10, 1, 9)))
+    assert delays[0] == pytest.approx(1.0, abs=0.01)
+
+
+def test_adaptive_concurrency_halves_once_per_burst():
+    concurrency = AdaptiveConcurrency(8)
+    started = [concurrency.acquire() for _ in range(4)]
+    for start in started:
+        concurrency.release(start, throttled=True)
+    assert concurrency.limit == 4
+
+    concurrency.release(concurrency.acquire(), throttled=True)
+    assert concurrency.limit == 2
+
+    # Additive increase: about one more slot per round of successful requests.
+    for _ in range(4):
+        concurrency.release(concurrency.acquire())
+    assert int(concurrency.limit) == 3
+
+
+def test_adaptive_concurrency_wakes_async_waiters():
+    concurrency = AdaptiveConcurrency(1)
+    active = []
+
+    async def hold():
+        started = await concurrency.acquire_async()
+        active.append(concurrency.active)
+        await asyncio.sleep(0)
+        concurrency.release(started)
+
+    async def run():
+        held = concurrency.acquire()
+        cancelled = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        tasks = [asyncio.ensure_future(hold()) for _ in range(100)]
+        await asyncio.sleep(0)
+        # A waiter cancelled once woken passes its slot on.
+        concurrency.release(held)
+        cancelled.cancel()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+        # Released from another thread, as by a blocking request.
+        held = concurrency.acquire()
+        task = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        await asyncio.to_thread(concurrency.release, held)
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(run())
+    assert len(active) == 101 and max(active) == 1
+    assert (concurrency.active, len(concurrency._waiters)) == (0, 0)
+
+
+def test_rate_limiter_retries_throttled_requests():
+    delays = []
+    limiter = RateLimiter(4, max_retries=3, seed=0, sleep=delays.append)
+    responses = [
+        make_response(429, {"retry-after": "0.01"}),
+        make_response(503),
+        make_response(200),
+    ]
+    response = limiter.call(lambda: responses.pop(0))
+
+    assert response.status_code == 200
+    assert limiter.retries == 2
+    assert limiter.throttled == 1
+    assert delays[0] >= 0.01
+    assert limiter.concurrency.limit < 4
+
+
+def test_rate_limiter_gives_up():
+    limiter = RateLimiter(max_retries=2, sleep=lambda delay: None)
+    assert limiter.call(lambda: make_response(500)).status_code == 500
+    assert limiter.call(lambda: make_response(400)).status_code == 400
+    assert limiter.retries == 2
+
+    def fail():
+        raise requests.ConnectionError("refused")
+
+    with pytest.raises(requests.ConnectionError):
+        limiter.call(fail)
+    assert limiter.retries == 4
+
+
+def test_line_mode_survives_injected_errors():
+    settings = MockSettings(latency=0, token_rate=0, error_rate=0.3, seed=1)
+    with MockLLMServer(settings) as server:
+        provider = OpenAIProvider("mock", api_base=f"{server.url}/v1")
+        provider.rate_limiter = RateLimiter(4, max_retries=10, backoff=0.001)
+        lines = [f"line {i}" for i in range(20)]
+        results = list(transform_lines(provider, lines, concurrency=4))
+        provider.close()
+
+    assert [result["text"] for result in results] == lines
+    assert settings.errors > 0
+    assert provider.rate_limiter.retries == settings.errors
+
+
+def test_rate_limiter_call_async():
+    limiter = RateLimiter(4, max_retries=3, backoff=0.001)
+    responses = [make_response(503), make_response(200)]
+
+    async def send():
+        return responses.pop(0)
+
+    response = asyncio.run(limiter.call_async(send))
+    assert response.status_code == 200
+    assert limiter.retries == 1
+    assert limiter.concurrency.active == 0
@@ -0,0 +1,212 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from jsonthat.aio import transform_lines_async
+from jsonthat.main import transform_lines
+from jsonthat.prompts import build_response_format
+from jsonthat.schema import CompiledSchema, InvalidOutput, to_strict_schema
+
+
+SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 1},
+        "age": {"type": "integer", "minimum": 0},
+        "tags": {"type": "array", "items": {"$ref": "#/definitions/tag"}},
+        "status": {"enum": ["active", "inactive"]},
+    },
+    "required": ["name", "age"],
+    "additionalProperties": False,
+    "definitions": {"tag": {"type": "string", "pattern": "^[a-z]+$"}},
+}
+
+
+def test_json_schema_rendering_is_compact():
+    schema = CompiledSchema.parse(json.dumps(SCHEMA, indent=4))
+    assert "$schema" not in str(schema)
+    assert " " not in str(schema)
+    assert json.loads(str(schema))["required"] == ["name", "age"]
+
+
+def test_json_schema_validation():
+    schema = CompiledSchema.parse(json.dumps(SCHEMA))
+    assert schema.validate({"name": "Jay", "age": 30, "tags": ["a"]}) == []
+    assert schema.validate({"name": "Jay", "age": 30.0}) == []
+    assert schema.validate({"name": "", "age": -1, "tags": ["A"], "x": 1}) == [
+        "/name: expected length >= 1",
+        "/age: expected at least 0",
+        "/tags/0: does not match '^[a-z]+$'",
+        "/: unexpected property 'x'",
+    ]
+    assert schema.validate({"age": True, "status": "gone"}) == [
+        "/: missing required property 'name'",
+        "/age: expected integer, got boolean",
+        '/status: "gone" is not one of ["active", "inactive"]',
+    ]
+    assert schema.validate([]) == ["/: expected object, got array"]
+
+
+def test_metadata_named_fields_are_kept():
+    schema = {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "properties": {
+            "examples": {"type": "array", "examples": [["a"]]},
+            "name": {"type": "string", "deprecated": False},
+        },
+        "required": ["examples", "name"],
+        "$defs": {"readOnly": {"type": "boolean"}},
+    }
+    compiled = CompiledSchema.parse(json.dumps(schema))
+    assert compiled.schema == {
+        "type": "object",
+        "properties": {"examples": {"type": "array"}, "name": {"type": "string"}},
+        "required": ["examples", "name"],
+        "$defs": {"readOnly": {"type": "boolean"}},
+    }
+    assert compiled.validate({"name": "Jay"}) == [
+        "/: missing required property 'examples'"
+    ]
+
+
+def test_plain_schema():
+    schema = CompiledSchema.parse(
+        "# a person\nname: string\nage: int\ntags: string[]\n"
+        "address:\n  city: string\nnote: anything useful\n"
+    )
+    assert str(schema).startswith("name: string\n")
+    assert schema.schema["required"] == ["name", "age", "tags", "address"]
+    assert (
+        schema.validate(
+            {"name": "Jay", "age": 3, "tags": ["x"], "address": {"city": "Paris"}}
+        )
+        == []
+    )
+    assert schema.validate({"name": "Jay", "age": "3", "tags": [1], "address": {}}) == [
+        "/age: expected integer, got string",
+        "/tags/0: expected string, got integer",
+        "/address: missing required property 'city'",
+    ]
+
+
+def test_free_text_schema_is_not_validated():
+    schema = CompiledSchema.parse("Extract the people mentioned in the text")
+    assert schema.schema is None
+    assert str(schema) == "Extract the people mentioned in the text"
+    assert schema.validate(["anything"]) == []
+
+
+def test_strict_schema():
+    strict = to_strict_schema("name: string\naddress:\n  city: string\n")
+    assert strict["additionalProperties"] is False
+    assert strict["properties"]["address"]["additionalProperties"] is False
+    assert strict["required"] == ["name", "address"]
+
+    # Optional properties, free-form values and combinators are not strict.
+    assert to_strict_schema(json.dumps(SCHEMA)) is None
+    assert to_strict_schema("name: string\nnote: anything useful") is None
+    assert to_strict_schema('{"type": "object", "properties": {}}') is None
+    schema = {"type": "object", "properties": {"a": {"oneOf": []}}, "required": ["a"]}
+    assert to_strict_schema(json.dumps(schema)) is None
+    assert to_strict_schema("Extract the people mentioned in the text") is None
+
+
+def test_response_format_keeps_metadata_named_fields():
+    schema = {
+        "type": "object",
+        "properties": {"examples": {"type": "string"}, "name": {"type": "string"}},
+        "required": ["examples", "name"],
+    }
+    response_format = build_response_format(json.dumps(schema))["json_schema"]
+    assert response_format["strict"] is True
+    assert list(response_format["schema"]["properties"]) == ["examples", "name"]
+
+
+def test_transform_lines_retries_invalid_records():
+    schema = CompiledSchema.parse("name: string\nage: integer")
+    provider = MagicMock()
+    provider.uncached = provider
+    provider.transform_text_to_json.side_effect = [
+        {"name": "Jay", "age": 30},
+        {"name": "Bob"},
+        {"name": "Bob", "age": 40},
+        {"name": "Ann", "age": "old"},
+        {"name": "Ann", "age": "old"},
+    ]
+
+    results = list(
+        transform_lines(
+            provider,
+            ["Jay 30", "Bob 40", "Ann"],
+            str(schema),
+            validator=schema,
+            retries=1,
+        )
+    )
+
+    assert results[:2] == [{"name": "Jay", "age": 30}, {"name": "Bob", "age": 40}]
+    assert isinstance(results[2], InvalidOutput)
+    assert results[2].errors == ["/age: expected integer, got string"]
+    retry_prompt = provider.transform_text_to_json.call_args_list[2].args[0]
+    assert retry_prompt.startswith("Bob 40\n")
+    assert "missing required property 'age'" in retry_prompt
+
+
+def malformed_answers():
+    def malformed(doc: str):
+        try:
+            json.loads(doc)
+        except json.JSONDecodeError as error:
+            return error
+
+    return [
+        {"name": "Jay", "age": 30},
+        malformed('{"name": "Bob", "age"'),
+        {"name": "Bob", "age": 40},
+        malformed("Ann is old"),
+        malformed("Ann is old"),
+        {"name": "Eve", "age": 20},
+    ]
+
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_transform_lines_retries_malformed_records(engine):
+    schema = CompiledSchema.parse("name: string\nage: integer")
+    lines = ["Jay 30", "Bob 40", "Ann", "Eve 20"]
+    provider = MagicMock()
+    provider.uncached = provider
+    if engine == "asyncio":
+        provider.transform_text_to_json_async = AsyncMock(
+            side_effect=malformed_answers()
+        )
+
+        async def run():
+            return [
+                result
+                async for result in transform_lines_async(
+                    provider, lines, str(schema), validator=schema, retries=1
+                )
+            ]
+
+        results = asyncio.run(run())
+        calls = provider.transform_text_to_json_async.call_args_list
+    else:
+        provider.transform_text_to_json.side_effect = malformed_answers()
+        results = list(
+            transform_lines(provider, lines, str(schema), validator=schema, retries=1)
+        )
+        calls = provider.transform_text_to_json.call_args_list
+
+    assert [results[i] for i in (0, 1, 3)] == [
+        {"name": "Jay", "age": 30},
+        {"name": "Bob", "age": 40},
+        {"name": "Eve", "age": 20},
+    ]
+    assert isinstance(results[2], InvalidOutput)
+    assert results[2].output == "Ann is old"
+    assert results[2].errors[0].startswith("not valid JSON: ")
+    assert "not valid JSON" in calls[2].args[0]
@@ -0,0 +1,127 @@
+import io
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from jsonthat.streaming import (
+    NDJSON,
+    SSE,
+    StreamError,
+    decode_events,
+    iter_response_chunks,
+)
+
+
+def split(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+SSE_BODY = (
+    b": keep-alive\r\n\r\n"
+    b'event: message_start\r\ndata: {"type": "message_start"}\r\n\r\n'
+    b'data: {"text": "caf\xc3\xa9"}\n\n'
+    b'data: {"text":\ndata: "multi"}\n\n'
+    b"data: not json\n\n"
+    b'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+    b'data: {"text": "after"}\n\n'
+)
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 64, 4096])
+def test_sse_frames_across_chunk_boundaries(size):
+    events = list(decode_events(split(SSE_BODY, size), SSE))
+    assert events == [
+        ("message_start", {"type": "message_start"}),
+        (None, {"text": "café"}),
+        (None, {"text": "multi"}),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+
+
+def test_sse_one_frame_per_read():
+    frames = [
+        b": keep-alive\n\n",
+        b'event: message_start\ndata: {"type": "message_start"}\n\n',
+        b'data:  {"text": "spaced"} \n\n',
+        b'data: {"text": "cut\n\n',
+        b"data: 42\n\n",
+        b'data: {"text": "last"}\n\n',
+    ]
+    assert list(decode_events(frames, SSE)) == [
+        ("message_start", {"type": "message_start"}),
+        (None, {"text": "spaced"}),
+        (None, {"text": "last"}),
+    ]
+
+
+def test_sse_done_and_unterminated_last_frame():
+    body = b'data: {"n": 1}\n\ndata: [DONE]\n\ndata: {"n": 2}\n\n'
+    assert [m for _, m in decode_events([body], SSE)] == [{"n": 1}]
+    # A body cut without the blank line still yields its last frame.
+    assert [m for _, m in decode_events([b'data: {"n": 3}'], SSE)] == [{"n": 3}]
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_ndjson_stops_at_done(size):
+    body = (
+        b'{"response": "a", "done": false}\n'
+        b'{"response": "b", "done": false}\n\n'
+        b'{"response": "", "done": true, "eval_count": 2}\n'
+        b'{"response": "late", "done": false}\n'
+    )
+    messages = [m for _, m in decode_events(split(body, size), NDJSON)]
+    assert [m["response"] for m in messages] == ["a", "b", ""]
+    assert messages[-1]["eval_count"] == 2
+
+
+def test_error_events_raise():
+    body = (
+        b'event: error\ndata: {"type": "error", "error": {"message": "Overloaded"}}\n\n'
+    )
+    with pytest.raises(StreamError, match="Overloaded"):
+        list(decode_events([body], SSE))
+    with pytest.raises(StreamError, match="model not found"):
+        list(decode_events([b'{"error": "model not found"}\n'], NDJSON))
+
+
+def test_iter_response_chunks_reads_what_has_arrived():
+    response = requests.Response()
+    response.raw = io.BytesIO(b"x" * 10)
+    assert list(iter_response_chunks(response, size=4)) == [b"xxxx", b"xxxx", b"xx"]
+
+
+class GzipStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        compressor = zlib.compressobj(wbits=31)
+        for number in range(3):
+            data = compressor.compress(f'data: {{"n": {number}}}\n\n'.encode())
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        data = compressor.flush()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n0\r\n\r\n")
+
+
+def test_iter_response_chunks_decodes_gzip_streams():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GzipStreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = requests.get(f"http://127.0.0.1:{server.server_port}", stream=True)
+        events = list(decode_events(iter_response_chunks(response), SSE))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert events == [(None, {"n": number}) for number in range(3)]
@@ -0,0 +1,102 @@
+import io
+import json
+from datetime import timedelta
+from unittest.mock import patch
+
+from jsonthat.main import ClaudeProvider, OllamaProvider, OpenAIProvider
+from jsonthat.usage import UsageTracker, percentile
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) is None
+
+
+def test_openai_usage_recorded():
+    tracker = UsageTracker()
+    provider = OpenAIProvider("test_key")
+    provider.usage_tracker = tracker
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.elapsed = timedelta(milliseconds=120)
+        mock_post.return_value.json.return_value = {
+            "choices": [{"message": {"content": '{"key": "value"}'}}],
+            "usage": {
+                "prompt_tokens": 50,
+                "completion_tokens": 8,
+                "prompt_tokens_details": {"cached_tokens": 32},
+            },
+        }
+        provider.transform_text_to_json("test text")
+    tracker.add_records()
+
+    summary = tracker.summary()
+    assert summary["requests"] == 1
+    assert summary["records"] == 1
+    assert summary["prompt_tokens"] == 50
+    assert summary["completion_tokens"] == 8
+    assert summary["cached_tokens"] == 32
+    assert summary["time_to_first_byte"]["p50"] == 0.12
+    assert "Tokens: 50 prompt (32 cached), 8 completion" in tracker.format_summary()
+
+
+def sse(events):
+    return io.BytesIO(
+        "".join(
+            f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events
+        ).encode()
+    )
+
+
+def test_claude_stream_usage_recorded():
+    tracker = UsageTracker()
+    provider = ClaudeProvider("test_key")
+    provider.usage_tracker = tracker
+    events = [
+        {
+            "type": "message_start",
+            "message": {
+                "usage": {
+                    "input_tokens": 10,
+                    "cache_read_input_tokens": 90,
+                    "output_tokens": 1,
+                }
+            },
+        },
+        {"type": "content_block_start", "content_block": {"text": ""}},
+        {"type": "content_block_delta", "delta": {"text": '{"key": '}},
+        {"type": "content_block_delta", "delta": {"text": '"value"}'}},
+        {"type": "content_block_stop"},
+        {"type": "message_delta", "usage": {"output_tokens": 7}},
+        {"type": "message_stop"},
+    ]
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.elapsed = timedelta(milliseconds=50)
+        mock_post.return_value.raw = sse(events)
+        chunks = list(provider.transform_text_to_json("test text", stream=True))
+
+    assert json.loads("".join(chunks)) == {"key": "value"}
+    usage = tracker.requests[0]
+    assert usage.prompt_tokens == 100
+    assert usage.cached_tokens == 90
+    assert usage.completion_tokens == 7
+    assert usage.time_to_first_token is not None
+    assert usage.latency >= usage.time_to_first_token
+
+
+def test_ollama_usage_recorded():
+    tracker = UsageTracker()
+    provider = OllamaProvider("http://test.api", "test_model")
+    provider.usage_tracker = tracker
+    with patch("requests.Session.post") as mock_post:
+        mock_post.return_value.elapsed = timedelta(milliseconds=10)
+        mock_post.return_value.json.return_value = {
+            "response": '{"key": "value"}',
+            "prompt_eval_count": 20,
+            "eval_count": 5,
+        }
+        provider.transform_text_to_json("test text")
+    assert tracker.summary()["prompt_tokens"] == 20
+    assert tracker.summary()["completion_tokens"] == 5
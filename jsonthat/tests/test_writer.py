@@ -0,0 +1,118 @@
+import io
+import json
+import threading
+import time
+
+from jsonthat.writer import OutputWriter
+
+
+class Stream(io.StringIO):
+    def __init__(self, tty: bool = False):
+        super().__init__()
+        self.tty = tty
+        self.writes = 0
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        return super().write(text)
+
+
+def test_output_modes():
+    results = [{"name": "Jay"}, {"tags": ["a", "b"]}]
+
+    for mode, expected in [
+        (
+            "pretty",
+            '{\n  "name": "Jay"\n}\n{\n  "tags": [\n    "a",\n    "b"\n  ]\n}\n',
+        ),
+        ("jsonl", '{"name":"Jay"}\n{"tags":["a","b"]}\n'),
+        ("json", '[\n{"name":"Jay"},\n{"tags":["a","b"]}\n]\n'),
+    ]:
+        stream = Stream()
+        writer = OutputWriter(stream, mode)
+        for result in results:
+            writer.write(result)
+        writer.close()
+        assert stream.getvalue() == expected, mode
+
+    stream = Stream()
+    OutputWriter(stream, "json").close()
+    assert json.loads(stream.getvalue()) == []
+
+
+def test_line_numbers():
+    stream = Stream()
+    writer = OutputWriter(stream, "jsonl", line_numbers=True)
+    writer.write({"a": 1}, ("-", 3))
+    writer.write({"a": 2}, ("logs.txt", 7))
+    writer.close()
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [
+        {"line": 3, "output": {"a": 1}},
+        {"line": 7, "input": "logs.txt", "output": {"a": 2}},
+    ]
+
+
+def test_buffered_flush_policy():
+    stream = Stream()
+    writer = OutputWriter(stream, "jsonl", flush_interval=0.05, flush_size=100)
+    for index in range(5):
+        writer.write({"index": index})
+    assert stream.writes == 0
+
+    # Flushed by size once the buffer holds more than 100 characters.
+    for index in range(10):
+        writer.write({"index": index})
+    assert stream.writes == 1
+
+    # Flushed in the background once data has waited for the interval.
+    writer.write({"index": 10})
+    deadline = time.monotonic() + 2
+    while stream.getvalue().count("\n") < 16 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stream.getvalue().count("\n") == 16
+    writer.close()
+
+
+def test_interactive_output_is_not_delayed():
+    stream = Stream(tty=True)
+    writer = OutputWriter(stream, "pretty")
+    writer.write_text("token")
+    assert stream.getvalue() == "token"
+
+
+class BlockedStream(Stream):
+    # A pipe into a reader that has stopped reading.
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text: str) -> int:
+        self.entered.set()
+        self.release.wait(5)
+        return super().write(text)
+
+
+def test_blocked_stream_does_not_block_writers():
+    stream = BlockedStream()
+    written = []
+    writer = OutputWriter(stream, "jsonl", flush_interval=0.01, flush_size=10_000)
+    writer.write({"index": 0}, on_written=lambda: written.append(0))
+    assert stream.entered.wait(2)
+
+    # The background flush is stuck in the stream, but writes still go
+    # through, and no record counts as written before it is.
+    start = time.monotonic()
+    for index in range(1, 10):
+        writer.write({"index": index}, on_written=lambda i=index: written.append(i))
+    assert time.monotonic() - start < 1
+    assert written == []
+
+    stream.release.set()
+    writer.close()
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["index"] for line in lines] == list(range(10))
+    assert written == list(range(10))